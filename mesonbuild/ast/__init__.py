@@ -22,12 +22,15 @@ __all__ = [
     'AstIndentationGenerator',
     'AstVisitor',
     'AstPrinter',
+    'DependencyCollector',
     'IntrospectionInterpreter',
+    'SubprojectScanner',
     'build_target_functions',
+    'top_level_subproject_calls',
 ]
 
 from .interpreter import AstInterpreter
-from .introspection import IntrospectionInterpreter, build_target_functions
+from .introspection import DependencyCollector, IntrospectionInterpreter, SubprojectScanner, build_target_functions, top_level_subproject_calls
 from .visitor import AstVisitor
 from .postprocess import AstConditionLevel, AstIDGenerator, AstIndentationGenerator
 from .printer import AstPrinter
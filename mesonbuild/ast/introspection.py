@@ -16,11 +16,12 @@
 # or an interpreter-based tool
 
 from . import AstInterpreter
-from .. import compilers, environment, mesonlib, optinterpreter
+from .visitor import AstVisitor
+from .. import compilers, environment, mesonlib, mparser, optinterpreter
 from .. import coredata as cdata
 from ..interpreterbase import InvalidArguments
 from ..build import Executable, Jar, SharedLibrary, SharedModule, StaticLibrary
-from ..mparser import ArithmeticNode, ArrayNode, ElementaryNode, IdNode, FunctionNode, StringNode
+from ..mparser import ArithmeticNode, ArrayNode, AssignmentNode, ElementaryNode, IdNode, FunctionNode, StringNode
 import os
 
 build_target_functions = ['executable', 'jar', 'library', 'shared_library', 'shared_module', 'static_library', 'both_libraries']
@@ -268,3 +269,150 @@ class IntrospectionInterpreter(AstInterpreter):
         self.sanity_check_ast()
         self.parse_project()
         self.run()
+
+def literal_value(node):
+    if isinstance(node, (str, bool, int)):
+        return node
+    if isinstance(node, ElementaryNode) and not isinstance(node, IdNode):
+        return node.value
+    if isinstance(node, ArrayNode):
+        return [literal_value(i) for i in node.args.arguments]
+    raise ValueError('Not a literal')
+
+class FunctionCallFinder(AstVisitor):
+    def __init__(self, names):
+        self.names = names
+        self.found = False
+
+    def visit_FunctionNode(self, node):
+        super().visit_FunctionNode(node)
+        if node.func_name in self.names:
+            self.found = True
+
+def top_level_subproject_calls(ast):
+    '''
+    Returns the name and keyword arguments of the subproject() calls done
+    unconditionally by a build file whose arguments are all literals.
+    '''
+    calls = []
+    for node in ast.lines:
+        # Nothing after a possible subdir_done() is sure to run
+        finder = FunctionCallFinder({'subdir_done'})
+        node.accept(finder)
+        if finder.found:
+            break
+        if isinstance(node, AssignmentNode):
+            node = node.value
+        if not isinstance(node, FunctionNode) or node.func_name != 'subproject':
+            continue
+        try:
+            args = [literal_value(i) for i in node.args.arguments]
+            kwargs = {k: literal_value(v) for k, v in node.args.kwargs.items()}
+        except ValueError:
+            continue
+        if len(args) == 1 and isinstance(args[0], str):
+            calls.append((args[0], kwargs))
+    return calls
+
+class SubprojectScanner(AstVisitor):
+    # Checks whether a subproject can be configured at the same time as the
+    # other subprojects of the main project: it must not configure other
+    # subprojects, or add languages or program overrides that subprojects
+    # configured after it would see, and all its build files must be known.
+    def __init__(self, source_root, subdir):
+        self.source_root = source_root
+        self.subdir = subdir
+        self.current_subdir = subdir
+        self.pending = []
+        self.languages = []
+        self.independent = True
+
+    def scan(self):
+        self.pending.append(self.subdir)
+        while self.pending and self.independent:
+            self.current_subdir = self.pending.pop(0)
+            fname = os.path.join(self.source_root, self.current_subdir, environment.build_filename)
+            try:
+                with open(fname, encoding='utf8') as f:
+                    code = f.read()
+                ast = mparser.Parser(code, self.current_subdir).parse()
+            except (OSError, UnicodeDecodeError, mesonlib.MesonException):
+                self.independent = False
+                break
+            ast.accept(self)
+        return self.independent
+
+    def visit_FunctionNode(self, node):
+        super().visit_FunctionNode(node)
+        name = node.func_name
+        args = node.args.arguments
+        if name in ('subproject', 'add_languages'):
+            self.independent = False
+        elif name == 'dependency' and 'fallback' in node.args.kwargs:
+            self.independent = False
+        elif name == 'project':
+            try:
+                languages = mesonlib.listify([literal_value(i) for i in args[1:]])
+            except ValueError:
+                self.independent = False
+                return
+            self.languages += [str(lang).lower() for lang in languages]
+        elif name == 'subdir':
+            if len(args) == 1 and isinstance(args[0], StringNode):
+                self.pending.append(os.path.join(self.current_subdir, args[0].value))
+            else:
+                self.independent = False
+
+    def visit_MethodNode(self, node):
+        super().visit_MethodNode(node)
+        if node.name == 'override_find_program':
+            self.independent = False
+
+class DependencyCollector(AstInterpreter):
+    # Collects the dependency() and subproject() calls whose arguments are
+    # all literals, so that they can be looked up before the build files are
+    # interpreted
+    def __init__(self, source_root, subdir=''):
+        super().__init__(source_root, subdir)
+        self.dependencies = []
+        self.subprojects = []
+        self.funcs.update({
+            'dependency': self.func_dependency,
+            'subdir': self.func_subdir,
+            'subproject': self.func_subproject,
+        })
+
+    def literal(self, node):
+        return literal_value(node)
+
+    def func_subdir(self, node, args, kwargs):
+        args = self.flatten_args(args)
+        # Silently skip what we cannot evaluate, the real interpreter will
+        # look up anything we miss
+        if len(args) != 1 or not isinstance(args[0], str):
+            return
+        return super().func_subdir(node, args, kwargs)
+
+    def func_dependency(self, node, args, kwargs):
+        try:
+            args = [self.literal(i) for i in args]
+            kwargs = {k: self.literal(v) for k, v in kwargs.items()}
+        except ValueError:
+            return
+        if len(args) != 1 or not isinstance(args[0], str):
+            return
+        self.dependencies.append((args[0], kwargs))
+
+    def func_subproject(self, node, args, kwargs):
+        try:
+            args = [self.literal(i) for i in args]
+        except ValueError:
+            return
+        if len(args) == 1 and isinstance(args[0], str):
+            self.subprojects.append(args[0])
+
+    def analyze(self):
+        self.load_root_meson_file()
+        self.sanity_check_ast()
+        self.run()
+        return self.dependencies
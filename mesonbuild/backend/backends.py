@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import os, pickle, re
+import os, pickle, re, glob, math, hashlib
 import textwrap
 from .. import build
 from .. import dependencies
@@ -146,6 +146,58 @@ def get_backend_from_name(backend, build):
         return xcodebackend.XCodeBackend(build)
     return None
 
+include_re = re.compile(r'#\s*include\s*([<"])([^>"]+)[>"]')
+
+def scan_include_preamble(fname):
+    '''
+    Returns the headers that @fname includes with angle brackets before
+    anything other than comments and #include lines, and before the first
+    header it includes with quotes. Returns None if the file starts with
+    another directive or with a quoted #include, such as a #define or a
+    config.h that could change what those headers declare, or if it cannot
+    be read.
+    '''
+    headers = []
+    seen_include = False
+    in_comment = False
+    try:
+        f = open(fname, encoding='utf-8', errors='replace')
+    except OSError:
+        return None
+    with f:
+        for line in f:
+            if in_comment:
+                if '*/' not in line:
+                    continue
+                line = line.split('*/', 1)[1]
+                in_comment = False
+            line = re.sub(r'/\*.*?\*/', ' ', line)
+            if '/*' in line:
+                line = line.split('/*', 1)[0]
+                in_comment = True
+            line = line.split('//', 1)[0].strip()
+            if not line:
+                continue
+            m = include_re.match(line)
+            if not m:
+                if line.startswith('#') and not seen_include:
+                    return None
+                break
+            seen_include = True
+            if m.group(1) == '"':
+                # The headers after it could depend on what it defines
+                if not headers:
+                    return None
+                break
+            headers.append(m.group(2))
+    return headers
+
+# With unity_balance set to 'size' or 'time', unity_size counts sources of
+# this many bytes or that took this many seconds to compile. The units are
+# fixed so that chunk boundaries do not depend on the other sources.
+unity_size_unit = 4096
+unity_time_unit = 0.5
+
 # This class contains the basic functionality that is needed by all backends.
 # Feel free to move stuff in and out of it as you see fit.
 class Backend:
@@ -161,6 +213,12 @@ class Backend:
         self.source_dir = self.environment.get_source_dir()
         self.build_to_src = mesonlib.relpath(self.environment.get_source_dir(),
                                              self.environment.get_build_dir())
+        # Compile times from .ninja_log, read when unity files need them
+        self.ninja_log_durations = None
+        # Unity files of each target and language, for extracting objects
+        self.unity_chunk_files = {}
+        # Generated precompiled headers of each target and language
+        self.auto_pch = {}
 
     def get_target_filename(self, t):
         if isinstance(t, build.CustomTarget):
@@ -264,13 +322,131 @@ class Backend:
         osrc = target.name + '-unity.' + suffix
         return mesonlib.File.from_built_file(self.get_target_private_dir(target), osrc)
 
+    def get_unity_chunk_file(self, target, suffix, first_src):
+        # Chunks are named after their first source, so that they keep their
+        # name and object file when chunks before them are added or removed.
+        rel_src = os.path.relpath(first_src, self.environment.get_source_dir())
+        digest = hashlib.sha1(rel_src.encode('utf-8')).hexdigest()[:8]
+        osrc = '{}-unity-{}.{}'.format(target.name, digest, suffix)
+        return mesonlib.File.from_built_file(self.get_target_private_dir(target), osrc)
+
+    def get_unity_source_weights(self, target, srcs, suffix, balance):
+        '''
+        Returns how expensive each of @srcs is estimated to be to compile, in
+        units of unity_size_unit or unity_time_unit. With 'size' that is the
+        size of the file. With 'time' it is how long compiling it took
+        according to the .ninja_log of the build directory, either on its own
+        or as its share by size of a unity file. Sources that have no
+        recorded time are estimated from their size.
+        '''
+        sizes = []
+        for src in srcs:
+            try:
+                sizes.append(max(os.path.getsize(src), 1) / unity_size_unit)
+            except OSError:
+                sizes.append(1 / unity_size_unit)
+        if balance != 'time':
+            return sizes
+        if self.ninja_log_durations is None:
+            from ..manalyze import read_output_durations
+            self.ninja_log_durations = read_output_durations(
+                os.path.join(self.environment.get_build_dir(), '.ninja_log'))
+        durations = self.ninja_log_durations
+        private_dir = self.get_target_private_dir(target)
+        src_sizes = dict(zip(srcs, sizes))
+        times = {}
+        # Sources that were compiled on their own
+        for src in srcs:
+            obj = self.object_filename_from_source(target, self.get_unity_src_file(src))
+            if os.path.join(private_dir, obj) in durations:
+                times[src] = durations[os.path.join(private_dir, obj)]
+        # Sources that were part of an earlier unity file
+        pattern = os.path.join(self.environment.get_build_dir(), private_dir,
+                               glob.escape(target.name) + '-unity*.' + suffix)
+        for unity_file in glob.glob(pattern):
+            unity_src = mesonlib.File.from_built_file(private_dir, os.path.basename(unity_file))
+            obj = os.path.join(private_dir, self.object_filename_from_source(target, unity_src))
+            if obj not in durations:
+                continue
+            with open(unity_file, encoding='utf-8', errors='replace') as f:
+                members = [os.path.normpath(l[len('#include<'):-1]) for l in f.read().splitlines()
+                           if l.startswith('#include<') and l.endswith('>')]
+            total = sum(src_sizes.get(m, 0) for m in members)
+            for m in members:
+                if m in src_sizes and m not in times:
+                    times[m] = durations[obj] * src_sizes[m] / total
+        if not times:
+            return sizes
+        times = {src: time / unity_time_unit for src, time in times.items()}
+        per_size = sum(times.values()) / sum(src_sizes[s] for s in times)
+        return [times.get(src, size * per_size) for src, size in zip(srcs, sizes)]
+
+    def get_unity_src_path(self, src):
+        if isinstance(src, mesonlib.File):
+            src = src.absolute_path(self.environment.get_source_dir(),
+                                    self.environment.get_build_dir())
+        return os.path.normpath(src)
+
+    def get_unity_src_file(self, src):
+        build_dir = self.environment.get_build_dir()
+        source_dir = self.environment.get_source_dir()
+        # Check the build directory first, it is often inside the source tree
+        for root, is_built in ((build_dir, True), (source_dir, False)):
+            if src.startswith(root + os.sep):
+                rel = os.path.relpath(src, root)
+                return mesonlib.File(is_built, os.path.dirname(rel), os.path.basename(rel))
+        return mesonlib.File.from_absolute_file(src)
+
+    def split_unity_sources(self, target, srcs, suffix):
+        '''
+        Splits @srcs into chunks of about unity_size sources, or of about
+        unity_size units of work with unity_balance set to 'size' or 'time'.
+        Whether a chunk ends after a source only depends on that source, its
+        weight and how much the chunk already holds, so adding or removing a
+        source only changes the chunk it is in and rarely the one after it,
+        instead of moving every later source.
+        '''
+        unity_size = self.environment.coredata.get_builtin_option('unity_size')
+        if unity_size == 0 or len(srcs) <= unity_size:
+            return [srcs]
+        paths = [self.get_unity_src_path(src) for src in srcs]
+        balance = self.environment.coredata.get_builtin_option('unity_balance')
+        target_weight = unity_size
+        if balance == 'count':
+            weights = [1] * len(srcs)
+        else:
+            # Weights are rounded to powers of two so that small changes in
+            # file size or compile time do not move chunk boundaries.
+            weights = [2 ** round(math.log2(w)) if w > 0 else 0
+                       for w in self.get_unity_source_weights(target, paths, suffix, balance)]
+        chunks = [[]]
+        chunk_weight = 0
+        source_dir = self.environment.get_source_dir()
+        for src, path, weight in zip(srcs, paths, weights):
+            chunks[-1].append(src)
+            chunk_weight += weight
+            rel_src = os.path.relpath(path, source_dir)
+            digest = hashlib.sha1(rel_src.encode('utf-8')).digest()
+            draw = int.from_bytes(digest[:4], 'big') / 2 ** 32
+            # Once a chunk holds half of target_weight, it ends after each
+            # source with a chance that grows with the weight of the source,
+            # so that chunks hold target_weight on average and never more
+            # than twice that.
+            if (chunk_weight * 2 >= target_weight and
+                    draw * (target_weight / 2 + weight) < weight) or \
+                    chunk_weight >= 2 * target_weight:
+                chunks.append([])
+                chunk_weight = 0
+        if not chunks[-1]:
+            chunks.pop()
+        return chunks
+
     def generate_unity_files(self, target, unity_src):
         abs_files = []
         result = []
         compsrcs = classify_unity_sources(target.compilers.values(), unity_src)
 
-        def init_language_file(suffix):
-            unity_src = self.get_unity_source_file(target, suffix)
+        def init_language_file(unity_src):
             outfileabs = unity_src.absolute_path(self.environment.get_source_dir(),
                                                  self.environment.get_build_dir())
             outfileabs_tmp = outfileabs + '.tmp'
@@ -281,11 +457,29 @@ class Backend:
             result.append(unity_src)
             return open(outfileabs_tmp, 'w')
 
-        # For each language, generate a unity source file and return the list
+        # For each language, generate unity source files and return the list
         for comp, srcs in compsrcs.items():
-            with init_language_file(comp.get_default_suffix()) as ofile:
-                for src in srcs:
-                    ofile.write('#include<%s>\n' % src)
+            suffix = comp.get_default_suffix()
+            chunks = self.split_unity_sources(target, srcs, suffix)
+            unity_files = []
+            for chunk in chunks:
+                if len(chunks) == 1:
+                    unity_file = self.get_unity_source_file(target, suffix)
+                else:
+                    unity_file = self.get_unity_chunk_file(target, suffix,
+                                                           self.get_unity_src_path(chunk[0]))
+                unity_files.append(unity_file)
+                with init_language_file(unity_file) as ofile:
+                    for src in chunk:
+                        ofile.write('#include<%s>\n' % src)
+            # Remove chunks left over from an earlier split
+            pattern = os.path.join(self.environment.get_build_dir(),
+                                   self.get_target_private_dir(target),
+                                   glob.escape(target.name) + '-unity-*.' + suffix)
+            for stale in glob.glob(pattern):
+                if stale not in abs_files:
+                    os.remove(stale)
+            self.unity_chunk_files[(target.get_id(), suffix)] = unity_files
         [mesonlib.replace_if_different(x, x + '.tmp') for x in abs_files]
         return result
 
@@ -489,16 +683,25 @@ class Backend:
 
         targetdir = self.get_target_private_dir(extobj.target)
 
-        # With unity builds, there's just one object that contains all the
-        # sources, and we only support extracting all the objects in this mode,
-        # so just return that.
+        # With unity builds, there's just one object per unity file that
+        # contains their sources, and we only support extracting all the
+        # objects in this mode, so just return those.
         if self.is_unity(extobj.target):
             compsrcs = classify_unity_sources(extobj.target.compilers.values(), sources)
             sources = []
-            for comp in compsrcs.keys():
-                osrc = self.get_unity_source_file(extobj.target,
-                                                  comp.get_default_suffix())
-                sources.append(osrc)
+            for comp, srcs in compsrcs.items():
+                suffix = comp.get_default_suffix()
+                key = (extobj.target.get_id(), suffix)
+                if key in self.unity_chunk_files:
+                    sources += self.unity_chunk_files[key]
+                    continue
+                chunks = self.split_unity_sources(extobj.target, srcs, suffix)
+                if len(chunks) == 1:
+                    sources.append(self.get_unity_source_file(extobj.target, suffix))
+                    continue
+                for chunk in chunks:
+                    sources.append(self.get_unity_chunk_file(extobj.target, suffix,
+                                                             self.get_unity_src_path(chunk[0])))
 
         for osrc in sources:
             objname = self.object_filename_from_source(extobj.target, osrc)
@@ -507,11 +710,65 @@ class Backend:
 
         return result
 
+    def get_target_pch(self, target, lang):
+        return target.get_pch(lang) or self.auto_pch.get(target.get_id(), {}).get(lang, [])
+
+    def target_has_pch(self, target):
+        return target.has_pch() or target.get_id() in self.auto_pch
+
+    def is_auto_pch(self, target, lang):
+        return not target.get_pch(lang) and lang in self.auto_pch.get(target.get_id(), {})
+
+    def generate_auto_pch(self, target):
+        '''
+        With b_pch_auto, writes a precompiled header for the C and for the
+        C++ sources of @target unless they have one, with the system headers
+        that at least half of those sources include at their start. The header is
+        left out when a source starts with another directive or a quoted
+        #include, because the precompiled header is included before anything
+        in the source.
+        '''
+        if not self.environment.coredata.base_options.get('b_pch_auto', False):
+            return
+        for lang in ('c', 'cpp'):
+            compiler = target.compilers.get(lang)
+            if compiler is None or target.get_pch(lang):
+                continue
+            srcs = [s for s in target.sources if isinstance(s, File) and
+                    compiler.can_compile(s) and
+                    not self.environment.is_header(s) and
+                    not self.environment.is_assembly(s)]
+            counts = OrderedDict()
+            for src in srcs:
+                headers = scan_include_preamble(src.absolute_path(self.environment.get_source_dir(),
+                                                                  self.environment.get_build_dir()))
+                if headers is None:
+                    mlog.debug('Not precompiling headers of {!r}: {} does not start with '
+                               'a system #include'.format(target.name, src))
+                    counts = None
+                    break
+                for header in OrderedSet(headers):
+                    counts[header] = counts.get(header, 0) + 1
+            if not counts:
+                continue
+            headers = [h for h, n in counts.items() if n >= 2 and n * 2 >= len(srcs)]
+            if not headers:
+                continue
+            pch_name = 'meson_auto_pch-%s.h' % lang
+            pch_file = os.path.join(self.build_dir, self.get_target_private_dir(target), pch_name)
+            os.makedirs(os.path.dirname(pch_file), exist_ok=True)
+            pch_file_tmp = pch_file + '.tmp'
+            with open(pch_file_tmp, 'w') as f:
+                for header in headers:
+                    f.write('#include <%s>\n' % header)
+            mesonlib.replace_if_different(pch_file, pch_file_tmp)
+            self.auto_pch.setdefault(target.get_id(), {})[lang] = [pch_name]
+
     def get_pch_include_args(self, compiler, target):
         args = []
         pchpath = self.get_target_private_dir(target)
         includeargs = compiler.get_include_args(pchpath, False)
-        p = target.get_pch(compiler.get_language())
+        p = self.get_target_pch(target, compiler.get_language())
         if p:
             args += compiler.get_pch_use_args(pchpath, p[0])
         return includeargs + args
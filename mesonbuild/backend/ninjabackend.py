@@ -27,6 +27,7 @@ from .. import modules
 from .. import environment, mesonlib
 from .. import build
 from .. import mlog
+from .. import mtrace
 from .. import dependencies
 from .. import compilers
 from ..compilers import CompilerArgs, CCompiler, VisualStudioCCompiler, FortranCompiler
@@ -45,6 +46,12 @@ else:
     execute_wrapper = ''
     rmfile_prefix = 'rm -f {} &&'
 
+# Whether double quotes in arguments must be escaped for quote_func()
+quote_func_escapes_quotes = quote_func('') == '""'
+
+# All the entries of build elements that should remain unquoted
+raw_names = {'DEPFILE', 'DESC', 'pool', 'description'}
+
 def ninja_quote(text, is_build_line=False):
     if is_build_line:
         qcs = ('$', ' ', ':')
@@ -114,23 +121,18 @@ class NinjaBuildElement:
         line = line.replace('\\', '/')
         outfile.write(line)
 
-        # All the entries that should remain unquoted
-        raw_names = {'DEPFILE', 'DESC', 'pool', 'description'}
-
         for e in self.elems:
             (name, elems) = e
             should_quote = name not in raw_names
             line = ' %s = ' % name
             newelems = []
             for i in elems:
-                if not should_quote or i == '&&': # Hackety hack hack
-                    quoter = ninja_quote
-                else:
-                    quoter = lambda x: ninja_quote(quote_func(x))
                 i = i.replace('\\', '\\\\')
-                if quote_func('') == '""':
+                if quote_func_escapes_quotes:
                     i = i.replace('"', '\\"')
-                newelems.append(quoter(i))
+                if should_quote and i != '&&': # Hackety hack hack
+                    i = quote_func(i)
+                newelems.append(ninja_quote(i))
             line += ' '.join(newelems)
             line += '\n'
             outfile.write(line)
@@ -151,6 +153,13 @@ class NinjaBackend(backends.Backend):
         self.fortran_deps = {}
         self.all_outputs = {}
         self.introspection_data = {}
+        # Lower-cased names of the files in each library search directory
+        self.library_dir_listings = {}
+        # (search dirs, library name, patterns) -> real path of the library
+        self.library_path_cache = {}
+        # Probe for ninja before the coredata is written out, so that the
+        # result is stored in its program cache for the next reconfigure
+        environment.detect_ninja()
 
     def create_target_alias(self, to_target, outfile):
         # We need to use aliases for targets that might be used as directory
@@ -223,11 +232,14 @@ int dummy;
             self.generate_phony(outfile)
             outfile.write('# Build rules for targets\n\n')
             for t in self.build.get_targets().values():
-                self.generate_target(t, outfile)
+                with mtrace.span(t.get_id(), 'target', {'type': type(t).__name__}):
+                    self.generate_target(t, outfile)
             outfile.write('# Test rules\n\n')
-            self.generate_tests(outfile)
+            with mtrace.span('tests', 'backend'):
+                self.generate_tests(outfile)
             outfile.write('# Install rules\n\n')
-            self.generate_install(outfile)
+            with mtrace.span('install', 'backend'):
+                self.generate_install(outfile)
             self.generate_dist(outfile)
             if 'b_coverage' in self.environment.coredata.base_options and \
                     self.environment.coredata.base_options['b_coverage'].value:
@@ -239,7 +251,8 @@ int dummy;
         # Only overwrite the old build file after the new one has been
         # fully created.
         os.replace(tempfilename, outfilename)
-        self.generate_compdb()
+        with mtrace.span('compile_commands.json', 'backend'):
+            self.generate_compdb()
 
     # http://clang.llvm.org/docs/JSONCompilationDatabase.html
     def generate_compdb(self):
@@ -428,6 +441,9 @@ int dummy;
         unity_src = []
         unity_deps = [] # Generated sources that must be built before compiling a Unity target.
         header_deps += self.get_generated_headers(target)
+        use_pch = self.environment.coredata.base_options.get('b_pch', False)
+        if use_pch:
+            self.generate_auto_pch(target)
 
         if is_unity:
             # Warn about incompatible sources if a unity build is enabled
@@ -476,8 +492,7 @@ int dummy;
                                                  header_deps=header_deps)
             obj_list.append(o)
 
-        use_pch = self.environment.coredata.base_options.get('b_pch', False)
-        if use_pch and target.has_pch():
+        if use_pch and self.target_has_pch(target):
             pch_objects = self.generate_pch(target, outfile, header_deps=header_deps)
         else:
             pch_objects = []
@@ -594,6 +609,7 @@ int dummy;
                                                              extra_bdeps, is_cross)
             if extra_paths:
                 serialize = True
+        exe_data = None
         if serialize:
             exe_data = self.serialize_executable(target.name, target.command[0], cmd[1:],
                                                  # All targets are built from the build dir
@@ -613,11 +629,28 @@ int dummy;
         if target.console:
             elem.add_item('pool', 'console')
         cmd = self.replace_paths(target, cmd)
+        if self.environment.coredata.get_builtin_option('cache_custom_targets') and \
+                not (target.build_always_stale or target.depfile or target.console):
+            cmd = self.get_cached_custom_target_command(elem, exe_data, cmd)
         elem.add_item('COMMAND', cmd)
         elem.add_item('description', desc.format(target.name, cmd_type))
         elem.write(outfile)
         self.processed_targets[target.get_id()] = True
 
+    def get_cached_custom_target_command(self, elem, exe_data, cmd):
+        # Everything that ninja knows the command reads is part of the key,
+        # the files named on its command line are added when it runs.
+        inputs = list(elem.infilenames) + list(elem.deps) + list(elem.orderdeps)
+        if exe_data:
+            inputs.append(exe_data)
+        cached_cmd = self.environment.get_build_command() + ['--internal', 'cachedcompile', '--custom']
+        for i in inputs:
+            cached_cmd += ['--input', i]
+        for o in elem.outfilenames:
+            cached_cmd += ['--output', o]
+        cached_cmd += ['--max-size', str(self.environment.coredata.get_builtin_option('compile_cache_size'))]
+        return cached_cmd + ['--'] + cmd
+
     def generate_run_target(self, target, outfile):
         cmd = self.environment.get_build_command() + ['--internal', 'commandrunner']
         deps = self.unwrap_dep_list(target)
@@ -1646,8 +1679,17 @@ rule FORTRAN_DEP_HACK%s
 '''
         else:
             command_template = ' command = {executable} $ARGS {dep_args} {output_args} {compile_only_args} $in\n'
+        executable = [ninja_quote(i) for i in compiler.get_exelist()]
+        if self.environment.coredata.get_builtin_option('compile_cache') and \
+                compiler.get_argument_syntax() == 'gcc':
+            executable = [ninja_quote(i) for i in self.environment.get_build_command()] + [
+                '--internal', 'cachedcompile',
+                '--depfile', '$DEPFILE',
+                '--output', '$out',
+                '--max-size', str(self.environment.coredata.get_builtin_option('compile_cache_size')),
+                '--'] + executable
         command = command_template.format(
-            executable=' '.join([ninja_quote(i) for i in compiler.get_exelist()]),
+            executable=' '.join(executable),
             dep_args=' '.join(quoted_depargs),
             output_args=' '.join(compiler.get_output_args('$out')),
             compile_only_args=' '.join(compiler.get_compile_only_args())
@@ -1747,31 +1789,43 @@ rule FORTRAN_DEP_HACK%s
         infilelist = genlist.get_inputs()
         outfilelist = genlist.get_outputs()
         extra_dependencies = [os.path.join(self.build_to_src, i) for i in genlist.extra_depends]
+        private_dir = self.get_target_private_dir(target)
+        if subdir:
+            source_target_dir = os.path.join(self.build_to_src, subdir)
+        else:
+            source_target_dir = self.get_target_source_dir(target)
+        # The values that are the same for every input, see replace_paths()
+        target_values = {'@SOURCE_DIR@': self.build_to_src,
+                         '@BUILD_DIR@': private_dir,
+                         '@CURRENT_SOURCE_DIR@': source_target_dir,
+                         '@SOURCE_ROOT@': self.build_to_src,
+                         '@BUILD_ROOT@': '.'}
         for i in range(len(infilelist)):
             curfile = infilelist[i]
             if len(generator.outputs) == 1:
-                sole_output = os.path.join(self.get_target_private_dir(target), outfilelist[i])
+                sole_output = os.path.join(private_dir, outfilelist[i])
             else:
                 sole_output = '{}'.format(curfile)
             infilename = curfile.rel_to_builddir(self.build_to_src)
-            base_args = generator.get_arglist(infilename)
+            plainname = os.path.basename(infilename)
             outfiles = genlist.get_outputs_for(curfile)
-            outfiles = [os.path.join(self.get_target_private_dir(target), of) for of in outfiles]
+            outfiles = [os.path.join(private_dir, of) for of in outfiles]
+            values = target_values.copy()
+            values['@PLAINNAME@'] = plainname
+            values['@BASENAME@'] = os.path.splitext(plainname)[0]
+            values['@INPUT@'] = infilename
+            values['@OUTPUT@'] = sole_output
+            for (ii, of) in enumerate(outfiles):
+                values['@OUTPUT{}@'.format(ii)] = of
             if generator.depfile is None:
                 rulename = 'CUSTOM_COMMAND'
-                args = base_args
             else:
                 rulename = 'CUSTOM_COMMAND_DEP'
                 depfilename = generator.get_dep_outname(infilename)
-                depfile = os.path.join(self.get_target_private_dir(target), depfilename)
-                args = [x.replace('@DEPFILE@', depfile) for x in base_args]
-            args = [x.replace("@INPUT@", infilename).replace('@OUTPUT@', sole_output)
-                    for x in args]
-            args = self.replace_outputs(args, self.get_target_private_dir(target), outfilelist)
-            # We have consumed output files, so drop them from the list of remaining outputs.
-            if len(generator.outputs) > 1:
-                outfilelist = outfilelist[len(generator.outputs):]
-            args = self.replace_paths(target, args, override_subdir=subdir)
+                depfile = os.path.join(private_dir, depfilename)
+                values['@DEPFILE@'] = depfile
+            args = generator.arglist_template.substitute(values)
+            args = [x.replace('\\', '/') for x in args]
             cmdlist = exe_arr + self.replace_extra_args(args, genlist)
             if generator.capture:
                 exe_data = self.serialize_executable(
@@ -1966,7 +2020,7 @@ rule FORTRAN_DEP_HACK%s
         # If you feel that the above is completely wrong and all of
         # this is actually doable, please send patches.
 
-        if target.has_pch():
+        if self.target_has_pch(target):
             tfilename = self.get_target_filename_abs(target)
             return compiler.get_compile_debugfile_args(tfilename, pch=True)
         else:
@@ -2168,7 +2222,7 @@ rule FORTRAN_DEP_HACK%s
         # PCH handling
         if self.environment.coredata.base_options.get('b_pch', False):
             commands += self.get_pch_include_args(compiler, target)
-            pchlist = target.get_pch(compiler.language)
+            pchlist = self.get_target_pch(target, compiler.language)
         else:
             pchlist = []
         if not pchlist:
@@ -2251,7 +2305,7 @@ rule FORTRAN_DEP_HACK%s
             return []
         return [os.path.join(self.get_target_dir(lt), lt.get_filename()) for lt in target.link_targets]
 
-    def generate_msvc_pch_command(self, target, compiler, pch):
+    def generate_msvc_pch_command(self, target, compiler, pch, header_path):
         header = pch[0]
         pchname = compiler.get_pch_name(header)
         dst = os.path.join(self.get_target_private_dir(target), pchname)
@@ -2262,8 +2316,7 @@ rule FORTRAN_DEP_HACK%s
         if len(pch) == 1:
             # Auto generate PCH.
             source = self.create_msvc_pch_implementation(target, compiler.get_language(), pch[0])
-            pch_header_dir = os.path.dirname(os.path.join(self.build_to_src, target.get_source_subdir(), header))
-            commands += compiler.get_include_args(pch_header_dir, False)
+            commands += compiler.get_include_args(os.path.dirname(header_path), False)
         else:
             source = os.path.join(self.build_to_src, target.get_source_subdir(), pch[1])
 
@@ -2292,23 +2345,27 @@ rule FORTRAN_DEP_HACK%s
         if target.is_cross:
             cstr = '_CROSS'
         for lang in ['c', 'cpp']:
-            pch = target.get_pch(lang)
+            pch = self.get_target_pch(target, lang)
             if not pch:
                 continue
-            if not has_path_sep(pch[0]) or not has_path_sep(pch[-1]):
+            if self.is_auto_pch(target, lang):
+                header = os.path.join(self.get_target_private_dir(target), pch[0])
+            elif not has_path_sep(pch[0]) or not has_path_sep(pch[-1]):
                 msg = 'Precompiled header of {!r} must not be in the same ' \
                       'directory as source, please put it in a subdirectory.' \
                       ''.format(target.get_basename())
                 raise InvalidArguments(msg)
+            else:
+                header = os.path.join(self.build_to_src, target.get_source_subdir(), pch[0])
             compiler = target.compilers[lang]
             if isinstance(compiler, VisualStudioCCompiler):
-                (commands, dep, dst, objs, src) = self.generate_msvc_pch_command(target, compiler, pch)
-                extradep = os.path.join(self.build_to_src, target.get_source_subdir(), pch[0])
+                (commands, dep, dst, objs, src) = self.generate_msvc_pch_command(target, compiler, pch, header)
+                extradep = header
             elif compiler.id == 'intel':
                 # Intel generates on target generation
                 continue
             else:
-                src = os.path.join(self.build_to_src, target.get_source_subdir(), pch[0])
+                src = header
                 (commands, dep, dst, objs) = self.generate_gcc_pch_command(target, compiler, pch[0])
                 extradep = None
             pch_objects += objs
@@ -2389,10 +2446,38 @@ rule FORTRAN_DEP_HACK%s
         target_args = self.build_target_link_arguments(linker, target.link_whole_targets)
         return linker.get_link_whole_for(target_args) if len(target_args) else []
 
-    @lru_cache(maxsize=None)
+    def list_library_dir(self, directory):
+        '''
+        Returns the lower-cased names of the files in @directory, listing it
+        only once for all link targets. Names are compared lower-cased so
+        that case-insensitive file systems are handled; a match is then
+        confirmed by looking for the file itself. Returns None if the
+        directory exists but cannot be listed, its files can still be found
+        by looking for each of them.
+        '''
+        if directory not in self.library_dir_listings:
+            try:
+                with os.scandir(directory) as it:
+                    listing = frozenset(e.name.lower() for e in it)
+            except (FileNotFoundError, NotADirectoryError):
+                listing = frozenset()
+            except OSError:
+                listing = None
+            self.library_dir_listings[directory] = listing
+        return self.library_dir_listings[directory]
+
     def guess_library_absolute_path(self, linker, libname, search_dirs, patterns):
+        key = (search_dirs, libname, patterns)
+        if key in self.library_path_cache:
+            return self.library_path_cache[key]
+        result = None
         for d in search_dirs:
+            listing = self.list_library_dir(d)
+            if listing is not None and not listing:
+                continue
             for p in patterns:
+                if listing is not None and '*' not in p and p.format(libname).lower() not in listing:
+                    continue
                 trial = CCompiler._get_trials_from_pattern(p, d, libname)
                 if not trial:
                     continue
@@ -2400,7 +2485,12 @@ rule FORTRAN_DEP_HACK%s
                 if not trial:
                     continue
                 # Return the first result
-                return trial
+                result = os.path.realpath(trial)
+                break
+            if result:
+                break
+        self.library_path_cache[key] = result
+        return result
 
     def guess_external_link_dependencies(self, linker, target, commands, internal):
         # Ideally the linker would generate dependency information that could be used.
@@ -2448,9 +2538,9 @@ rule FORTRAN_DEP_HACK%s
         guessed_dependencies = []
         # TODO The get_library_naming requirement currently excludes link targets that use d or fortran as their main linker
         if hasattr(linker, 'get_library_naming'):
-            search_dirs = tuple(search_dirs) + linker.get_library_dirs(self.environment)
-            static_patterns = linker.get_library_naming(self.environment, 'static', strict=True)
-            shared_patterns = linker.get_library_naming(self.environment, 'shared', strict=True)
+            search_dirs = tuple(search_dirs) + tuple(linker.get_library_dirs(self.environment))
+            static_patterns = tuple(linker.get_library_naming(self.environment, 'static', strict=True))
+            shared_patterns = tuple(linker.get_library_naming(self.environment, 'shared', strict=True))
             for libname in libs:
                 # be conservative and record most likely shared and static resolution, because we don't know exactly
                 # which one the linker will prefer
@@ -2459,9 +2549,9 @@ rule FORTRAN_DEP_HACK%s
                 sharedlibs = self.guess_library_absolute_path(linker, libname,
                                                               search_dirs, shared_patterns)
                 if staticlibs:
-                    guessed_dependencies.append(os.path.realpath(staticlibs))
+                    guessed_dependencies.append(staticlibs)
                 if sharedlibs:
-                    guessed_dependencies.append(os.path.realpath(sharedlibs))
+                    guessed_dependencies.append(sharedlibs)
 
         return guessed_dependencies + absolute_libs
 
@@ -24,6 +24,7 @@ from . import backends
 from .. import build
 from .. import dependencies
 from .. import mlog
+from .. import mtrace
 from .. import compilers
 from ..compilers import CompilerArgs
 from ..mesonlib import (
@@ -397,7 +398,8 @@ class Vs2010Backend(backends.Backend):
             relname = target_dir / fname
             projfile_path = outdir / fname
             proj_uuid = self.environment.coredata.target_guids[name]
-            self.gen_vcxproj(target, str(projfile_path), proj_uuid)
+            with mtrace.span(target.get_id(), 'target', {'type': type(target).__name__}):
+                self.gen_vcxproj(target, str(projfile_path), proj_uuid)
             projlist.append((name, relname, proj_uuid))
 
         # Put the startup project first in the project list
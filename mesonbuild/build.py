@@ -25,7 +25,7 @@ from . import mlog
 from .mesonlib import (
     File, MesonException, listify, extract_as_list, OrderedSet,
     typeslistify, stringlistify, classify_unity_sources,
-    get_filenames_templates_dict, substitute_values,
+    get_filenames_templates_dict, substitute_values, CommandTemplate,
     for_windows, for_darwin, for_cygwin, for_android, has_path_sep
 )
 from .compilers import is_object, clink_langs, sort_clink, lang_suffixes, get_macos_dylib_install_name
@@ -157,9 +157,33 @@ class Build:
                 other.__dict__[k] = v
         return other
 
-    def merge(self, other):
+    def merge(self, other, base=None):
+        '''
+        Takes over the state of other, a copy() of this build that a subproject
+        was configured in. If other was copied from base instead, an earlier
+        copy of this build, only what changed between base and other is taken
+        over so that what was added to this build since then is kept.
+        '''
+        if base is None:
+            for k, v in other.__dict__.items():
+                self.__dict__[k] = v
+            return
         for k, v in other.__dict__.items():
-            self.__dict__[k] = v
+            old = base.__dict__.get(k)
+            if v is old:
+                continue
+            mine = self.__dict__.get(k)
+            if isinstance(v, dict) and isinstance(old, dict):
+                for key, value in v.items():
+                    if key not in old or old[key] is not value:
+                        mine[key] = value
+            elif isinstance(v, list) and isinstance(old, list):
+                # Lists are only ever appended to
+                mine.extend(v[len(old):])
+            elif isinstance(v, set) and isinstance(old, set):
+                mine.update(v - old)
+            else:
+                self.__dict__[k] = v
 
     def ensure_static_linker(self, compiler):
         if self.static_linker is None and compiler.needs_static_linker():
@@ -447,6 +471,8 @@ class BuildTarget(Target):
         self.include_dirs = []
         self.link_targets = []
         self.link_whole_targets = []
+        # Results of get_transitive_dependencies(), by value of internal
+        self.transitive_dependencies = {}
         self.link_depends = []
         self.name_prefix_set = False
         self.name_suffix_set = False
@@ -962,22 +988,56 @@ This will become a hard error in a future Meson release.''')
         return self.extra_args.get(language, [])
 
     def get_dependencies(self, exclude=None, internal=True):
-        transitive_deps = []
-        if exclude is None:
-            exclude = []
+        if not exclude:
+            return list(self.get_transitive_dependencies(internal))
+        # The static libraries that are excluded are not walked either, so
+        # this cannot filter the cached list
+        transitive_deps = OrderedSet()
+        self.walk_dependencies(transitive_deps, set(exclude), internal)
+        return list(transitive_deps)
+
+    def get_link_targets(self, internal):
         if internal:
-            link_targets = itertools.chain(self.link_targets, self.link_whole_targets)
-        else:
-            # We don't want the 'internal' libraries when generating the
-            # `Libs:` and `Libs.private:` lists in pkg-config files.
-            link_targets = self.link_targets
-        for t in link_targets:
+            return itertools.chain(self.link_targets, self.link_whole_targets)
+        # We don't want the 'internal' libraries when generating the
+        # `Libs:` and `Libs.private:` lists in pkg-config files.
+        return self.link_targets
+
+    def walk_dependencies(self, transitive_deps, exclude, internal):
+        for t in self.get_link_targets(internal):
             if t in transitive_deps or t in exclude:
                 continue
-            transitive_deps.append(t)
+            transitive_deps.add(t)
             if isinstance(t, StaticLibrary):
-                transitive_deps += t.get_dependencies(transitive_deps + exclude, internal)
-        return transitive_deps
+                t.walk_dependencies(transitive_deps, exclude, internal)
+
+    def get_transitive_dependencies(self, internal):
+        '''
+        Returns the targets this target links to and, recursively, the ones
+        the static libraries among them link to, in depth-first order. Each
+        static library computes this once, so targets sharing deep trees of
+        static libraries only walk them once.
+
+        Targets get all their link targets while they are created, before
+        the build files can use them, so the result is computed on first
+        use and kept. link() and link_whole() refuse to change it later.
+        '''
+        try:
+            return self.transitive_dependencies[internal]
+        except KeyError:
+            pass
+        transitive_deps = OrderedSet()
+        for t in self.get_link_targets(internal):
+            if t in transitive_deps:
+                continue
+            transitive_deps.add(t)
+            if isinstance(t, StaticLibrary):
+                # Everything a library already in the list links to is in
+                # the list too, so skipping those keeps the same order as
+                # walking the whole tree here.
+                transitive_deps.update(t.get_transitive_dependencies(internal))
+        result = self.transitive_dependencies[internal] = tuple(transitive_deps)
+        return result
 
     def get_source_subdir(self):
         return self.subdir
@@ -1051,7 +1111,13 @@ You probably should put it in link_with instead.''')
     def get_external_deps(self):
         return self.external_deps
 
+    def check_dependencies_unused(self):
+        if self.transitive_dependencies:
+            raise MesonException('Tried to add a link target to {!r} after its dependencies '
+                                 'were used.'.format(self.name))
+
     def link(self, target):
+        self.check_dependencies_unused()
         for t in listify(target, unholder=True):
             if not isinstance(t, Target):
                 raise InvalidArguments('{!r} is not a target.'.format(t))
@@ -1066,6 +1132,7 @@ You probably should put it in link_with instead.''')
             self.link_targets.append(t)
 
     def link_whole(self, target):
+        self.check_dependencies_unused()
         for t in listify(target, unholder=True):
             if not isinstance(t, StaticLibrary):
                 raise InvalidArguments('{!r} is not a static library.'.format(t))
@@ -1230,6 +1297,10 @@ This is not permitted on OSX''')
 recommended as it is not supported on some platforms''')
                 return
 
+# The template strings that generator arguments are filled in with
+generator_templates_regex = re.compile(r'(@(?:BASENAME|PLAINNAME|INPUT|OUTPUT[0-9]*|DEPFILE|'
+                                       r'SOURCE_DIR|BUILD_DIR|CURRENT_SOURCE_DIR|SOURCE_ROOT|BUILD_ROOT)@)')
+
 class Generator:
     def __init__(self, args, kwargs):
         if len(args) != 1:
@@ -1263,6 +1334,9 @@ class Generator:
             if not isinstance(a, str):
                 raise InvalidArguments('A non-string object in "arguments" keyword argument.')
         self.arglist = args
+        # Generators are often run on thousands of files, so the template
+        # strings in the arguments are found only once.
+        self.arglist_template = CommandTemplate(args, generator_templates_regex)
         if 'output' not in kwargs:
             raise InvalidArguments('Generator must have "output" keyword argument.')
         outputs = listify(kwargs['output'])
@@ -1307,7 +1381,7 @@ class Generator:
     def get_arglist(self, inname):
         plainname = os.path.basename(inname)
         basename = os.path.splitext(plainname)[0]
-        return [x.replace('@BASENAME@', basename).replace('@PLAINNAME@', plainname) for x in self.arglist]
+        return self.arglist_template.substitute({'@BASENAME@': basename, '@PLAINNAME@': plainname})
 
     def is_parent_path(self, parent, trial):
         relpath = pathlib.PurePath(trial).relative_to(parent)
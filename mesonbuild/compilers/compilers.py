@@ -19,6 +19,7 @@ from typing import List, Tuple
 from ..linkers import StaticLinker
 from .. import coredata
 from .. import mlog
+from .. import mtrace
 from .. import mesonlib
 from ..mesonlib import (
     EnvironmentException, MesonException, OrderedSet,
@@ -378,6 +379,9 @@ ccrx_debug_args = {False: [],
                    True: ['-debug']}
 
 base_options = {'b_pch': coredata.UserBooleanOption('b_pch', 'Use precompiled headers', True),
+                'b_pch_auto': coredata.UserBooleanOption('b_pch_auto',
+                                                         'Precompile the system headers most sources include',
+                                                         False),
                 'b_lto': coredata.UserBooleanOption('b_lto', 'Use link time optimization', False),
                 'b_sanitize': coredata.UserComboOption('b_sanitize',
                                                        'Code sanitizer to use',
@@ -1134,8 +1138,10 @@ class Compiler:
                 mlog.debug('Cached compiler stderr:\n', p.stde)
                 yield p
                 return
+        trace = mtrace.span(self.get_display_language() + ' compiler check', 'compiler',
+                            {'mode': mode})
         try:
-            with tempfile.TemporaryDirectory() as tmpdirname:
+            with tempfile.TemporaryDirectory() as tmpdirname, trace:
                 if isinstance(code, str):
                     srcname = os.path.join(tmpdirname,
                                            'testfile.' + self.default_suffix)
@@ -1483,7 +1489,7 @@ class GnuLikeCompiler(abc.ABC):
     """
     def __init__(self, compiler_type):
         self.compiler_type = compiler_type
-        self.base_options = ['b_pch', 'b_lto', 'b_pgo', 'b_sanitize', 'b_coverage',
+        self.base_options = ['b_pch', 'b_pch_auto', 'b_lto', 'b_pgo', 'b_sanitize', 'b_coverage',
                              'b_ndebug', 'b_staticpic', 'b_pie']
         if (not self.compiler_type.is_osx_compiler and
                 not self.compiler_type.is_windows_compiler and
@@ -19,7 +19,7 @@ from itertools import chain
 from pathlib import PurePath
 from collections import OrderedDict
 from .mesonlib import (
-    MesonException, MachineChoice, PerMachine,
+    MesonException, MachineChoice, PerMachine, ProgramCache,
     default_libdir, default_libexecdir, default_prefix, stringlistify
 )
 from .wrap import WrapMode
@@ -269,6 +269,8 @@ class CoreData:
         self.compilers = OrderedDict()
         self.cross_compilers = OrderedDict()
         self.deps = OrderedDict()
+        # Program lookups and version probes, reused when reconfiguring
+        self.program_cache = ProgramCache()
         # Only to print a warning if it changes between Meson invocations.
         self.pkgconf_envvar = os.environ.get('PKG_CONFIG_PATH', '')
         self.config_files = self.__load_config_files(options.native_file)
@@ -377,6 +379,10 @@ class CoreData:
         prefix = get_builtin_option_default('prefix')
         for key in get_builtin_options():
             value = get_builtin_option_default(key, prefix)
+            if builtin_options[key][0] == UserArrayOption:
+                self.builtins[key] = UserArrayOption(key, builtin_options[key][1], value,
+                                                     choices=builtin_options[key][2])
+                continue
             args = [key] + builtin_options[key][1:-1] + [value]
             self.builtins[key] = builtin_options[key][0](*args)
 
@@ -720,7 +726,7 @@ def is_builtin_option(optname):
 
 def get_builtin_option_choices(optname):
     if is_builtin_option(optname):
-        if builtin_options[optname][0] == UserComboOption:
+        if builtin_options[optname][0] in (UserComboOption, UserArrayOption):
             return builtin_options[optname][2]
         elif builtin_options[optname][0] == UserBooleanOption:
             return [True, False]
@@ -748,7 +754,7 @@ def get_builtin_option_action(optname):
 def get_builtin_option_default(optname, prefix=''):
     if is_builtin_option(optname):
         o = builtin_options[optname]
-        if o[0] == UserComboOption:
+        if o[0] in (UserComboOption, UserArrayOption):
             return o[3]
         if o[0] == UserIntegerOption:
             return o[4]
@@ -775,7 +781,8 @@ def add_builtin_argument(p, name):
         h = h.rstrip('.') + ' (default: %s).' % get_builtin_option_default(name)
     else:
         kwargs['action'] = b
-    if c and not b:
+    if c and not b and builtin_options[name][0] != UserArrayOption:
+        # Arrays are given as comma separated strings and checked later
         kwargs['choices'] = c
     kwargs['default'] = argparse.SUPPRESS
     kwargs['dest'] = name
@@ -817,6 +824,11 @@ builtin_options = {
     'buildtype':  [UserComboOption, 'Build type to use', ['plain', 'debug', 'debugoptimized', 'release', 'minsize', 'custom'], 'debug'],
     'strip':      [UserBooleanOption, 'Strip targets on install', False],
     'unity':      [UserComboOption, 'Unity build', ['on', 'off', 'subprojects'], 'off'],
+    'unity_size': [UserIntegerOption, 'Average number of sources in a unity file, 0 for all of them', 0, None, 0],
+    'unity_balance': [UserComboOption, 'What to balance unity files by', ['count', 'size', 'time'], 'count'],
+    'compile_cache': [UserBooleanOption, 'Reuse object files compiled in any build directory', False],
+    'compile_cache_size': [UserIntegerOption, 'Maximum size of the compile cache in MiB', 1, None, 5120],
+    'cache_custom_targets': [UserBooleanOption, 'Reuse outputs of custom targets built in any build directory', False],
     'prefix':     [UserStringOption, 'Installation prefix', default_prefix()],
     'libdir':     [UserStringOption, 'Library directory', default_libdir()],
     'libexecdir': [UserStringOption, 'Library executable directory', default_libexecdir()],
@@ -845,6 +857,11 @@ builtin_options = {
                                                        'nofallback',
                                                        'nodownload',
                                                        'forcefallback'], 'default'],
+    'pkg_config_impl': [UserComboOption, 'Implementation used to query pkg-config files', ['external', 'builtin'], 'external'],
+    'pkg_config_cache': [UserBooleanOption, 'Cache the results of the pkg-config executable in the user cache directory', False],
+    'prefetch_dependencies': [UserBooleanOption, 'Look up dependencies concurrently before interpreting the build files', False],
+    'parallel_subprojects': [UserBooleanOption, 'Configure independent subprojects concurrently', False],
+    'dist_formats':    [UserArrayOption, 'Archive formats created by the dist target', ['xztar', 'gztar', 'zip'], ['xztar']],
 }
 
 # Special prefix-dependent defaults for installation directories that reside in
@@ -26,17 +26,20 @@ import textwrap
 import platform
 import itertools
 import ctypes
+import threading
 from typing import List, Tuple
 from enum import Enum
 from pathlib import Path, PurePath
 
 from .. import mlog
+from .. import mtrace
 from .. import mesonlib
 from ..compilers import clib_langs
 from ..environment import BinaryTable, Environment, MachineInfo
 from ..mesonlib import MachineChoice, MesonException, OrderedSet, PerMachine
 from ..mesonlib import Popen_safe, version_compare_many, version_compare, listify
-from ..mesonlib import Version
+from ..mesonlib import Version, PersistentCache, file_stamp
+from .pcfile import PcResolver
 
 # These must be defined in this file to avoid cyclical references.
 packages = {}
@@ -413,7 +416,7 @@ class ConfigToolDependency(ExternalDependency):
         best_match = (None, None)
         for tool in tools:
             try:
-                p, out = Popen_safe(tool + ['--version'])[:2]
+                p, out = mesonlib.program_cache.run(tool + ['--version'])[:2]
             except (FileNotFoundError, PermissionError):
                 continue
             if p.returncode != 0:
@@ -496,6 +499,14 @@ class PkgConfigDependency(ExternalDependency):
     class_pkgbin = PerMachine(None, None, None)
     # We cache all pkg-config subprocess invocations to avoid redundant calls
     pkgbin_cache = {}
+    # Guards the search for the pkg-config binary
+    class_lock = threading.Lock()
+    # pkg-config results are also cached across Meson invocations, together
+    # with the stamps of the .pc files and search directories they came from
+    pkgbin_disk_cache = PersistentCache('pkgconfig')
+    # Resolvers used to answer queries in-process or to find the .pc files a
+    # query depends on, keyed on the pkg-config binary and PKG_CONFIG_* env
+    resolver_cache = {}
 
     def __init__(self, name, environment, kwargs, language=None):
         super().__init__('pkgconfig', environment, language, kwargs)
@@ -529,45 +540,62 @@ class PkgConfigDependency(ExternalDependency):
                     mlog.debug('Trying a default pkg-config fallback at', potential_pkgpath)
                     yield ExternalProgram(potential_pkgpath, silent=True)
 
+        # The builtin implementation parses .pc files itself instead of
+        # running pkg-config
+        self.builtin_impl = environment.coredata.get_builtin_option('pkg_config_impl') == 'builtin'
+        # Cached results of the executable are only valid if it searches the
+        # directories Meson finds from PKG_CONFIG_* and its pc_path, so the
+        # disk cache is opt-in
+        self.disk_cache = environment.coredata.get_builtin_option('pkg_config_cache')
+        self.is_cross_machine = environment.is_cross_build() and for_machine == MachineChoice.HOST
+
         # Only search for pkg-config for each machine the first time and store
         # the result in the class definition
-        if PkgConfigDependency.class_pkgbin[for_machine] is False:
-            mlog.debug('Pkg-config binary for %s is cached as not found.' % for_machine)
-        elif PkgConfigDependency.class_pkgbin[for_machine] is not None:
-            mlog.debug('Pkg-config binary for %s is cached.' % for_machine)
-        else:
-            assert PkgConfigDependency.class_pkgbin[for_machine] is None
-            mlog.debug('Pkg-config binary for %s is not cached.' % for_machine)
-            for potential_pkgbin in search():
-                mlog.debug('Trying pkg-config binary {} for machine {} at {}'
-                           .format(potential_pkgbin.name, for_machine, potential_pkgbin.command))
-                version_if_ok = self.check_pkgconfig(potential_pkgbin)
-                if not version_if_ok:
-                    continue
-                if not self.silent:
-                    mlog.log('Found pkg-config:', mlog.bold(potential_pkgbin.get_path()),
-                             '(%s)' % version_if_ok)
-                PkgConfigDependency.class_pkgbin[for_machine] = potential_pkgbin
-                break
+        # Lookups may run concurrently when dependencies are prefetched
+        with PkgConfigDependency.class_lock:
+            if self.builtin_impl:
+                mlog.debug('Using the builtin pkg-config implementation for %s.' % for_machine)
+            elif PkgConfigDependency.class_pkgbin[for_machine] is False:
+                mlog.debug('Pkg-config binary for %s is cached as not found.' % for_machine)
+            elif PkgConfigDependency.class_pkgbin[for_machine] is not None:
+                mlog.debug('Pkg-config binary for %s is cached.' % for_machine)
             else:
-                if not self.silent:
-                    mlog.log('Found Pkg-config:', mlog.red('NO'))
-                # Set to False instead of None to signify that we've already
-                # searched for it and not found it
-                PkgConfigDependency.class_pkgbin[for_machine] = False
-
-        self.pkgbin = PkgConfigDependency.class_pkgbin[for_machine]
-        if self.pkgbin is False:
-            self.pkgbin = None
-            msg = 'Pkg-config binary for machine %s not found. Giving up.' % for_machine
-            if self.required:
-                raise DependencyException(msg)
-            else:
-                mlog.debug(msg)
-                return
+                assert PkgConfigDependency.class_pkgbin[for_machine] is None
+                mlog.debug('Pkg-config binary for %s is not cached.' % for_machine)
+                for potential_pkgbin in search():
+                    mlog.debug('Trying pkg-config binary {} for machine {} at {}'
+                               .format(potential_pkgbin.name, for_machine, potential_pkgbin.command))
+                    version_if_ok = self.check_pkgconfig(potential_pkgbin)
+                    if not version_if_ok:
+                        continue
+                    if not self.silent:
+                        mlog.log('Found pkg-config:', mlog.bold(potential_pkgbin.get_path()),
+                                 '(%s)' % version_if_ok)
+                    PkgConfigDependency.class_pkgbin[for_machine] = potential_pkgbin
+                    break
+                else:
+                    if not self.silent:
+                        mlog.log('Found Pkg-config:', mlog.red('NO'))
+                    # Set to False instead of None to signify that we've already
+                    # searched for it and not found it
+                    PkgConfigDependency.class_pkgbin[for_machine] = False
+
+        if self.builtin_impl:
+            mlog.debug('Determining dependency {!r} with the builtin pkg-config '
+                       'implementation'.format(name))
+        else:
+            self.pkgbin = PkgConfigDependency.class_pkgbin[for_machine]
+            if self.pkgbin is False:
+                self.pkgbin = None
+                msg = 'Pkg-config binary for machine %s not found. Giving up.' % for_machine
+                if self.required:
+                    raise DependencyException(msg)
+                else:
+                    mlog.debug(msg)
+                    return
 
-        mlog.debug('Determining dependency {!r} with pkg-config executable '
-                   '{!r}'.format(name, self.pkgbin.get_path()))
+            mlog.debug('Determining dependency {!r} with pkg-config executable '
+                       '{!r}'.format(name, self.pkgbin.get_path()))
         ret, self.version = self._call_pkgbin(['--modversion', name])
         if ret != 0:
             return
@@ -609,9 +637,59 @@ class PkgConfigDependency(ExternalDependency):
             fenv = frozenset(env.items())
         targs = tuple(args)
         cache = PkgConfigDependency.pkgbin_cache
-        if (self.pkgbin, targs, fenv) not in cache:
-            cache[(self.pkgbin, targs, fenv)] = self._call_pkgbin_real(args, env)
-        return cache[(self.pkgbin, targs, fenv)]
+        # The builtin implementation has no binary, and searches different
+        # paths for each machine
+        key = (self.pkgbin, self.is_cross_machine, targs, fenv)
+        if key not in cache:
+            if self.builtin_impl:
+                res = self._get_resolver(env).query(args, env)
+                mlog.debug("Resolved `pkg-config {}` -> {}\n{}".format(' '.join(args), *res))
+            elif self.disk_cache:
+                res = self._call_pkgbin_cached(args, env)
+            else:
+                res = self._call_pkgbin_real(args, env)
+            cache[key] = res
+        return cache[key]
+
+    def _call_pkgbin_cached(self, args, env):
+        '''
+        Returns the result of a previous Meson invocation if none of the .pc
+        files or search directories it depended on have changed since.
+        '''
+        pkgenv = tuple(sorted((k, v) for k, v in env.items() if k.startswith('PKG_CONFIG_')))
+        key = (tuple(self.pkgbin.get_command()), file_stamp(self.pkgbin.get_path()), tuple(args), pkgenv)
+        disk_cache = PkgConfigDependency.pkgbin_disk_cache
+        entry = disk_cache.get(key)
+        if entry is not None:
+            stamps, res = entry
+            if all(file_stamp(f) == stamp for f, stamp in stamps.items()):
+                mlog.debug("Using cached `pkg-config {}` -> {}\n{}".format(' '.join(args), *res))
+                return res
+        res = self._call_pkgbin_real(args, env)
+        names = [a for a in args if not a.startswith('--')]
+        stamps = self._get_resolver(env).files_for(names)
+        if stamps is not None:
+            disk_cache[key] = (stamps, res)
+        return res
+
+    def _get_resolver(self, env):
+        pkgenv = tuple(sorted((k, v) for k, v in env.items() if k.startswith('PKG_CONFIG_')))
+        key = (self.pkgbin, self.is_cross_machine, pkgenv)
+        resolver = PkgConfigDependency.resolver_cache.get(key)
+        if resolver is None:
+            if self.pkgbin is not None:
+                # Ask the binary for its compiled-in search path
+                rc, out = self._call_pkgbin_real(['--variable', 'pc_path', 'pkg-config'], env)
+                default_path = out.split(os.pathsep) if rc == 0 and out else None
+            elif self.is_cross_machine:
+                # The build machine's .pc files are useless for the host machine,
+                # so only PKG_CONFIG_PATH and PKG_CONFIG_LIBDIR are searched
+                default_path = []
+            else:
+                default_path = None
+            resolver = PcResolver.from_env(dict(pkgenv), default_path)
+            PkgConfigDependency.resolver_cache[key] = resolver
+        return resolver
 
     def _convert_mingw_paths(self, args):
         '''
@@ -832,7 +910,7 @@ class PkgConfigDependency(ExternalDependency):
             mlog.log('Did not find pkg-config by name {!r}'.format(pkgbin.name))
             return None
         try:
-            p, out = Popen_safe(pkgbin.get_command() + ['--version'])[0:2]
+            p, out = mesonlib.program_cache.run(pkgbin.get_command() + ['--version'])[0:2]
             if p.returncode != 0:
                 mlog.warning('Found pkg-config {!r} but it failed when run'
                              ''.format(' '.join(pkgbin.get_command())))
@@ -917,8 +995,14 @@ class CMakeDependency(ExternalDependency):
     class_cmakebin = PerMachine(None, None, None)
     class_cmakevers = PerMachine(None, None, None)
     class_cmakeinfo = PerMachine(None, None, None)
+    # Guards the search for the CMake binary and its system information
+    class_lock = threading.Lock()
     # We cache all pkg-config subprocess invocations to avoid redundant calls
     cmake_cache = {}
+    # The system information and package search results are also cached
+    # across Meson invocations, together with the stamps of the CMake files
+    # and directories they came from
+    cmake_disk_cache = PersistentCache('cmake')
     # Version string for the minimum CMake version
     class_cmake_version = '>=3.4'
     # CMake generators to try (empty for no generator)
@@ -975,32 +1059,34 @@ class CMakeDependency(ExternalDependency):
 
         # Only search for CMake the first time and store the result in the class
         # definition
-        if CMakeDependency.class_cmakebin[for_machine] is False:
-            mlog.debug('CMake binary for %s is cached as not found' % for_machine)
-        elif CMakeDependency.class_cmakebin[for_machine] is not None:
-            mlog.debug('CMake binary for %s is cached.' % for_machine)
-        else:
-            assert CMakeDependency.class_cmakebin[for_machine] is None
-            mlog.debug('CMake binary for %s is not cached' % for_machine)
-            for potential_cmakebin in search():
-                mlog.debug('Trying CMake binary {} for machine {} at {}'
-                           .format(potential_cmakebin.name, for_machine, potential_cmakebin.command))
-                version_if_ok = self.check_cmake(potential_cmakebin)
-                if not version_if_ok:
-                    continue
-                if not self.silent:
-                    mlog.log('Found CMake:', mlog.bold(potential_cmakebin.get_path()),
-                             '(%s)' % version_if_ok)
-                CMakeDependency.class_cmakebin[for_machine] = potential_cmakebin
-                CMakeDependency.class_cmakevers[for_machine] = version_if_ok
-                break
+        # Lookups may run concurrently when dependencies are prefetched
+        with CMakeDependency.class_lock:
+            if CMakeDependency.class_cmakebin[for_machine] is False:
+                mlog.debug('CMake binary for %s is cached as not found' % for_machine)
+            elif CMakeDependency.class_cmakebin[for_machine] is not None:
+                mlog.debug('CMake binary for %s is cached.' % for_machine)
             else:
-                if not self.silent:
-                    mlog.log('Found CMake:', mlog.red('NO'))
-                # Set to False instead of None to signify that we've already
-                # searched for it and not found it
-                CMakeDependency.class_cmakebin[for_machine] = False
-                CMakeDependency.class_cmakevers[for_machine] = None
+                assert CMakeDependency.class_cmakebin[for_machine] is None
+                mlog.debug('CMake binary for %s is not cached' % for_machine)
+                for potential_cmakebin in search():
+                    mlog.debug('Trying CMake binary {} for machine {} at {}'
+                               .format(potential_cmakebin.name, for_machine, potential_cmakebin.command))
+                    version_if_ok = self.check_cmake(potential_cmakebin)
+                    if not version_if_ok:
+                        continue
+                    if not self.silent:
+                        mlog.log('Found CMake:', mlog.bold(potential_cmakebin.get_path()),
+                                 '(%s)' % version_if_ok)
+                    CMakeDependency.class_cmakebin[for_machine] = potential_cmakebin
+                    CMakeDependency.class_cmakevers[for_machine] = version_if_ok
+                    break
+                else:
+                    if not self.silent:
+                        mlog.log('Found CMake:', mlog.red('NO'))
+                    # Set to False instead of None to signify that we've already
+                    # searched for it and not found it
+                    CMakeDependency.class_cmakebin[for_machine] = False
+                    CMakeDependency.class_cmakevers[for_machine] = None
 
         self.cmakebin = CMakeDependency.class_cmakebin[for_machine]
         self.cmakevers = CMakeDependency.class_cmakevers[for_machine]
@@ -1012,8 +1098,9 @@ class CMakeDependency(ExternalDependency):
             mlog.debug(msg)
             return
 
-        if CMakeDependency.class_cmakeinfo[for_machine] is None:
-            CMakeDependency.class_cmakeinfo[for_machine] = self._get_cmake_info()
+        with CMakeDependency.class_lock:
+            if CMakeDependency.class_cmakeinfo[for_machine] is None:
+                CMakeDependency.class_cmakeinfo[for_machine] = self._get_cmake_info()
         self.cmakeinfo = CMakeDependency.class_cmakeinfo[for_machine]
         if self.cmakeinfo is None:
             raise self._gen_exception('Unable to obtain CMake system information')
@@ -1039,8 +1126,42 @@ class CMakeDependency(ExternalDependency):
         return s.format(self.__class__.__name__, self.name, self.is_found,
                         self.version_reqs)
 
+    @staticmethod
+    def _cmake_env_key():
+        # Only the environment variables that can influence the package search
+        return tuple(sorted((k, v) for k, v in os.environ.items()
+                            if k == 'PATH' or k.startswith(('CMAKE_', 'PKG_CONFIG_')) or
+                            k.endswith(('_DIR', '_ROOT'))))
+
+    def _disk_cache_key(self, *args):
+        return args + (tuple(self.cmakebin.get_command()), file_stamp(self.cmakebin.get_path()),
+                       self.cmakevers, self._cmake_env_key())
+
+    def _get_disk_cached(self, key):
+        entry = CMakeDependency.cmake_disk_cache.get(key)
+        if entry is None:
+            return None
+        stamps, value = entry
+        if any(file_stamp(f) != stamp for f, stamp in stamps.items()):
+            return None
+        return value
+
+    def _set_disk_cached(self, key, value, files, dirs):
+        # The result is valid as long as none of the files CMake read change
+        # and no file is added to or removed from the directories involved.
+        # Files in our scratch directories are rewritten on every run.
+        files = [x for x in files if not x.startswith(self.cmake_root_dir)]
+        dirs = set(dirs).union(os.path.dirname(x) for x in files)
+        stamps = {x: file_stamp(x) for x in itertools.chain(files, dirs)}
+        CMakeDependency.cmake_disk_cache[key] = (stamps, value)
+
     def _get_cmake_info(self):
         mlog.debug("Extracting basic cmake information")
+        key = self._disk_cache_key('info')
+        res = self._get_disk_cached(key)
+        if res is not None:
+            mlog.debug('Using cached CMake system information')
+            return res
         res = {}
 
         # Try different CMake generators since specifying no generator may fail
@@ -1074,19 +1195,22 @@ class CMakeDependency(ExternalDependency):
         if ret1 != 0:
             return None
 
+        trace_files = set()
         try:
             # First parse the trace
             lexer1 = self._lex_trace(err1)
 
             # Primary pass -- parse all invocations of set
             for l in lexer1:
+                trace_files.add(l.file)
                 if l.func == 'set':
                     self._cmake_set(l)
         except:
             return None
 
         # Extract the variables and sanity check them
-        module_paths = sorted(set(self.get_cmake_var('MESON_PATHS_LIST')))
+        all_paths = self.get_cmake_var('MESON_PATHS_LIST')
+        module_paths = sorted(set(all_paths))
         module_paths = list(filter(lambda x: os.path.isdir(x), module_paths))
         archs = self.get_cmake_var('MESON_ARCH_LIST')
 
@@ -1106,10 +1230,24 @@ class CMakeDependency(ExternalDependency):
         mlog.debug('  -- CMake architectures:    {}'.format(res['archs']))
         mlog.debug('  -- CMake lib search paths: {}'.format(res['common_paths']))
 
+        self._set_disk_cached(key, res, trace_files, all_paths + ['/lib'])
+
         # Reset variables
         self.vars = {}
         return res
 
+    def _search_dirs(self, args):
+        # The directories in which a newly installed package would show up
+        dirs = [os.path.join(self.cmakeinfo['cmake_root'], 'Modules')]
+        for i in args:
+            if i.startswith('-DCMAKE_MODULE_PATH='):
+                dirs += i.split('=', 1)[1].split(';')
+        for i in self.cmakeinfo['module_paths']:
+            dirs += [i]
+            for j in self.cmakeinfo['common_paths']:
+                dirs += [os.path.join(i, j), os.path.join(i, j, 'cmake')]
+        return dirs
+
     @staticmethod
     @functools.lru_cache(maxsize=None)
     def _cached_listdir(path: str) -> Tuple[Tuple[str, str]]:
@@ -1209,69 +1347,31 @@ class CMakeDependency(ExternalDependency):
         mlog.debug('\nDetermining dependency {!r} with CMake executable '
                    '{!r}'.format(name, self.cmakebin.get_path()))
 
-        # Try different CMake generators since specifying no generator may fail
-        # in cygwin for some reason
-        gen_list = []
-        # First try the last working generator
-        if CMakeDependency.class_working_generator is not None:
-            gen_list += [CMakeDependency.class_working_generator]
-        gen_list += CMakeDependency.class_cmake_generators
-
-        for i in gen_list:
-            mlog.debug('Try CMake generator: {}'.format(i if len(i) > 0 else 'auto'))
-
-            # Prepare options
-            cmake_opts = ['--trace-expand', '-DNAME={}'.format(name), '-DARCHS={}'.format(';'.join(self.cmakeinfo['archs']))] + args + ['.']
-            if len(i) > 0:
-                cmake_opts = ['-G', i] + cmake_opts
-
-            # Run CMake
-            ret1, out1, err1 = self._call_cmake(cmake_opts, 'CMakeLists.txt')
-
-            # Current generator was successful
-            if ret1 == 0:
-                CMakeDependency.class_working_generator = i
-                break
-
-            mlog.debug('CMake failed for generator {} and package {} with error code {}'.format(i, name, ret1))
-            mlog.debug('OUT:\n{}\n\n\nERR:\n{}\n\n'.format(out1, err1))
-
-        # Check if any generator succeeded
-        if ret1 != 0:
-            return
-
-        try:
-            # First parse the trace
-            lexer1 = self._lex_trace(err1)
-
-            # All supported functions
-            functions = {
-                'set': self._cmake_set,
-                'unset': self._cmake_unset,
-                'add_executable': self._cmake_add_executable,
-                'add_library': self._cmake_add_library,
-                'add_custom_target': self._cmake_add_custom_target,
-                'set_property': self._cmake_set_property,
-                'set_target_properties': self._cmake_set_target_properties
-            }
-
-            # Primary pass -- parse everything
-            for l in lexer1:
-                # "Execute" the CMake function if supported
-                fn = functions.get(l.func, None)
-                if(fn):
-                    fn(l)
+        key = self._disk_cache_key('package', name, tuple(args), tuple(self.cmakeinfo['archs']))
+        cached = self._get_disk_cached(key)
+        if cached is not None:
+            mlog.debug('Using cached CMake results for {}'.format(name))
+            self.vars, self.targets = cached
+        else:
+            try:
+                trace_files = self._trace_find_package(name, args)
+            except DependencyException as e:
+                if self.required:
+                    raise
+                else:
+                    self.compile_args = []
+                    self.link_args = []
+                    self.is_found = False
+                    self.reason = e
+                    return
 
-        except DependencyException as e:
-            if self.required:
-                raise
-            else:
-                self.compile_args = []
-                self.link_args = []
-                self.is_found = False
-                self.reason = e
+            if trace_files is None:
                 return
 
+            # Everything below only needs the PACKAGE_* variables and the targets
+            package_vars = {k: v for k, v in self.vars.items() if k.startswith('PACKAGE_')}
+            self._set_disk_cached(key, (package_vars, self.targets), trace_files, self._search_dirs(args))
+
         # Whether the package is found or not is always stored in PACKAGE_FOUND
         self.is_found = self._var_to_bool('PACKAGE_FOUND')
         if not self.is_found:
@@ -1389,6 +1489,67 @@ class CMakeDependency(ExternalDependency):
         self.compile_args = compileOptions + compileDefinitions + list(map(lambda x: '-I{}'.format(x), incDirs))
         self.link_args = libraries
 
+    def _trace_find_package(self, name: str, args: List[str]):
+        # Runs find_package() for the dependency and executes the supported
+        # functions from the trace, returns the files that CMake read or
+        # None if CMake failed
+
+        # Try different CMake generators since specifying no generator may fail
+        # in cygwin for some reason
+        gen_list = []
+        # First try the last working generator
+        if CMakeDependency.class_working_generator is not None:
+            gen_list += [CMakeDependency.class_working_generator]
+        gen_list += CMakeDependency.class_cmake_generators
+
+        for i in gen_list:
+            mlog.debug('Try CMake generator: {}'.format(i if len(i) > 0 else 'auto'))
+
+            # Prepare options
+            cmake_opts = ['--trace-expand', '-DNAME={}'.format(name), '-DARCHS={}'.format(';'.join(self.cmakeinfo['archs']))] + args + ['.']
+            if len(i) > 0:
+                cmake_opts = ['-G', i] + cmake_opts
+
+            # Run CMake
+            ret1, out1, err1 = self._call_cmake(cmake_opts, 'CMakeLists.txt')
+
+            # Current generator was successful
+            if ret1 == 0:
+                CMakeDependency.class_working_generator = i
+                break
+
+            mlog.debug('CMake failed for generator {} and package {} with error code {}'.format(i, name, ret1))
+            mlog.debug('OUT:\n{}\n\n\nERR:\n{}\n\n'.format(out1, err1))
+
+        # Check if any generator succeeded
+        if ret1 != 0:
+            return None
+
+        # First parse the trace
+        lexer1 = self._lex_trace(err1)
+
+        # All supported functions
+        functions = {
+            'set': self._cmake_set,
+            'unset': self._cmake_unset,
+            'add_executable': self._cmake_add_executable,
+            'add_library': self._cmake_add_library,
+            'add_custom_target': self._cmake_add_custom_target,
+            'set_property': self._cmake_set_property,
+            'set_target_properties': self._cmake_set_target_properties
+        }
+
+        # Primary pass -- parse everything
+        trace_files = set()
+        for l in lexer1:
+            trace_files.add(l.file)
+            # "Execute" the CMake function if supported
+            fn = functions.get(l.func, None)
+            if(fn):
+                fn(l)
+
+        return trace_files
+
     def get_first_cmake_var_of(self, var_list):
         # Return the first found CMake variable in list var_list
         for i in var_list:
@@ -1566,29 +1727,30 @@ class CMakeDependency(ExternalDependency):
 
     def _lex_trace(self, trace):
         # The trace format is: '<file>(<line>):  <func>(<args -- can contain \n> )\n'
-        reg_tline = re.compile(r'\s*(.*\.(cmake|txt))\(([0-9]+)\):\s*(\w+)\(([\s\S]*?) ?\)\s*\n', re.MULTILINE)
-        reg_other = re.compile(r'[^\n]*\n')
+        # The trace is processed line by line; a call ends with the first
+        # line ending in ')'
+        reg_tline = re.compile(r'\s*(.*\.(cmake|txt))\(([0-9]+)\):\s*(\w+)\((.*)$')
         reg_genexp = re.compile(r'\$<.*>')
-        loc = 0
-        while loc < len(trace):
-            mo_file_line = reg_tline.match(trace, loc)
+        lines = iter(trace.split('\n'))
+        for l in lines:
+            mo_file_line = reg_tline.match(l)
             if not mo_file_line:
-                skip_match = reg_other.match(trace, loc)
-                if not skip_match:
-                    print(trace[loc:])
-                    raise self._gen_exception('Failed to parse CMake trace')
-
-                loc = skip_match.end()
                 continue
 
-            loc = mo_file_line.end()
-
             file = mo_file_line.group(1)
             line = mo_file_line.group(3)
             func = mo_file_line.group(4)
-            args = mo_file_line.group(5).split(' ')
-            args = list(map(lambda x: x.strip(), args))
-            args = list(map(lambda x: reg_genexp.sub('', x), args)) # Remove generator expressions
+            parts = [mo_file_line.group(5)]
+            while not parts[-1].rstrip().endswith(')'):
+                try:
+                    parts.append(next(lines))
+                except StopIteration:
+                    raise self._gen_exception('Failed to parse CMake trace')
+            args = '\n'.join(parts).rstrip()[:-1]
+            if args.endswith(' '):
+                args = args[:-1]
+            # Remove generator expressions
+            args = [reg_genexp.sub('', x.strip()) if '$<' in x else x.strip() for x in args.split(' ')]
 
             yield CMakeTraceLine(file, line, func, args)
 
@@ -1677,7 +1839,7 @@ set(CMAKE_SIZEOF_VOID_P "{}")
             mlog.log('Did not find CMake {!r}'.format(cmakebin.name))
             return None
         try:
-            p, out = Popen_safe(cmakebin.get_command() + ['--version'])[0:2]
+            p, out = mesonlib.program_cache.run(cmakebin.get_command() + ['--version'])[0:2]
             if p.returncode != 0:
                 mlog.warning('Found CMake {!r} but couldn\'t run it'
                              ''.format(' '.join(cmakebin.get_command())))
@@ -1877,7 +2039,7 @@ class DubDependency(ExternalDependency):
         dubbin = ExternalProgram('dub', silent=True)
         if dubbin.found():
             try:
-                p, out = Popen_safe(dubbin.get_command() + ['--version'])[0:2]
+                p, out = mesonlib.program_cache.run(dubbin.get_command() + ['--version'])[0:2]
                 if p.returncode != 0:
                     mlog.warning('Found dub {!r} but couldn\'t run it'
                                  ''.format(' '.join(dubbin.get_command())))
@@ -1907,7 +2069,7 @@ class ExternalProgram:
         if command is not None:
             self.command = listify(command)
         else:
-            self.command = self._search(name, search_dir)
+            self.command = mesonlib.program_cache.search(name, search_dir, self._search)
 
         # Set path to be the last item that is actually a file (in order to
         # skip options in something like ['python', '-u', 'file.py']. If we
@@ -2324,8 +2486,10 @@ def find_external_dependency(name, env, kwargs):
     for c in candidates:
         # try this dependency method
         try:
-            d = c()
-            d._check_version()
+            with mtrace.span(display_name, 'dependency', {'method': _candidate_name(c)}) as trace_args:
+                d = c()
+                d._check_version()
+                trace_args['found'] = d.found()
             pkgdep.append(d)
         except DependencyException as e:
             pkg_exc.append(e)
@@ -2380,6 +2544,15 @@ def find_external_dependency(name, env, kwargs):
     return NotFoundDependency(env)
 
 
+def _candidate_name(candidate):
+    # The dependency class a candidate constructs, for profiling
+    while isinstance(candidate, functools.partial):
+        candidate = candidate.func
+    # Class method constructors such as ConfigToolDependency.factory
+    if isinstance(getattr(candidate, '__self__', None), type):
+        candidate = candidate.__self__
+    return getattr(candidate, '__name__', type(candidate).__name__)
+
 def _build_external_dependency_list(name, env: Environment, kwargs: Dict[str, Any]) -> list:
     # First check if the method is valid
     if 'method' in kwargs and kwargs['method'] not in [e.value for e in DependencyMethods]:
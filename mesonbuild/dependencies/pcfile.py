@@ -0,0 +1,424 @@
+# Copyright 2019 The Meson development team
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This file contains a pure-Python reader for pkg-config .pc files that can
+# answer the queries PkgConfigDependency makes without spawning pkg-config,
+# and the helpers used to validate cached pkg-config results on disk.
+
+import os
+import re
+import shlex
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from .. import mesonlib
+from ..mesonlib import MesonException, file_stamp, version_compare
+
+class PcFileException(MesonException):
+    '''Errors while locating, parsing or resolving .pc files'''
+
+# Matches a variable definition (name=value) or a keyword field (Name: value)
+_pc_line_re = re.compile(r'^([A-Za-z0-9_.]+)\s*([=:])\s*(.*)$')
+_pc_var_re = re.compile(r'\$\$|\$\{([^}]*)\}')
+_requires_op_re = re.compile(r'(<=|>=|!=|==|=|<|>)')
+
+@lru_cache(maxsize=None)
+def default_system_library_path() -> List[str]:
+    paths = []
+    for libdir in (mesonlib.default_libdir(), 'lib', 'lib64'):
+        for prefix in ('/usr', '/'):
+            p = os.path.join(prefix, libdir)
+            if p not in paths:
+                paths.append(p)
+    return paths
+
+class PcFile:
+    '''
+    A parsed .pc file. Variables are kept unexpanded so that the same parse
+    can be reused with different --define-variable overrides.
+    '''
+
+    def __init__(self, path: str, name: str):
+        self.path = path
+        self.name = name
+        self.raw_variables = OrderedDict() # type: Dict[str, str]
+        self.raw_fields = {} # type: Dict[str, str]
+        self._expanded = {}
+        self._parse()
+
+    def _parse(self):
+        try:
+            with open(self.path, encoding='utf-8', errors='replace') as f:
+                text = f.read()
+        except OSError as e:
+            raise PcFileException('Could not read {!r}: {}'.format(self.path, e))
+        # Join continuation lines before splitting
+        text = text.replace('\\\r\n', '').replace('\\\n', '')
+        for line in text.splitlines():
+            line = self._strip_comment(line).strip()
+            if not line:
+                continue
+            m = _pc_line_re.match(line)
+            if not m:
+                continue
+            key, sep, value = m.groups()
+            if sep == '=':
+                # The first definition wins, like pkg-config
+                self.raw_variables.setdefault(key, value.strip())
+            else:
+                # Keywords are case-insensitive, some files use CFlags
+                self.raw_fields[key.lower()] = value.strip()
+
+    @staticmethod
+    def _strip_comment(line: str) -> str:
+        idx = line.find('#')
+        while idx != -1:
+            if idx == 0 or line[idx - 1] != '\\':
+                return line[:idx]
+            line = line[:idx - 1] + line[idx:]
+            idx = line.find('#', idx)
+        return line
+
+    def variables(self, overrides: Tuple[Tuple[str, str], ...], sysroot: str) -> Dict[str, str]:
+        key = (overrides, sysroot)
+        if key in self._expanded:
+            return self._expanded[key]
+        globals_ = {'pcfiledir': os.path.dirname(self.path),
+                    'pc_sysrootdir': sysroot or '/'}
+        globals_.update(dict(overrides))
+        result = dict(globals_)
+        for name, raw in self.raw_variables.items():
+            if name in globals_:
+                continue
+            result[name] = self._expand(raw, result)
+        self._expanded[key] = result
+        return result
+
+    def _expand(self, value: str, variables: Dict[str, str]) -> str:
+        def repl(m):
+            if m.group(0) == '$$':
+                return '$'
+            name = m.group(1)
+            if name not in variables:
+                raise PcFileException('Variable {!r} not defined in {!r}'.format(name, self.path))
+            return variables[name]
+        return _pc_var_re.sub(repl, value)
+
+    def field(self, name: str, overrides, sysroot) -> str:
+        raw = self.raw_fields.get(name.lower(), '')
+        if not raw:
+            return ''
+        return self._expand(raw, self.variables(overrides, sysroot))
+
+    def flags(self, name: str, overrides, sysroot) -> List[str]:
+        value = self.field(name, overrides, sysroot)
+        try:
+            return shlex.split(value)
+        except ValueError as e:
+            raise PcFileException('Could not parse {} field of {!r}: {}'.format(name, self.path, e))
+
+    def requires(self, name: str, overrides, sysroot) -> List[Tuple[str, Optional[str]]]:
+        '''
+        Parses a Requires-style field into a list of (package, constraint)
+        where the constraint is in the form version_compare() understands.
+        '''
+        tokens = _requires_op_re.sub(r' \1 ', self.field(name, overrides, sysroot)).replace(',', ' ').split()
+        result = []
+        i = 0
+        while i < len(tokens):
+            pkg = tokens[i]
+            constraint = None
+            if i + 1 < len(tokens) and _requires_op_re.fullmatch(tokens[i + 1]):
+                if i + 2 >= len(tokens):
+                    raise PcFileException('Missing version after {!r} in {} field of {!r}'.format(tokens[i + 1], name, self.path))
+                op = tokens[i + 1]
+                if op == '=':
+                    op = '=='
+                constraint = op + tokens[i + 2]
+                i += 2
+            result.append((pkg, constraint))
+            i += 1
+        return result
+
+
+class PcResolver:
+    '''
+    Resolves packages against a pkg-config search path and answers a subset
+    of the pkg-config command line: --modversion, --cflags, --libs, --static,
+    --variable, --define-variable and --print-variables.
+
+    The behaviour follows pkg-config: Cflags are collected from Requires and
+    Requires.private, Libs only from Requires unless --static is given, and
+    system include and library directories are filtered unless
+    PKG_CONFIG_ALLOW_SYSTEM_CFLAGS or PKG_CONFIG_ALLOW_SYSTEM_LIBS are set.
+    '''
+
+    # Parsed files are shared between resolvers, keyed on path and stamp
+    pcfile_cache = {}
+
+    def __init__(self, search_path: List[str], sysroot: str = '',
+                 system_include_path: Optional[List[str]] = None,
+                 system_library_path: Optional[List[str]] = None):
+        self.search_path = [p for p in search_path if p]
+        self.sysroot = sysroot
+        if system_include_path is None:
+            system_include_path = ['/usr/include']
+        if system_library_path is None:
+            system_library_path = default_system_library_path()
+        self.system_include_path = [os.path.normpath(p) for p in system_include_path]
+        self.system_library_path = [os.path.normpath(p) for p in system_library_path]
+        self._index = None
+        self._index_stamps = None
+
+    @staticmethod
+    def default_search_path() -> List[str]:
+        '''
+        The search path compiled into the common pkg-config and pkgconf
+        distribution builds, used when PKG_CONFIG_LIBDIR is not set.
+        '''
+        if mesonlib.is_windows():
+            return []
+        libdirs = [mesonlib.default_libdir(), 'lib']
+        paths = []
+        for prefix in ('/usr/local', '/usr'):
+            for libdir in libdirs:
+                p = os.path.join(prefix, libdir, 'pkgconfig')
+                if p not in paths:
+                    paths.append(p)
+            paths.append(os.path.join(prefix, 'share', 'pkgconfig'))
+        return paths
+
+    @classmethod
+    def from_env(cls, env: Dict[str, str], default_search_path: Optional[List[str]] = None) -> 'PcResolver':
+        '''
+        Creates a resolver configured from the PKG_CONFIG_* variables in
+        @env the same way pkg-config would be.
+        '''
+        path = env.get('PKG_CONFIG_PATH', '').split(os.pathsep)
+        if 'PKG_CONFIG_LIBDIR' in env:
+            path += env['PKG_CONFIG_LIBDIR'].split(os.pathsep)
+        elif default_search_path is not None:
+            path += default_search_path
+        else:
+            path += cls.default_search_path()
+
+        def pathlist(var):
+            if var in env:
+                return [p for p in env[var].split(os.pathsep) if p]
+            return None
+        return cls(path, env.get('PKG_CONFIG_SYSROOT_DIR', ''),
+                   pathlist('PKG_CONFIG_SYSTEM_INCLUDE_PATH'),
+                   pathlist('PKG_CONFIG_SYSTEM_LIBRARY_PATH'))
+
+    def refresh(self):
+        '''Forgets the package index if any search directory has changed'''
+        stamps = [file_stamp(d) for d in self.search_path]
+        if stamps != self._index_stamps:
+            self._index = None
+            self._index_stamps = stamps
+
+    @property
+    def index(self) -> Dict[str, str]:
+        '''Maps package names to the first matching .pc file in the search path'''
+        if self._index is None:
+            self._index = {}
+            for d in self.search_path:
+                try:
+                    entries = os.listdir(d)
+                except OSError:
+                    continue
+                for e in entries:
+                    if e.endswith('.pc'):
+                        self._index.setdefault(e[:-3], os.path.join(d, e))
+        return self._index
+
+    def find(self, name: str) -> Optional[str]:
+        if name.endswith('.pc') and os.path.isfile(name):
+            return os.path.abspath(name)
+        return self.index.get(name)
+
+    def load(self, name: str) -> PcFile:
+        path = self.find(name)
+        if path is None:
+            raise PcFileException('Package {} was not found in the pkg-config search path.'.format(name))
+        key = (path, file_stamp(path))
+        pc = PcResolver.pcfile_cache.get(key)
+        if pc is None:
+            pc = PcFile(path, name)
+            PcResolver.pcfile_cache[key] = pc
+        return pc
+
+    def _walk(self, name: str, private: bool, overrides) -> List[PcFile]:
+        '''
+        Returns @name and its transitive requirements in an order where every
+        package comes before the packages it requires. Version constraints
+        are checked for all requirements, public and private.
+        '''
+        postorder = []
+        visited = set()
+        visiting = set()
+
+        def visit(pkgname, constraint, parent):
+            if parent is None:
+                pc = self.load(pkgname)
+            else:
+                pc = self._load_required(pkgname, constraint, parent, overrides)
+            if pc.path in visited or pc.path in visiting:
+                return
+            visiting.add(pc.path)
+            reqs = pc.requires('Requires', overrides, self.sysroot)
+            private_reqs = pc.requires('Requires.private', overrides, self.sysroot)
+            if private:
+                reqs += private_reqs
+            else:
+                # Private requirements must still exist and satisfy their constraints
+                for req, cons in private_reqs:
+                    self._load_required(req, cons, pc, overrides)
+            # Visit in reverse so that the reversed post-order lists
+            # requirements in the order they were declared
+            for req, cons in reversed(reqs):
+                visit(req, cons, pc)
+            visiting.discard(pc.path)
+            visited.add(pc.path)
+            postorder.append(pc)
+
+        visit(name, None, None)
+        postorder.reverse()
+        return postorder
+
+    def _load_required(self, name, constraint, parent, overrides) -> PcFile:
+        try:
+            pc = self.load(name)
+        except PcFileException:
+            raise PcFileException('Package {!r}, required by {!r}, not found'.format(name, parent.name))
+        if constraint is not None:
+            version = pc.field('Version', overrides, self.sysroot)
+            if not version_compare(version, constraint):
+                raise PcFileException('Package {!r} requires {!r} {} but version of {} is {}'.format(
+                                      parent.name, name, constraint, name, version))
+        return pc
+
+    def _sysroot_path(self, flag: str, prefix: str) -> str:
+        if self.sysroot and flag.startswith(prefix + '/'):
+            return prefix + self.sysroot + flag[len(prefix):]
+        return flag
+
+    def cflags(self, name: str, overrides=(), allow_system: bool = False, static: bool = False) -> List[str]:
+        result = []
+        for pc in self._walk(name, True, overrides):
+            flags = pc.flags('Cflags', overrides, self.sysroot)
+            if static:
+                flags += pc.flags('Cflags.private', overrides, self.sysroot)
+            for f in flags:
+                if f.startswith('-I'):
+                    if not allow_system and os.path.normpath(f[2:]) in self.system_include_path:
+                        continue
+                    f = self._sysroot_path(f, '-I')
+                if f not in result:
+                    result.append(f)
+        return result
+
+    def libs(self, name: str, overrides=(), allow_system: bool = False, static: bool = False) -> List[str]:
+        flags = []
+        for pc in self._walk(name, static, overrides):
+            flags += pc.flags('Libs', overrides, self.sysroot)
+            if static:
+                flags += pc.flags('Libs.private', overrides, self.sysroot)
+        result = []
+        libdirs = set()
+        # Dependencies come after their dependents, so keep the last of any
+        # duplicated library flag but the first of any library directory.
+        last = {f: i for i, f in enumerate(flags)}
+        for i, f in enumerate(flags):
+            if f.startswith('-L'):
+                if not allow_system and os.path.normpath(f[2:]) in self.system_library_path:
+                    continue
+                f = self._sysroot_path(f, '-L')
+                if f in libdirs:
+                    continue
+                libdirs.add(f)
+            elif last[f] != i:
+                continue
+            result.append(f)
+        return result
+
+    def files_for(self, names: List[str]) -> Optional[Dict[str, object]]:
+        '''
+        Returns the stamps of every file and search directory that determine
+        the result of a query for @names, or None if they can't all be known.
+        Removing or adding .pc files changes the stamp of their directory.
+        '''
+        self.refresh()
+        stamps = {d: file_stamp(d) for d in self.search_path}
+        try:
+            for name in names:
+                for pc in self._walk(name, True, ()):
+                    stamps[pc.path] = file_stamp(pc.path)
+        except PcFileException:
+            # Not-found results are covered by the directory stamps, but a
+            # package that can't be walked may depend on files we don't know.
+            if any(self.find(n) is not None for n in names):
+                return None
+        return stamps
+
+    def query(self, args: List[str], env: Dict[str, str]) -> Tuple[int, str]:
+        '''
+        Answers a pkg-config command line the same way the pkg-config
+        executable would, returning its (returncode, stripped output).
+        '''
+        modes = []
+        static = False
+        overrides = []
+        names = []
+        for a in args:
+            if a.startswith('--define-variable='):
+                k, _, v = a[len('--define-variable='):].partition('=')
+                overrides.append((k, v))
+            elif a.startswith('--variable='):
+                modes.append(('variable', a[len('--variable='):]))
+            elif a == '--static':
+                static = True
+            elif a in ('--modversion', '--cflags', '--libs', '--print-variables', '--exists'):
+                modes.append((a[2:], None))
+            elif a.startswith('--'):
+                return 1, 'Unknown option {}'.format(a)
+            else:
+                names.append(a)
+        overrides = tuple(overrides)
+        self.refresh()
+        allow_cflags = 'PKG_CONFIG_ALLOW_SYSTEM_CFLAGS' in env
+        allow_libs = 'PKG_CONFIG_ALLOW_SYSTEM_LIBS' in env
+        out = []
+        try:
+            for name in names:
+                pc = self.load(name)
+                for mode, arg in modes:
+                    if mode == 'modversion':
+                        out.append(pc.field('Version', overrides, self.sysroot))
+                    elif mode == 'variable':
+                        out.append(pc.variables(overrides, self.sysroot).get(arg, ''))
+                    elif mode == 'print-variables':
+                        out += sorted(set(pc.raw_variables) | {'pcfiledir'})
+                    elif mode == 'exists':
+                        self._walk(name, True, overrides)
+                    elif mode == 'cflags':
+                        out.append(' '.join(shlex.quote(f) for f in
+                                            self.cflags(name, overrides, allow_cflags, static)))
+                    elif mode == 'libs':
+                        out.append(' '.join(shlex.quote(f) for f in
+                                            self.libs(name, overrides, allow_libs, static)))
+        except PcFileException as e:
+            return 1, str(e)
+        return 0, '\n'.join(out).strip()
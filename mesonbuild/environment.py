@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import configparser, os, platform, re, sys, shlex, shutil, subprocess
+import configparser, os, platform, re, sys, shlex, shutil
 import typing
 
 from . import coredata
@@ -86,7 +86,7 @@ build_filename = 'meson.build'
 def detect_gcovr(version='3.1', log=False):
     gcovr_exe = 'gcovr'
     try:
-        p, found = Popen_safe([gcovr_exe, '--version'])[0:2]
+        p, found = mesonlib.program_cache.run([gcovr_exe, '--version'])[0:2]
     except (FileNotFoundError, PermissionError):
         # Doesn't exist in PATH or isn't executable
         return None, None
@@ -113,7 +113,7 @@ def find_coverage_tools():
 def detect_ninja(version='1.5', log=False):
     for n in ['ninja', 'ninja-build', 'samu']:
         try:
-            p, found = Popen_safe([n, '--version'])[0:2]
+            p, found = mesonlib.program_cache.run([n, '--version'])[0:2]
         except (FileNotFoundError, PermissionError):
             # Doesn't exist in PATH or isn't executable
             continue
@@ -366,6 +366,7 @@ class Environment:
         else:
             # Just create a fresh coredata in this case
             self.create_new_coredata(options)
+        mesonlib.program_cache = self.coredata.program_cache
 
         self.machines = MachineInfos()
         # Will be fully initialized later using compilers later.
@@ -524,7 +525,7 @@ class Environment:
         # Arguments to output compiler pre-processor defines to stdout
         # gcc, g++, and gfortran all support these arguments
         args = compiler + ['-E', '-dM', '-']
-        p, output, error = Popen_safe(args, write='', stdin=subprocess.PIPE)
+        p, output, error = mesonlib.program_cache.run(args, write='')
         if p.returncode != 0:
             raise EnvironmentException('Unable to detect GNU compiler type:\n' + output + error)
         # Parse several lines of the type:
@@ -644,7 +645,7 @@ class Environment:
             else:
                 arg = '--version'
             try:
-                p, out, err = Popen_safe(compiler + [arg])
+                p, out, err = mesonlib.program_cache.run(compiler + [arg])
             except OSError as e:
                 popen_exceptions[' '.join(compiler + [arg])] = e
                 continue
@@ -697,7 +698,7 @@ class Environment:
                 # clang
                 arg = '--version'
                 try:
-                    p, out, err = Popen_safe(compiler + [arg])
+                    p, out, err = mesonlib.program_cache.run(compiler + [arg])
                 except OSError as e:
                     popen_exceptions[' '.join(compiler + [arg])] = e
                 version = search_version(out)
@@ -776,7 +777,7 @@ class Environment:
                 raise EnvironmentException()
             arg = '--version'
             try:
-                p, out, err = Popen_safe(compiler + [arg])
+                p, out, err = mesonlib.program_cache.run(compiler + [arg])
             except OSError as e:
                 popen_exceptions[' '.join(compiler + [arg])] = e
                 continue
@@ -808,7 +809,7 @@ class Environment:
                 compiler = [compiler]
             for arg in ['--version', '-V']:
                 try:
-                    p, out, err = Popen_safe(compiler + [arg])
+                    p, out, err = mesonlib.program_cache.run(compiler + [arg])
                 except OSError as e:
                     popen_exceptions[' '.join(compiler + [arg])] = e
                     continue
@@ -873,7 +874,7 @@ class Environment:
                 compiler = [compiler]
             arg = ['--version']
             try:
-                p, out, err = Popen_safe(compiler + arg)
+                p, out, err = mesonlib.program_cache.run(compiler + arg)
             except OSError as e:
                 popen_exceptions[' '.join(compiler + arg)] = e
                 continue
@@ -900,7 +901,7 @@ class Environment:
                 compiler = [compiler]
             arg = ['--version']
             try:
-                p, out, err = Popen_safe(compiler + arg)
+                p, out, err = mesonlib.program_cache.run(compiler + arg)
             except OSError as e:
                 popen_exceptions[' '.join(compiler + arg)] = e
                 continue
@@ -926,7 +927,7 @@ class Environment:
             exelist = [self.default_java[0]]
 
         try:
-            p, out, err = Popen_safe(exelist + ['-version'])
+            p, out, err = mesonlib.program_cache.run(exelist + ['-version'])
         except OSError:
             raise EnvironmentException('Could not execute Java compiler "%s"' % ' '.join(exelist))
         if 'javac' in out or 'javac' in err:
@@ -945,7 +946,7 @@ class Environment:
             if not isinstance(comp, list):
                 comp = [comp]
             try:
-                p, out, err = Popen_safe(comp + ['--version'])
+                p, out, err = mesonlib.program_cache.run(comp + ['--version'])
             except OSError as e:
                 popen_exceptions[' '.join(comp + ['--version'])] = e
                 continue
@@ -965,7 +966,7 @@ class Environment:
             exelist = [self.default_vala[0]]
 
         try:
-            p, out = Popen_safe(exelist + ['--version'])[0:2]
+            p, out = mesonlib.program_cache.run(exelist + ['--version'])[0:2]
         except OSError:
             raise EnvironmentException('Could not execute Vala compiler "%s"' % ' '.join(exelist))
         version = search_version(out)
@@ -981,7 +982,7 @@ class Environment:
                 compiler = [compiler]
             arg = ['--version']
             try:
-                p, out = Popen_safe(compiler + arg)[0:2]
+                p, out = mesonlib.program_cache.run(compiler + arg)[0:2]
             except OSError as e:
                 popen_exceptions[' '.join(compiler + arg)] = e
                 continue
@@ -1012,7 +1013,7 @@ class Environment:
                 raise EnvironmentException('Could not find any supported D compiler.')
 
         try:
-            p, out = Popen_safe(exelist + ['--version'])[0:2]
+            p, out = mesonlib.program_cache.run(exelist + ['--version'])[0:2]
         except OSError:
             raise EnvironmentException('Could not execute D compiler "%s"' % ' '.join(exelist))
         version = search_version(out)
@@ -1043,7 +1044,7 @@ class Environment:
             exelist = [self.default_swift[0]]
 
         try:
-            p, _, err = Popen_safe(exelist + ['-v'])
+            p, _, err = mesonlib.program_cache.run(exelist + ['-v'])
         except OSError:
             raise EnvironmentException('Could not execute Swift compiler "%s"' % ' '.join(exelist))
         version = search_version(err)
@@ -1112,9 +1113,26 @@ class Environment:
         if comp is None:
             raise EnvironmentException('Tried to use unknown language "%s".' % lang)
 
-        comp.sanity_check(self.get_scratch_dir(), self)
+        self.sanity_check_compiler(comp)
         if cross_comp:
-            cross_comp.sanity_check(self.get_scratch_dir(), self)
+            self.sanity_check_compiler(cross_comp)
+
+    def sanity_check_compiler(self, comp: Compiler):
+        '''
+        Skips the sanity check if the same compiler binary already passed it
+        with the same flags, in this or any other build directory.
+        '''
+        cache = self.coredata.program_cache
+        env_vars = [compilers.compilers.cflags_mapping.get(comp.get_language()), 'CPPFLAGS', 'LDFLAGS']
+        key = cache.key('sanity_check', type(comp).__name__, tuple(comp.get_exelist()), comp.is_cross,
+                        repr(getattr(comp, 'exe_wrapper', None)),
+                        *[os.environ.get(x) for x in env_vars if x])
+        if cache.get(key):
+            mlog.debug('Sanity check of {} compiler {} is cached'.format(comp.get_display_language(),
+                                                                         ' '.join(comp.get_exelist())))
+            return
+        comp.sanity_check(self.get_scratch_dir(), self)
+        cache.set(key, True, cache.program_files(comp.get_exelist()))
 
     def detect_compilers(self, lang: str, need_cross_compiler: bool):
         (comp, cross_comp) = self.compilers_from_language(lang, need_cross_compiler)
@@ -1156,7 +1174,7 @@ class Environment:
             else:
                 arg = '--version'
             try:
-                p, out, err = Popen_safe(linker + [arg])
+                p, out, err = mesonlib.program_cache.run(linker + [arg])
             except OSError as e:
                 popen_exceptions[' '.join(linker + [arg])] = e
                 continue
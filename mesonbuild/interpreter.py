@@ -16,6 +16,7 @@ from . import environment
 from . import coredata
 from . import dependencies
 from . import mlog
+from . import mtrace
 from . import build
 from . import optinterpreter
 from . import compilers
@@ -31,11 +32,13 @@ from .interpreterbase import InterpreterObject, MutableInterpreterObject, Disabl
 from .interpreterbase import FeatureNew, FeatureDeprecated, FeatureNewKwargs
 from .interpreterbase import ObjectHolder
 from .modules import ModuleReturnValue
+from .ast import DependencyCollector, SubprojectScanner, top_level_subproject_calls
 
-import os, shutil, uuid
+import copy, os, shutil, uuid
 import re, shlex
 import subprocess
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from itertools import chain
 from pathlib import PurePath
 import functools
@@ -2019,6 +2022,17 @@ class Interpreter(InterpreterBase):
         else:
             self.default_project_options = {}
         self.project_default_options = {}
+        # Results of dependency lookups done ahead of time, see prefetch_dependencies()
+        self.prefetched_deps = {}
+        # Subprojects being configured in other threads, see start_concurrent_subprojects()
+        self.concurrent_subprojects = None
+        self.subproject_executor = None
+        # Target counts logged by a subproject configured in a worker thread
+        self.target_counts = None
+        # Found dependencies. A subproject configured in a worker thread
+        # gets its own copy, and records the identifiers it looks up.
+        self.deps = self.coredata.deps
+        self.deps_looked_up = None
         self.build_func_dict()
         # build_def_files needs to be defined before parse_project is called
         self.build_def_files = [os.path.join(self.subdir, environment.build_filename)]
@@ -2419,20 +2433,28 @@ external dependencies (including libraries) must go to "dependencies".''')
         subdir = os.path.join(self.subproject_dir, resolved)
         os.makedirs(os.path.join(self.build.environment.get_build_dir(), subdir), exist_ok=True)
         self.global_args_frozen = True
+        if self.concurrent_subprojects is None and not self.is_subproject() and \
+                self.coredata.get_builtin_option('parallel_subprojects'):
+            self.start_concurrent_subprojects()
         mlog.log()
         with mlog.nested():
             mlog.log('Executing subproject', mlog.bold(dirname), '\n')
+        current_active = self.active_projectname
+        base_build = None
         try:
             with mlog.nested():
-                new_build = self.build.copy()
-                subi = Interpreter(new_build, self.backend, dirname, subdir, self.subproject_dir,
-                                   self.modules, default_options)
-                subi.subprojects = self.subprojects
-
-                subi.subproject_stack = self.subproject_stack + [dirname]
-                current_active = self.active_projectname
-                subi.run()
-                mlog.log('Subproject', mlog.bold(dirname), 'finished.')
+                concurrent = self.take_concurrent_subproject(dirname, default_options)
+                if concurrent:
+                    subi, base_build = concurrent
+                else:
+                    new_build = self.build.copy()
+                    subi = Interpreter(new_build, self.backend, dirname, subdir, self.subproject_dir,
+                                       self.modules, default_options)
+                    subi.subprojects = self.subprojects
+
+                    subi.subproject_stack = self.subproject_stack + [dirname]
+                    subi.run()
+                    mlog.log('Subproject', mlog.bold(dirname), 'finished.')
         # Invalid code is always an error
         except InvalidCode:
             raise
@@ -2457,10 +2479,156 @@ external dependencies (including libraries) must go to "dependencies".''')
         self.subprojects.update(subi.subprojects)
         self.subprojects[dirname] = SubprojectHolder(subi, self.subproject_dir, dirname)
         self.build_def_files += subi.build_def_files
-        self.build.merge(subi.build)
+        self.build.merge(subi.build, base_build)
         self.build.subprojects[dirname] = subi.project_version
         return self.subprojects[dirname]
 
+    def subproject_snapshot(self):
+        # What a subproject may see of the state left by the subprojects
+        # configured before it
+        return (frozenset(self.build.find_overrides), tuple(self.coredata.compilers),
+                tuple(self.coredata.cross_compilers))
+
+    def start_concurrent_subprojects(self):
+        '''
+        Starts configuring, in worker threads, the subprojects that the main
+        build file calls unconditionally with literal arguments, and that do
+        not affect each other. do_subproject() then takes over their results
+        in the order in which the build file calls them, replaying their log
+        messages at that point. The threads take turns with the main thread
+        through mesonlib.configure_lock, which is released while waiting for
+        compilers and other external processes to finish.
+        '''
+        self.concurrent_subprojects = {}
+        if not mesonlib.configure_lock.is_held():
+            return
+        calls = top_level_subproject_calls(self.ast)
+        wrap_mode = self.coredata.get_builtin_option('wrap_mode')
+        subproject_dir_abs = os.path.join(self.environment.get_source_dir(), self.subproject_dir)
+        candidates = []
+        for dirname, kwargs in calls:
+            if dirname in self.subprojects or dirname in [c[0] for c in candidates]:
+                continue
+            if set(kwargs) - {'default_options', 'required', 'version'} or \
+                    not isinstance(kwargs.get('required', True), bool):
+                continue
+            try:
+                resolved = wrap.Resolver(subproject_dir_abs, wrap_mode).resolve(dirname)
+            except wrap.WrapException:
+                continue
+            subdir = os.path.join(self.subproject_dir, resolved)
+            scanner = SubprojectScanner(self.environment.get_source_dir(), subdir)
+            if not scanner.scan():
+                continue
+            if any(lang not in self.coredata.compilers for lang in scanner.languages):
+                continue
+            if self.environment.is_cross_build() and \
+                    any(lang not in self.coredata.cross_compilers for lang in scanner.languages):
+                continue
+            default_options = coredata.create_options_dict(mesonlib.stringlistify(kwargs.get('default_options', [])))
+            candidates.append((dirname, subdir, default_options))
+        if len(candidates) < 2:
+            return
+        mlog.debug('Configuring subprojects concurrently:', ', '.join(c[0] for c in candidates))
+        base_build = self.build.copy()
+        snapshot = self.subproject_snapshot()
+        base_deps = frozenset(self.coredata.deps)
+        self.subproject_executor = ThreadPoolExecutor()
+        for dirname, subdir, default_options in candidates:
+            os.makedirs(os.path.join(self.environment.get_build_dir(), subdir), exist_ok=True)
+            state = self.save_subproject_state(dirname)
+            future = self.subproject_executor.submit(self.configure_subproject, dirname, subdir,
+                                                     default_options, base_build.copy(),
+                                                     OrderedDict(self.coredata.deps))
+            self.concurrent_subprojects[dirname] = (future, default_options, base_build,
+                                                    snapshot, base_deps, state)
+
+    def save_subproject_state(self, dirname):
+        # Configuring a subproject also writes, under its name, into state
+        # that is shared with the other projects
+        prefix = dirname + ':'
+        user_options = {k: copy.deepcopy(v) for k, v in self.coredata.user_options.items()
+                        if k.startswith(prefix)}
+        cmd_line_options = {k: v for k, v in self.environment.cmd_line_options.items()
+                            if k.startswith(prefix)}
+        return user_options, cmd_line_options
+
+    def restore_subproject_state(self, dirname, state):
+        # Undoes what a subproject configured in a worker thread wrote into
+        # shared state, so that configuring it again starts afresh
+        prefix = dirname + ':'
+        for options, saved in zip((self.coredata.user_options, self.environment.cmd_line_options), state):
+            for k in [k for k in options if k.startswith(prefix)]:
+                del options[k]
+            options.update(saved)
+        mesonlib.project_meson_versions.pop(dirname, None)
+        for feature in (FeatureNew, FeatureDeprecated):
+            feature.feature_registry.pop(dirname, None)
+            feature.feature_checked.difference_update([k for k in feature.feature_checked if k[0] == dirname])
+
+    def configure_subproject(self, dirname, subdir, default_options, new_build, deps):
+        # Runs in a worker thread, see start_concurrent_subprojects()
+        with mesonlib.configure_lock.held(), mlog.capture() as records:
+            try:
+                subi = Interpreter(new_build, self.backend, dirname, subdir, self.subproject_dir,
+                                   self.modules, default_options)
+                subi.subproject_stack = self.subproject_stack + [dirname]
+                subi.target_counts = []
+                subi.deps = deps
+                subi.deps_looked_up = set()
+                subi.run()
+                mlog.log('Subproject', mlog.bold(dirname), 'finished.')
+            except Exception as e:
+                return None, e, records
+        return subi, None, records
+
+    def take_concurrent_subproject(self, dirname, default_options):
+        '''
+        Returns the interpreter of a subproject configured in a worker thread
+        and the state of the build it started from, or None if the subproject
+        has to be configured now. Errors are raised as if it had been
+        configured now.
+        '''
+        if not self.concurrent_subprojects or dirname not in self.concurrent_subprojects:
+            return None
+        future, expected_options, base_build, snapshot, base_deps, state = \
+            self.concurrent_subprojects.pop(dirname)
+        with mesonlib.configure_lock.released():
+            subi, exception, records = future.result()
+        # A dependency found since the subproject started would have been
+        # cached for it
+        cached = subi is not None and \
+            any(i in self.coredata.deps and i not in base_deps for i in subi.deps_looked_up)
+        if default_options != expected_options or snapshot != self.subproject_snapshot() or cached:
+            # Something the subproject could have seen changed in the meantime
+            mlog.debug('Configuring subproject', dirname, 'again')
+            self.restore_subproject_state(dirname, state)
+            return None
+        if subi is not None:
+            for identifier, dep in subi.deps.items():
+                self.coredata.deps.setdefault(identifier, dep)
+            # The worker counted the targets of the build it started from
+            # rather than those of the current build
+            offset = len(self.build.targets) - len(base_build.targets)
+            for count in subi.target_counts:
+                count.text = str(int(count.text) + offset)
+        mlog.replay(records)
+        if exception is not None:
+            raise exception
+        return subi, base_build
+
+    def finish_concurrent_subprojects(self):
+        if self.subproject_executor is None:
+            return
+        # Only happens when configuring fails before the build file calls
+        # all the subprojects
+        for future, *_ in self.concurrent_subprojects.values():
+            future.cancel()
+        with mesonlib.configure_lock.released():
+            self.subproject_executor.shutdown()
+        self.subproject_executor = None
+        self.concurrent_subprojects = {}
+
     def get_option_internal(self, optname):
         for d in chain(
                 [self.coredata.base_options, compilers.base_options, self.coredata.builtins],
@@ -2822,7 +2990,7 @@ external dependencies (including libraries) must go to "dependencies".''')
                           'Look here for example: http://mesonbuild.com/howtox.html#add-math-library-lm-portably\n'
                           )
 
-    def _find_cached_dep(self, name, kwargs):
+    def _get_dep_identifier(self, name, kwargs):
         # Check if we want this as a cross-dep or a native-dep
         # FIXME: Not all dependencies support such a distinction right now,
         # and we repeat this check inside dependencies that do. We need to
@@ -2833,8 +3001,13 @@ external dependencies (including libraries) must go to "dependencies".''')
         else:
             want_cross = is_cross
 
-        identifier = dependencies.get_dep_identifier(name, kwargs, want_cross)
-        cached_dep = self.coredata.deps.get(identifier)
+        return dependencies.get_dep_identifier(name, kwargs, want_cross)
+
+    def _find_cached_dep(self, name, kwargs):
+        identifier = self._get_dep_identifier(name, kwargs)
+        if self.deps_looked_up is not None:
+            self.deps_looked_up.add(identifier)
+        cached_dep = self.deps.get(identifier)
         if cached_dep:
             if not cached_dep.found():
                 mlog.log('Dependency', mlog.bold(name),
@@ -2978,14 +3151,16 @@ external dependencies (including libraries) must go to "dependencies".''')
         if name != '' and not forcefallback:
             self._handle_featurenew_dependencies(name)
             kwargs['required'] = required and not has_fallback
-            dep = dependencies.find_external_dependency(name, self.environment, kwargs)
+            dep = self._take_prefetched_dep(identifier, kwargs)
+            if dep is None:
+                dep = dependencies.find_external_dependency(name, self.environment, kwargs)
             kwargs['required'] = required
             # Only store found-deps in the cache
-            # Never add fallback deps to self.coredata.deps since we
+            # Never add fallback deps to self.deps since we
             # cannot cache them. They must always be evaluated else
             # we won't actually read all the build files.
             if dep.found():
-                self.coredata.deps[identifier] = dep
+                self.deps[identifier] = dep
                 return DependencyHolder(dep, self.subproject)
 
         if has_fallback:
@@ -2993,6 +3168,95 @@ external dependencies (including libraries) must go to "dependencies".''')
 
         return self.notfound_dependency()
 
+    def _prefetch_key(self, identifier, kwargs):
+        # The outcome of a lookup also depends on the version constraints and
+        # on the compilers that were available when it was done.
+        version = tuple(listify(kwargs.get('version', [])))
+        return (identifier, version, tuple(self.coredata.compilers),
+                tuple(self.coredata.cross_compilers))
+
+    def _take_prefetched_dep(self, identifier, kwargs):
+        key = self._prefetch_key(identifier, kwargs)
+        dep, records = self.prefetched_deps.pop(key, (None, None))
+        # Only found dependencies are reused, anything else is looked up
+        # again so that errors are reported the usual way.
+        if dep is None or not dep.found():
+            return None
+        dep.required = kwargs['required']
+        mlog.replay(records)
+        return dep
+
+    def prefetch_dependencies(self):
+        '''
+        Look up the dependencies of the main project concurrently before the
+        build files are interpreted. Only dependency() calls with literal
+        arguments are considered, the results are consumed by dependency_impl()
+        in the order in which the build files request them. The archives of
+        the subprojects that will be needed, either directly or as the fallback
+        of a dependency that was not found, are then downloaded concurrently.
+        '''
+        try:
+            collector = DependencyCollector(self.source_root, self.subdir)
+            calls = collector.analyze()
+        except Exception as e:
+            mlog.debug('Not prefetching dependencies:', str(e))
+            return
+        forcefallback = self.coredata.get_builtin_option('wrap_mode') == WrapMode.forcefallback
+        wraps = list(collector.subprojects)
+        fallbacks = {}
+        groups = OrderedDict()
+        seen = set()
+        for name, kwargs in calls:
+            if name == '' or '<' in name or '>' in name or '=' in name:
+                continue
+            fallback = kwargs.get('fallback')
+            if isinstance(fallback, list) and fallback and isinstance(fallback[0], str):
+                fallback = fallback[0]
+            else:
+                fallback = None
+            if forcefallback and 'fallback' in kwargs:
+                if fallback:
+                    wraps.append(fallback)
+                continue
+            identifier = self._get_dep_identifier(name, kwargs)
+            key = self._prefetch_key(identifier, kwargs)
+            if identifier in self.deps or key in seen:
+                continue
+            seen.add(key)
+            if fallback:
+                fallbacks[key] = fallback
+            # Lookups of the same dependency share scratch directories and
+            # caches, so they are done one after the other.
+            groups.setdefault(name.lower(), []).append((key, name, kwargs))
+
+        def lookup(group):
+            results = []
+            for key, name, kwargs in group:
+                kwargs = kwargs.copy()
+                kwargs['required'] = False
+                with mlog.capture() as records:
+                    try:
+                        dep = dependencies.find_external_dependency(name, self.environment, kwargs)
+                    except Exception as e:
+                        mlog.debug('Prefetching dependency {} failed: {}'.format(name, e))
+                        dep = None
+                results.append((key, dep, records))
+            return results
+
+        if groups:
+            with ThreadPoolExecutor() as executor:
+                for results in executor.map(lookup, groups.values()):
+                    for key, dep, records in results:
+                        if dep is not None:
+                            self.prefetched_deps[key] = (dep, records)
+                        if (dep is None or not dep.found()) and key in fallbacks:
+                            wraps.append(fallbacks[key])
+        if wraps:
+            subproject_dir_abs = os.path.join(self.environment.get_source_dir(), self.subproject_dir)
+            r = wrap.Resolver(subproject_dir_abs, self.coredata.get_builtin_option('wrap_mode'))
+            for name, e in r.prefetch(list(OrderedDict.fromkeys(wraps))):
+                mlog.debug('Prefetching subproject {} failed: {}'.format(name, e))
+
     @FeatureNew('disabler', '0.44.0')
     @noKwargs
     @noPosargs
@@ -3350,15 +3614,16 @@ This will become a hard error in the future.''' % kwargs['input'], location=self
         with open(absname, encoding='utf8') as f:
             code = f.read()
         assert(isinstance(code, str))
-        try:
-            codeblock = mparser.Parser(code, self.subdir).parse()
-        except mesonlib.MesonException as me:
-            me.file = buildfilename
-            raise me
-        try:
-            self.evaluate_codeblock(codeblock)
-        except SubdirDoneRequest:
-            pass
+        with mtrace.span(buildfilename, 'file'):
+            try:
+                codeblock = mparser.Parser(code, self.subdir).parse()
+            except mesonlib.MesonException as me:
+                me.file = buildfilename
+                raise me
+            try:
+                self.evaluate_codeblock(codeblock)
+            except SubdirDoneRequest:
+                pass
         self.subdir = prev_subdir
 
     def _get_kwarg_install_mode(self, kwargs):
@@ -3809,8 +4074,22 @@ different subdirectory.
         return self.join_path_strings(args)
 
     def run(self):
-        super().run()
-        mlog.log('Build targets in project:', mlog.bold(str(len(self.build.targets))))
+        if not self.is_subproject() and not mlog.log_fatal_warnings and \
+                self.coredata.get_builtin_option('prefetch_dependencies'):
+            self.prefetch_dependencies()
+        if not self.is_subproject() and self.coredata.get_builtin_option('parallel_subprojects'):
+            with mesonlib.configure_lock.held():
+                try:
+                    super().run()
+                finally:
+                    self.finish_concurrent_subprojects()
+        else:
+            super().run()
+        self.prefetched_deps = {}
+        target_count = mlog.bold(str(len(self.build.targets)))
+        if self.target_counts is not None:
+            self.target_counts.append(target_count)
+        mlog.log('Build targets in project:', target_count)
         FeatureNew.report(self.subproject)
         FeatureDeprecated.report(self.subproject)
         if not self.is_subproject():
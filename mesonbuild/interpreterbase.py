@@ -15,7 +15,7 @@
 # This class contains the basic functionality needed to run any interpreter
 # or an interpreter-based tool.
 
-from . import mparser, mesonlib, mlog
+from . import mparser, mesonlib, mlog, mtrace
 from . import environment, dependencies
 
 import os, copy, re
@@ -116,32 +116,51 @@ def flatten(args):
             result.append(a)
     return result
 
-def noPosargs(f):
+def _add_check(f, check, want_subproject=False):
+    '''
+    Returns a wrapper of @f that calls @check(s, node, args, kwargs, subproject)
+    before calling @f. If @f is such a wrapper already, the new wrapper calls
+    the function it wraps after running all the checks, this one first, so
+    that the arguments are looked up once however many checks are stacked.
+    '''
+    func = f
+    checks = [check]
+    # Other wrappers copy the attributes of the function they wrap
+    checked = getattr(f, 'checked-call', None)
+    if checked is not None and checked[0] is f:
+        func = checked[1]
+        checks += checked[2]
+        want_subproject = want_subproject or checked[3]
+
     @wraps(f)
     def wrapped(*wrapped_args, **wrapped_kwargs):
-        args = _get_callee_args(wrapped_args)[2]
-        if args:
-            raise InvalidArguments('Function does not take positional arguments.')
-        return f(*wrapped_args, **wrapped_kwargs)
+        callee_args = _get_callee_args(wrapped_args, want_subproject)
+        for c in checks:
+            c(*callee_args)
+        return func(*wrapped_args, **wrapped_kwargs)
+    setattr(wrapped, 'checked-call', (wrapped, func, checks, want_subproject))
     return wrapped
 
+def _check_no_posargs(s, node, args, kwargs, subproject):
+    if args:
+        raise InvalidArguments('Function does not take positional arguments.')
+
+def noPosargs(f):
+    return _add_check(f, _check_no_posargs)
+
+def _check_no_kwargs(s, node, args, kwargs, subproject):
+    if kwargs:
+        raise InvalidArguments('Function does not take keyword arguments.')
+
 def noKwargs(f):
-    @wraps(f)
-    def wrapped(*wrapped_args, **wrapped_kwargs):
-        kwargs = _get_callee_args(wrapped_args)[3]
-        if kwargs:
-            raise InvalidArguments('Function does not take keyword arguments.')
-        return f(*wrapped_args, **wrapped_kwargs)
-    return wrapped
+    return _add_check(f, _check_no_kwargs)
+
+def _check_string_args(s, node, args, kwargs, subproject):
+    assert(isinstance(args, list))
+    check_stringlist(args)
 
 def stringArgs(f):
-    @wraps(f)
-    def wrapped(*wrapped_args, **wrapped_kwargs):
-        args = _get_callee_args(wrapped_args)[2]
-        assert(isinstance(args, list))
-        check_stringlist(args)
-        return f(*wrapped_args, **wrapped_kwargs)
-    return wrapped
+    return _add_check(f, _check_string_args)
 
 def noArgsFlattening(f):
     setattr(f, 'no-args-flattening', True)
@@ -163,16 +182,14 @@ class permittedKwargs:
     def __init__(self, permitted):
         self.permitted = permitted
 
+    def check(self, s, node, args, kwargs, subproject):
+        for k in kwargs:
+            if k not in self.permitted:
+                mlog.warning('''Passed invalid keyword argument "{}".'''.format(k), location=node)
+                mlog.warning('This will become a hard error in the future.')
+
     def __call__(self, f):
-        @wraps(f)
-        def wrapped(*wrapped_args, **wrapped_kwargs):
-            s, node, args, kwargs, _ = _get_callee_args(wrapped_args)
-            for k in kwargs:
-                if k not in self.permitted:
-                    mlog.warning('''Passed invalid keyword argument "{}".'''.format(k), location=node)
-                    mlog.warning('This will become a hard error in the future.')
-            return f(*wrapped_args, **wrapped_kwargs)
-        return wrapped
+        return _add_check(f, self.check)
 
 
 class FeatureCheckBase:
@@ -194,6 +211,11 @@ class FeatureCheckBase:
         # No target version
         if tv == '':
             return
+        # Each feature needs to be checked only once for each target version
+        key = (subproject, tv, self.feature_version, self.feature_name)
+        if key in self.feature_checked:
+            return
+        self.feature_checked.add(key)
         # Target version is new enough
         if mesonlib.version_compare_condition_with_min(tv, self.feature_version):
             return
@@ -211,6 +233,15 @@ class FeatureCheckBase:
         register[self.feature_version].add(self.feature_name)
         self.log_usage_warning(tv)
 
+    @classmethod
+    def reset(cls):
+        '''
+        Forgets the features used so far, so that the next configure warns
+        about them again.
+        '''
+        cls.feature_registry.clear()
+        cls.feature_checked.clear()
+
     @classmethod
     def report(cls, subproject):
         if subproject not in cls.feature_registry:
@@ -221,15 +252,13 @@ class FeatureCheckBase:
             warning_str += '\n * {}: {}'.format(version, fv[version])
         mlog.warning(warning_str)
 
+    def check(self, s, node, args, kwargs, subproject):
+        if subproject is None:
+            raise AssertionError('{!r}'.format((s, node, args, kwargs)))
+        self.use(subproject)
+
     def __call__(self, f):
-        @wraps(f)
-        def wrapped(*wrapped_args, **wrapped_kwargs):
-            subproject = _get_callee_args(wrapped_args, want_subproject=True)[4]
-            if subproject is None:
-                raise AssertionError('{!r}'.format(wrapped_args))
-            self.use(subproject)
-            return f(*wrapped_args, **wrapped_kwargs)
-        return wrapped
+        return _add_check(f, self.check, want_subproject=True)
 
 class FeatureNew(FeatureCheckBase):
     """Checks for new features"""
@@ -237,6 +266,8 @@ class FeatureNew(FeatureCheckBase):
     #
     # Format: {subproject: {feature_version: set(feature_names)}}
     feature_registry = {}
+    # Format: set((subproject, target_version, feature_version, feature_name))
+    feature_checked = set()
 
     @staticmethod
     def get_warning_str_prefix(tv):
@@ -252,6 +283,8 @@ class FeatureDeprecated(FeatureCheckBase):
     #
     # Format: {subproject: {feature_version: set(feature_names)}}
     feature_registry = {}
+    # Format: set((subproject, target_version, feature_version, feature_name))
+    feature_checked = set()
 
     @staticmethod
     def get_warning_str_prefix(tv):
@@ -268,22 +301,19 @@ class FeatureCheckKwargsBase:
         self.feature_name = feature_name
         self.feature_version = feature_version
         self.kwargs = kwargs
+        # Which FeatureCheck class to invoke, for each of the kwargs
+        self.feature_checks = [(arg, self.feature_check_class(arg + ' arg in ' + feature_name, feature_version))
+                               for arg in kwargs]
+
+    def check(self, s, node, args, kwargs, subproject):
+        if subproject is None:
+            raise AssertionError('{!r}'.format((s, node, args, kwargs)))
+        for arg, feature_check in self.feature_checks:
+            if arg in kwargs:
+                feature_check.use(subproject)
 
     def __call__(self, f):
-        @wraps(f)
-        def wrapped(*wrapped_args, **wrapped_kwargs):
-            # Which FeatureCheck class to invoke
-            FeatureCheckClass = self.feature_check_class
-            kwargs, subproject = _get_callee_args(wrapped_args, want_subproject=True)[3:5]
-            if subproject is None:
-                raise AssertionError('{!r}'.format(wrapped_args))
-            for arg in self.kwargs:
-                if arg not in kwargs:
-                    continue
-                name = arg + ' arg in ' + self.feature_name
-                FeatureCheckClass(name, self.feature_version).use(subproject)
-            return f(*wrapped_args, **wrapped_kwargs)
-        return wrapped
+        return _add_check(f, self.check, want_subproject=True)
 
 class FeatureNewKwargs(FeatureCheckKwargsBase):
     feature_check_class = FeatureNew
@@ -403,10 +433,12 @@ class InterpreterBase:
     def run(self):
         # Evaluate everything after the first line, which is project() because
         # we already parsed that in self.parse_project()
-        try:
-            self.evaluate_codeblock(self.ast, start=1)
-        except SubdirDoneRequest:
-            pass
+        fname = os.path.join(self.subdir, environment.build_filename)
+        with mtrace.span(fname, 'file'):
+            try:
+                self.evaluate_codeblock(self.ast, start=1)
+            except SubdirDoneRequest:
+                pass
 
     def evaluate_codeblock(self, node, start=0, end=None):
         if node is None:
@@ -759,6 +791,10 @@ The result of this is undefined and will become a hard error in a future Meson r
                 posargs = flatten(posargs)
 
             self.current_node = node
+            if mtrace.enabled:
+                location = '{}:{}'.format(os.path.join(self.subdir, environment.build_filename), node.lineno)
+                with mtrace.span(func_name, 'function', {'location': location}):
+                    return func(node, posargs, kwargs)
             return func(node, posargs, kwargs)
         else:
             self.unknown_function_called(func_name)
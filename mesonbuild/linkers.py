@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .mesonlib import Popen_safe, is_windows
+from .mesonlib import is_windows
 from . import mesonlib
 
 class StaticLinker:
@@ -77,7 +77,7 @@ class ArLinker(StaticLinker):
     def __init__(self, exelist):
         self.exelist = exelist
         self.id = 'ar'
-        pc, stdo = Popen_safe(self.exelist + ['-h'])[0:2]
+        pc, stdo = mesonlib.program_cache.run(self.exelist + ['-h'])[0:2]
         # Enable deterministic builds if they are available.
         if '[D]' in stdo:
             self.std_args = ['csrD']
@@ -198,7 +198,7 @@ class CcrxLinker(StaticLinker):
     def __init__(self, exelist):
         self.exelist = exelist
         self.id = 'rlink'
-        pc, stdo = Popen_safe(self.exelist + ['-h'])[0:2]
+        pc, stdo = mesonlib.program_cache.run(self.exelist + ['-h'])[0:2]
         self.std_args = []
 
     def can_linker_accept_rsp(self):
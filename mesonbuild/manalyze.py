@@ -0,0 +1,409 @@
+# Copyright 2019 The Meson development team
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Reports where the last build of a build directory spent its time.
+
+The steps of the build and how long they took are read from the
+.ninja_log file that ninja writes, the dependencies between them from
+"ninja -t graph", and the targets and source files they belong to from
+the build data of the build directory and compile_commands.json.
+'''
+
+import os
+import re
+import json
+
+from . import build, coredata
+from .environment import detect_ninja
+from .mesonlib import MesonException, Popen_safe
+
+def add_arguments(parser):
+    parser.add_argument('builddir', nargs='?', default='.',
+                        help='The build directory (default: current directory).')
+    parser.add_argument('--top', type=int, default=10,
+                        help='How many of the slowest targets and sources to list (default: 10).')
+    parser.add_argument('--buckets', type=int, default=20,
+                        help='How many intervals to split the build into for the '
+                             'parallelism report (default: 20).')
+    parser.add_argument('--json', default=None, metavar='FILE',
+                        help='Write the full report as JSON into FILE ("-" for stdout).')
+    parser.add_argument('--trace', default=None, metavar='FILE',
+                        help='Write the build steps in the Chrome trace event format into FILE.')
+
+class BuildStep:
+    '''One command that ninja ran, with times in seconds since the build started'''
+
+    def __init__(self, outputs, start, end):
+        self.outputs = outputs
+        self.start = start
+        self.end = end
+        self.target = None
+        self.source = None
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    @property
+    def name(self):
+        return self.outputs[0]
+
+    def to_json(self):
+        return {'outputs': self.outputs,
+                'start': self.start,
+                'end': self.end,
+                'duration': self.duration,
+                'target': self.target,
+                'source': self.source,
+                }
+
+def parse_ninja_log(lines):
+    '''
+    Returns the steps of the last build recorded in the lines of a
+    .ninja_log file. Every build appends to the log, and ninja restarts its
+    clock for every build, so the last build starts after the last entry
+    that ended later than the one following it. Outputs of the same command
+    share an entry with the same times and command hash.
+    '''
+    lines = iter(lines)
+    header = next(lines, '')
+    match = re.match(r'# ninja log v(\d+)', header)
+    if not match or int(match.group(1)) < 4:
+        raise MesonException('Unsupported .ninja_log format: {!r}'.format(header.strip()))
+    entries = []
+    for line in lines:
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) < 4:
+            continue
+        start, end, output = int(fields[0]), int(fields[1]), fields[3]
+        cmdhash = fields[4] if len(fields) > 4 else output
+        if entries and end < entries[-1][1]:
+            entries = []
+        entries.append((start, end, cmdhash, output))
+    steps = {}
+    for start, end, cmdhash, output in entries:
+        key = (start, end, cmdhash)
+        if key in steps:
+            steps[key].outputs.append(output)
+        else:
+            steps[key] = BuildStep([output], start / 1000, end / 1000)
+    return sorted(steps.values(), key=lambda s: (s.start, s.end))
+
+def read_output_durations(fname):
+    '''
+    Returns how long the command producing each output in a .ninja_log
+    file took in seconds, the last time it ran. Unlike parse_ninja_log()
+    this covers outputs from all builds, not only from the last one.
+    '''
+    durations = {}
+    try:
+        with open(fname, encoding='utf-8', errors='replace') as f:
+            if not f.readline().startswith('# ninja log v'):
+                return durations
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) >= 4 and fields[0].isdigit() and fields[1].isdigit():
+                    durations[fields[3]] = (int(fields[1]) - int(fields[0])) / 1000
+    except OSError:
+        pass
+    return durations
+
+def parse_ninja_graph(text):
+    '''
+    Returns a dictionary from every file in the output of "ninja -t graph"
+    to the files that the command producing it reads. Commands with one
+    input and one output are drawn as a single arrow, others as a node of
+    their own that their inputs point at and that points at their outputs.
+    '''
+    labels = {}
+    edges = {}
+    arrows = []
+    for line in text.splitlines():
+        match = re.match(r'"([^"]+)" -> "([^"]+)"(.*)$', line)
+        if match:
+            arrows.append(match.groups())
+            continue
+        match = re.match(r'"([^"]+)" \[label="((?:[^"\\]|\\.)*)"(, shape=ellipse)?\]$', line)
+        if match:
+            if match.group(3):
+                edges[match.group(1)] = []
+            else:
+                labels[match.group(1)] = re.sub(r'\\(.)', r'\1', match.group(2))
+    # Not every file that arrows point at gets a label of its own, such as
+    # the outputs of phony commands without inputs. Those are skipped.
+    inputs = {}
+    outputs_of = {}
+    for src, dst, attrs in arrows:
+        if dst in edges:
+            edges[dst].append(src)
+        elif src in edges:
+            outputs_of.setdefault(src, []).append(dst)
+        elif src in labels and dst in labels:
+            inputs.setdefault(labels[dst], []).append(labels[src])
+    for edge, ins in edges.items():
+        for out in outputs_of.get(edge, []):
+            if out in labels:
+                inputs.setdefault(labels[out], []).extend(labels[i] for i in ins if i in labels)
+    return inputs
+
+def critical_path(steps, inputs):
+    '''
+    Returns the chain of steps that would still take the longest if every
+    step could start as soon as the ones producing its inputs finished.
+    Files that were not built by any of @steps, such as sources, phony
+    targets and outputs that were up to date, are looked through to the
+    steps producing their own inputs.
+    '''
+    producer = {}
+    for step in steps:
+        for output in step.outputs:
+            producer[output] = step
+    step_deps = {}
+    file_deps = {}
+
+    def deps_of_file(fname, visiting):
+        if fname in producer:
+            return [producer[fname]]
+        if fname in file_deps:
+            return file_deps[fname]
+        if fname in visiting:
+            return []
+        visiting.add(fname)
+        result = []
+        for i in inputs.get(fname, []):
+            result += deps_of_file(i, visiting)
+        visiting.discard(fname)
+        file_deps[fname] = result
+        return result
+
+    for step in steps:
+        deps = {}
+        for output in step.outputs:
+            for i in inputs.get(output, []):
+                deps.update((d, None) for d in deps_of_file(i, set()) if d is not step)
+        step_deps[step] = list(deps)
+
+    # Steps only depend on steps that finished before they started, so
+    # processing them by end time visits dependencies first.
+    finish = {}
+    previous = {}
+    for step in sorted(steps, key=lambda s: (s.end, s.start)):
+        best = None
+        for d in step_deps[step]:
+            if d in finish and (best is None or finish[d] > finish[best]):
+                best = d
+        finish[step] = step.duration + (finish[best] if best else 0)
+        previous[step] = best
+    if not finish:
+        return []
+    step = max(finish, key=lambda s: finish[s])
+    path = []
+    while step is not None:
+        path.append(step)
+        step = previous[step]
+    return list(reversed(path))
+
+def parallelism(steps, buckets):
+    '''
+    Returns how many steps ran on average in each of @buckets intervals of
+    equal length that the build is split into.
+    '''
+    if not steps:
+        return []
+    begin = min(s.start for s in steps)
+    end = max(s.end for s in steps)
+    width = (end - begin) / buckets
+    if width <= 0:
+        return []
+    result = []
+    for i in range(buckets):
+        lo = begin + i * width
+        hi = lo + width
+        busy = sum(max(0, min(hi, s.end) - max(lo, s.start)) for s in steps)
+        result.append({'start': lo, 'end': hi, 'average': busy / width})
+    return result
+
+def assign_lanes(steps):
+    '''Packs the steps into as few rows as possible, for the trace'''
+    lanes = []
+    result = {}
+    for step in sorted(steps, key=lambda s: (s.start, s.end)):
+        for i, lane_end in enumerate(lanes):
+            if lane_end <= step.start:
+                lanes[i] = step.end
+                result[step] = i
+                break
+        else:
+            result[step] = len(lanes)
+            lanes.append(step.end)
+    return result
+
+def get_target_dir(cdata, target):
+    if cdata.get_builtin_option('layout') == 'mirror':
+        return target.get_subdir()
+    return 'meson-out'
+
+def map_outputs(builddir, steps):
+    '''Sets the target and the source file of every step that has one'''
+    b = build.load(builddir)
+    cdata = coredata.load(builddir)
+    outputs = {}
+    private_dirs = {}
+    for target in b.get_targets().values():
+        target_dir = get_target_dir(cdata, target)
+        for output in target.get_outputs():
+            outputs[os.path.normpath(os.path.join(target_dir, output))] = target.get_id()
+        private_dirs[os.path.normpath(os.path.join(target_dir, target.get_id()))] = target.get_id()
+    sources = {}
+    try:
+        with open(os.path.join(builddir, 'compile_commands.json'), encoding='utf-8') as f:
+            for entry in json.load(f):
+                if 'output' in entry:
+                    sources[os.path.normpath(entry['output'])] = entry['file']
+    except (OSError, ValueError):
+        pass
+    for step in steps:
+        for output in step.outputs:
+            output = os.path.normpath(output)
+            if output in sources:
+                step.source = sources[output]
+            if output in outputs:
+                step.target = outputs[output]
+                continue
+            parent = os.path.dirname(output)
+            while parent and step.target is None:
+                step.target = private_dirs.get(parent)
+                parent = os.path.dirname(parent)
+
+def get_ninja_graph(builddir):
+    ninja = detect_ninja()
+    if ninja is None:
+        return None
+    try:
+        p, o, e = Popen_safe([ninja, '-C', builddir, '-t', 'graph'])
+    except OSError:
+        return None
+    if p.returncode != 0:
+        return None
+    return parse_ninja_graph(o)
+
+def analyze(builddir, top=10, buckets=20):
+    log = os.path.join(builddir, '.ninja_log')
+    if not os.path.isfile(log):
+        raise MesonException('No .ninja_log in {!r}. Build the project with ninja first.'.format(builddir))
+    with open(log, encoding='utf-8', errors='replace') as f:
+        steps = parse_ninja_log(f)
+    map_outputs(builddir, steps)
+    graph = get_ninja_graph(builddir)
+    path = critical_path(steps, graph) if graph is not None else None
+
+    wall = max((s.end for s in steps), default=0) - min((s.start for s in steps), default=0)
+    targets = {}
+    for step in steps:
+        t = targets.setdefault(step.target or '(other)', {'total': 0, 'compile': 0, 'steps': 0})
+        t['total'] += step.duration
+        t['steps'] += 1
+        if step.source is not None:
+            t['compile'] += step.duration
+    target_list = [dict(name=name, **t) for name, t in targets.items()]
+    target_list.sort(key=lambda t: t['total'], reverse=True)
+    units = sorted((s for s in steps if s.source is not None), key=lambda s: s.duration, reverse=True)
+    return {'steps': [s.to_json() for s in steps],
+            'wall_time': wall,
+            'cpu_time': sum(s.duration for s in steps),
+            'critical_path': [s.to_json() for s in path] if path is not None else None,
+            'targets': target_list[:top],
+            'translation_units': [s.to_json() for s in units[:top]],
+            'parallelism': parallelism(steps, buckets),
+            }, steps
+
+def write_trace(fname, steps):
+    lanes = assign_lanes(steps)
+    events = []
+    for step in steps:
+        event = {'name': step.name,
+                 'cat': 'compile' if step.source is not None else 'build',
+                 'ph': 'X',
+                 'pid': 0,
+                 'tid': lanes[step],
+                 'ts': round(step.start * 1e6),
+                 'dur': round(step.duration * 1e6),
+                 'args': {'outputs': step.outputs},
+                 }
+        if step.target is not None:
+            event['args']['target'] = step.target
+        if step.source is not None:
+            event['args']['source'] = step.source
+        events.append(event)
+    with open(fname, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+def print_report(report):
+    steps = report['steps']
+    wall = report['wall_time']
+    print('The last build ran {} steps in {:.2f} s, {:.2f} s of work, '
+          '{:.1f} steps at a time on average.'.format(
+              len(steps), wall, report['cpu_time'],
+              report['cpu_time'] / wall if wall else 0))
+
+    path = report['critical_path']
+    print()
+    if path is None:
+        print('Critical path: unknown, "ninja -t graph" failed.')
+    else:
+        print('Critical path: {:.2f} s'.format(sum(s['duration'] for s in path)))
+        for s in path:
+            print('  {:8.2f} s  {}{}'.format(s['duration'], s['outputs'][0],
+                                             '  [{}]'.format(s['target']) if s['target'] else ''))
+
+    print()
+    print('Slowest targets:')
+    print('  {:>10}  {:>10}  {:>6}  {}'.format('total', 'compile', 'steps', 'target'))
+    for t in report['targets']:
+        print('  {:8.2f} s  {:8.2f} s  {:6}  {}'.format(t['total'], t['compile'], t['steps'], t['name']))
+
+    print()
+    print('Slowest translation units:')
+    for s in report['translation_units']:
+        print('  {:8.2f} s  {}{}'.format(s['duration'], s['source'],
+                                         '  [{}]'.format(s['target']) if s['target'] else ''))
+
+    print()
+    print('Steps running at a time:')
+    buckets = report['parallelism']
+    scale = max((b['average'] for b in buckets), default=0)
+    for b in buckets:
+        bar = '#' * int(round(40 * b['average'] / scale)) if scale else ''
+        print('  {:8.2f} s  {:5.1f}  {}'.format(b['start'], b['average'], bar))
+
+def run(options):
+    builddir = options.builddir
+    if not os.path.isdir(os.path.join(builddir, 'meson-private')):
+        print('Current directory is not a build dir. Please specify it or '
+              'change the working directory to it.')
+        return 1
+    report, steps = analyze(builddir, options.top, options.buckets)
+    if options.trace:
+        write_trace(options.trace, steps)
+    if options.json == '-':
+        print(json.dumps(report, indent=2))
+        return 0
+    if options.json:
+        with open(options.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    print_report(report)
+    if options.trace:
+        print()
+        print('Build trace written to', options.trace)
+    return 0
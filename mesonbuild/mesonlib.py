@@ -15,16 +15,18 @@
 """A library of random helper functionality."""
 from pathlib import Path
 from typing import List
-import functools
 import sys
 import stat
 import time
 import platform, subprocess, operator, os, shutil, re
+import multiprocessing
 import collections
+import pickle
+from contextlib import contextmanager
 from enum import Enum
 from functools import lru_cache
 
-from mesonbuild import mlog
+from mesonbuild import mlog, mtrace
 
 have_fcntl = False
 have_msvcrt = False
@@ -505,20 +507,39 @@ def detect_vcs(source_dir):
                 return vcs
     return None
 
+_version_sequences_regex = re.compile(r'\d+|[a-zA-Z]+')
+
+@lru_cache(maxsize=None)
+def _parse_version(s):
+    '''
+    Returns the sequences of the version string @s and the key that orders
+    it, which are computed only once for each string.
+    '''
+    # split into numeric and alphabetic sequences, the non-alphanumeric
+    # separators between them are discarded
+    sequences = []
+    key = []
+    for seq in _version_sequences_regex.findall(s):
+        if seq.isdigit():
+            # numeric sequences have leading zeroes discarded
+            if seq[0] == '0':
+                seq = seq.lstrip('0') or '0'
+            # a non-digit sequence sorts before a digit sequence, and because
+            # leading zeros have been removed, if one number has more digits,
+            # it is greater
+            key.append((1, len(seq), seq))
+        else:
+            key.append((0, seq))
+        sequences.append(seq)
+    # if all sequences match, the version with a suffix remaining is greater,
+    # which is how tuples compare
+    return sequences, tuple(key)
+
 # a helper class which implements the same version ordering as RPM
-@functools.total_ordering
 class Version:
     def __init__(self, s):
         self._s = s
-
-        # split into numeric, alphabetic and non-alphanumeric sequences
-        sequences = re.finditer(r'(\d+|[a-zA-Z]+|[^a-zA-Z\d]+)', s)
-        # non-alphanumeric separators are discarded
-        sequences = [m for m in sequences if not re.match(r'[^a-zA-Z\d]+', m.group(1))]
-        # numeric sequences have leading zeroes discarded
-        sequences = [re.sub(r'^0+(\d)', r'\1', m.group(1), 1) for m in sequences]
-
-        self._v = sequences
+        (self._v, self._key) = _parse_version(s)
 
     def __str__(self):
         return '%s (V=%s)' % (self._s, str(self._v))
@@ -526,39 +547,29 @@ class Version:
     def __repr__(self):
         return '<Version: {}>'.format(self._s)
 
+    def __hash__(self):
+        return hash(self._key)
+
     def __lt__(self, other):
-        return self.__cmp__(other) == -1
+        return self._key < other._key
+
+    def __le__(self, other):
+        return self._key <= other._key
 
     def __eq__(self, other):
-        return self.__cmp__(other) == 0
+        return self._key == other._key
+
+    def __ne__(self, other):
+        return self._key != other._key
+
+    def __gt__(self, other):
+        return self._key > other._key
+
+    def __ge__(self, other):
+        return self._key >= other._key
 
     def __cmp__(self, other):
-        def cmp(a, b):
-            return (a > b) - (a < b)
-
-        # compare each sequence in order
-        for i in range(0, min(len(self._v), len(other._v))):
-            # sort a non-digit sequence before a digit sequence
-            if self._v[i].isdigit() != other._v[i].isdigit():
-                return 1 if self._v[i].isdigit() else -1
-
-            # compare as numbers
-            if self._v[i].isdigit():
-                # because leading zeros have already been removed, if one number
-                # has more digits, it is greater
-                c = cmp(len(self._v[i]), len(other._v[i]))
-                if c != 0:
-                    return c
-                # fallthrough
-
-            # compare lexicographically
-            c = cmp(self._v[i], other._v[i])
-            if c != 0:
-                return c
-
-        # if equal length, all components have matched, so equal
-        # otherwise, the version with a suffix remaining is greater
-        return cmp(len(self._v), len(other._v))
+        return (self._key > other._key) - (self._key < other._key)
 
 def _version_extract_cmpop(vstr2):
     if vstr2.startswith('>='):
@@ -587,6 +598,9 @@ def _version_extract_cmpop(vstr2):
 
     return (cmpop, vstr2)
 
+# Dependency checks, feature checks and compiler checks compare the same
+# few versions over and over again
+@lru_cache(maxsize=None)
 def version_compare(vstr1, vstr2):
     (cmpop, vstr2) = _version_extract_cmpop(vstr2)
     return cmpop(Version(vstr1), Version(vstr2))
@@ -763,48 +777,103 @@ def do_mesondefine(line, confdata):
         raise MesonException('#mesondefine argument "%s" is of unknown type.' % varname)
 
 
-def do_conf_file(src, dst, confdata, format, encoding='utf-8'):
-    try:
-        with open(src, encoding=encoding, newline='') as f:
-            data = f.readlines()
-    except Exception as e:
-        raise MesonException('Could not read input file %s: %s' % (src, str(e)))
+def get_conf_file_regex(format):
+    '''
+    Returns the regex that do_conf_file() uses to find the define lines,
+    escapes and template variables of @format in a single pass over the
+    whole template.
+    '''
     # Only allow (a-z, A-Z, 0-9, _, -) as valid characters for a define
     # Also allow escaping '@' with '\@'
     if format in ['meson', 'cmake@']:
-        regex = re.compile(r'(?:\\\\)+(?=\\?@)|\\@|@([-a-zA-Z0-9_]+)@')
+        start_chars = r'#\\@'
+        variable = r'(?P<escapes>(?:\\\\)+)(?=\\?@)|(?P<escape>\\@)|@(?P<var>[-a-zA-Z0-9_]+)@'
     elif format == 'cmake':
-        regex = re.compile(r'(?:\\\\)+(?=\\?\$)|\\\${|\${([-a-zA-Z0-9_]+)}')
+        start_chars = r'#\\$'
+        variable = r'(?P<escapes>(?:\\\\)+)(?=\\?\$)|(?P<escape>\\\${)|\${(?P<var>[-a-zA-Z0-9_]+)}'
     else:
         raise MesonException('Format "{}" not handled'.format(format))
 
     search_token = '#mesondefine'
     if format != 'meson':
         search_token = '#cmakedefine'
+    # Define lines are replaced whole, with their line ending, and lines
+    # may end with '\r' alone like they do for readlines().
+    define = r'(?P<define>(?<![^\r\n]){}[^\r\n]*(?:\r\n|\r|\n)?)'.format(search_token)
+    # Every alternative starts with one of a few characters, and checking
+    # for those first makes the regex skip plain text much faster.
+    return re.compile(r'(?=[{}])(?:{}|{})'.format(start_chars, define, variable))
+
+def do_conf_file(src, dst, confdata, format, encoding='utf-8'):
+    try:
+        with open(src, encoding=encoding, newline='') as f:
+            data = f.read()
+    except Exception as e:
+        raise MesonException('Could not read input file %s: %s' % (src, str(e)))
+    regex = get_conf_file_regex(format)
+    start_tag = '@'
+    if format == 'cmake':
+        start_tag = '${'
+
+    # The values that can be substituted, converted to strings only once
+    # however many times the template uses them.
+    values = {}
+    for varname in confdata.keys():
+        var = confdata.get(varname)[0]
+        if isinstance(var, (str, int)):
+            values[varname] = str(var)
 
-    result = []
     missing_variables = set()
+    found_defines = False
+
+    def replace(match):
+        nonlocal found_defines
+        kind = match.lastgroup
+        if kind == 'define':
+            found_defines = True
+            return do_mesondefine(match.group(0), confdata)
+        # Pairs of escape characters before '@' or '\@'
+        if kind == 'escapes':
+            return '\\' * (len(match.group(0)) // 2)
+        # Single escape character and '@'
+        if kind == 'escape':
+            return start_tag
+        # Template variable to be replaced
+        varname = match.group('var')
+        if varname in values:
+            return values[varname]
+        if varname in confdata:
+            msg = 'Tried to replace variable {!r} value with ' \
+                  'something other than a string or int: {!r}'
+            raise MesonException(msg.format(varname, confdata.get(varname)[0]))
+        missing_variables.add(varname)
+        return ''
+
+    result = regex.sub(replace, data)
     # Detect when the configuration data is empty and no tokens were found
     # during substitution so we can warn the user to use the `copy:` kwarg.
-    confdata_useless = not confdata.keys()
-    for line in data:
-        if line.startswith(search_token):
-            confdata_useless = False
-            line = do_mesondefine(line, confdata)
-        else:
-            line, missing = do_replacement(regex, line, format, confdata)
-            missing_variables.update(missing)
-            if missing:
-                confdata_useless = False
-        result.append(line)
+    confdata_useless = not confdata.keys() and not found_defines and not missing_variables
+    try:
+        result = result.encode(encoding)
+    except Exception as e:
+        raise MesonException('Could not write output file %s: %s' % (dst, str(e)))
+    # Reconfiguring mostly produces the same output again, so compare with
+    # it in memory and leave it alone, without writing a temporary file.
+    try:
+        if os.path.getsize(dst) == len(result):
+            with open(dst, 'rb') as f:
+                if f.read() == result:
+                    return missing_variables, confdata_useless
+    except OSError:
+        pass
     dst_tmp = dst + '~'
     try:
-        with open(dst_tmp, 'w', encoding=encoding, newline='') as f:
-            f.writelines(result)
+        with open(dst_tmp, 'wb') as f:
+            f.write(result)
     except Exception as e:
         raise MesonException('Could not write output file %s: %s' % (dst, str(e)))
     shutil.copymode(src, dst_tmp)
-    replace_if_different(dst, dst_tmp)
+    os.replace(dst_tmp, dst)
     return missing_variables, confdata_useless
 
 CONF_C_PRELUDE = '''/*
@@ -942,14 +1011,70 @@ def expand_arguments(args):
             return None
     return expended_args
 
+class ConfigureLock:
+    '''
+    Lets subprojects be configured in several threads while only one of them
+    runs Meson code at any time. A thread holds the lock while it interprets
+    build files and releases it while it waits for an external process, so
+    the compiler checks and tools run by different subprojects overlap but
+    the state they share is never modified concurrently.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def is_held(self):
+        return getattr(self.local, 'held', False)
+
+    @contextmanager
+    def held(self):
+        if self.is_held():
+            yield
+            return
+        self.lock.acquire()
+        self.local.held = True
+        try:
+            yield
+        finally:
+            self.local.held = False
+            self.lock.release()
+
+    @contextmanager
+    def released(self):
+        '''Lets other threads run, does nothing if the lock is not held'''
+        if not self.is_held():
+            yield
+            return
+        self.local.held = False
+        self.lock.release()
+        try:
+            yield
+        finally:
+            self.lock.acquire()
+            self.local.held = True
+
+configure_lock = ConfigureLock()
+
 def Popen_safe(args, write=None, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs):
+    if mtrace.enabled:
+        if isinstance(args, str):
+            cmd, prog = args, args.split(' ', 1)[0]
+        else:
+            cmd, prog = ' '.join(str(x) for x in args), str(args[0])
+        with mtrace.span(os.path.basename(prog), 'process', {'command': cmd}):
+            return _Popen_safe(args, write=write, stdout=stdout, stderr=stderr, **kwargs)
+    return _Popen_safe(args, write=write, stdout=stdout, stderr=stderr, **kwargs)
+
+def _Popen_safe(args, write=None, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs):
     import locale
     encoding = locale.getpreferredencoding()
     if sys.version_info < (3, 6) or not sys.stdout.encoding or encoding.upper() != 'UTF-8':
         return Popen_safe_legacy(args, write=write, stdout=stdout, stderr=stderr, **kwargs)
     p = subprocess.Popen(args, universal_newlines=True, close_fds=False,
                          stdout=stdout, stderr=stderr, **kwargs)
-    o, e = p.communicate(write)
+    with configure_lock.released():
+        o, e = p.communicate(write)
     return p, o, e
 
 def Popen_safe_legacy(args, write=None, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs):
@@ -957,7 +1082,8 @@ def Popen_safe_legacy(args, write=None, stdout=subprocess.PIPE, stderr=subproces
                          stdout=stdout, stderr=stderr, **kwargs)
     if write is not None:
         write = write.encode('utf-8')
-    o, e = p.communicate(write)
+    with configure_lock.released():
+        o, e = p.communicate(write)
     if o is not None:
         if sys.stdout.encoding:
             o = o.decode(encoding=sys.stdout.encoding, errors='replace').replace('\r\n', '\n')
@@ -970,61 +1096,101 @@ def Popen_safe_legacy(args, write=None, stdout=subprocess.PIPE, stderr=subproces
             e = e.decode(errors='replace').replace('\r\n', '\n')
     return p, o, e
 
-def iter_regexin_iter(regexiter, initer):
+# The template strings that substitute_values() fills in
+filenames_templates_regex = re.compile(r'(@(?:INPUT[0-9]*|OUTPUT[0-9]*|OUTDIR|PLAINNAME|BASENAME)@)')
+
+class CommandTemplate:
     '''
-    Takes each regular expression in @regexiter and tries to search for it in
-    every item in @initer. If there is a match, returns that match.
-    Else returns False.
+    A command with its template strings found once, so that it can be
+    filled in with different values in a single pass over each argument.
+    @regex must have one group, which matches a whole template string.
     '''
-    for regex in regexiter:
-        for ii in initer:
-            if not isinstance(ii, str):
-                continue
-            match = re.search(regex, ii)
-            if match:
-                return match.group()
-    return False
+    def __init__(self, command, regex):
+        # Each argument with the literal strings and template strings it
+        # is made of, alternating, or None if it has no template strings.
+        self.args = []
+        # Every template string in the command, in order
+        self.templates = []
+        for arg in command:
+            parts = None
+            if isinstance(arg, str) and '@' in arg:
+                parts = regex.split(arg)
+                if len(parts) == 1:
+                    parts = None
+                else:
+                    self.templates += parts[1::2]
+            self.args.append((arg, parts))
+
+    def substitute(self, values):
+        '''
+        Returns the command with the template strings in @values replaced by
+        their values, other template strings are left as they are. A list
+        value replaces an argument that is only that template string with
+        all of its items, and can only be part of a longer argument if it
+        has exactly one item.
+        '''
+        result = []
+        for arg, parts in self.args:
+            if parts is None:
+                result.append(arg)
+            elif len(parts) == 3 and not parts[0] and not parts[2]:
+                value = values.get(parts[1], arg)
+                if isinstance(value, list):
+                    result += value
+                else:
+                    result.append(value)
+            else:
+                newarg = parts[0]
+                for i in range(1, len(parts), 2):
+                    value = values.get(parts[i], parts[i])
+                    if isinstance(value, list):
+                        if len(value) != 1:
+                            m = 'Command has {!r} as part of a string and more than one {} file'
+                            raise MesonException(m.format(parts[i], parts[i].strip('@').lower()))
+                        value = value[0]
+                    newarg += value + parts[i + 1]
+                result.append(newarg)
+        return result
+
+def _substitute_values_check_errors(templates, values):
+    def find(*prefixes):
+        for prefix in prefixes:
+            for template in templates:
+                if template.startswith(prefix):
+                    return template
+        return None
 
-def _substitute_values_check_errors(command, values):
     # Error checking
-    inregex = ('@INPUT([0-9]+)?@', '@PLAINNAME@', '@BASENAME@')
-    outregex = ('@OUTPUT([0-9]+)?@', '@OUTDIR@')
     if '@INPUT@' not in values:
         # Error out if any input-derived templates are present in the command
-        match = iter_regexin_iter(inregex, command)
+        match = find('@INPUT', '@PLAINNAME@', '@BASENAME@')
         if match:
             m = 'Command cannot have {!r}, since no input files were specified'
             raise MesonException(m.format(match))
     else:
         if len(values['@INPUT@']) > 1:
             # Error out if @PLAINNAME@ or @BASENAME@ is present in the command
-            match = iter_regexin_iter(inregex[1:], command)
+            match = find('@PLAINNAME@', '@BASENAME@')
             if match:
                 raise MesonException('Command cannot have {!r} when there is '
                                      'more than one input file'.format(match))
         # Error out if an invalid @INPUTnn@ template was specified
-        for each in command:
-            if not isinstance(each, str):
-                continue
-            match = re.search(inregex[0], each)
-            if match and match.group() not in values:
+        for template in templates:
+            if template.startswith('@INPUT') and template not in values:
                 m = 'Command cannot have {!r} since there are only {!r} inputs'
-                raise MesonException(m.format(match.group(), len(values['@INPUT@'])))
+                raise MesonException(m.format(template, len(values['@INPUT@'])))
     if '@OUTPUT@' not in values:
         # Error out if any output-derived templates are present in the command
-        match = iter_regexin_iter(outregex, command)
+        match = find('@OUTPUT', '@OUTDIR@')
         if match:
             m = 'Command cannot have {!r} since there are no outputs'
             raise MesonException(m.format(match))
     else:
         # Error out if an invalid @OUTPUTnn@ template was specified
-        for each in command:
-            if not isinstance(each, str):
-                continue
-            match = re.search(outregex[0], each)
-            if match and match.group() not in values:
+        for template in templates:
+            if template.startswith('@OUTPUT') and template not in values:
                 m = 'Command cannot have {!r} since there are only {!r} outputs'
-                raise MesonException(m.format(match.group(), len(values['@OUTPUT@'])))
+                raise MesonException(m.format(template, len(values['@OUTPUT@'])))
 
 def substitute_values(command, values):
     '''
@@ -1036,43 +1202,9 @@ def substitute_values(command, values):
     substitute @INPUT@ and @OUTPUT@ only if they are the entire string, not
     just a part of it, and in that case we substitute *all* of them.
     '''
-    # Error checking
-    _substitute_values_check_errors(command, values)
-    # Substitution
-    outcmd = []
-    rx_keys = [re.escape(key) for key in values if key not in ('@INPUT@', '@OUTPUT@')]
-    value_rx = re.compile('|'.join(rx_keys)) if rx_keys else None
-    for vv in command:
-        if not isinstance(vv, str):
-            outcmd.append(vv)
-        elif '@INPUT@' in vv:
-            inputs = values['@INPUT@']
-            if vv == '@INPUT@':
-                outcmd += inputs
-            elif len(inputs) == 1:
-                outcmd.append(vv.replace('@INPUT@', inputs[0]))
-            else:
-                raise MesonException("Command has '@INPUT@' as part of a "
-                                     "string and more than one input file")
-        elif '@OUTPUT@' in vv:
-            outputs = values['@OUTPUT@']
-            if vv == '@OUTPUT@':
-                outcmd += outputs
-            elif len(outputs) == 1:
-                outcmd.append(vv.replace('@OUTPUT@', outputs[0]))
-            else:
-                raise MesonException("Command has '@OUTPUT@' as part of a "
-                                     "string and more than one output file")
-        # Append values that are exactly a template string.
-        # This is faster than a string replace.
-        elif vv in values:
-            outcmd.append(values[vv])
-        # Substitute everything else with replacement
-        elif value_rx:
-            outcmd.append(value_rx.sub(lambda m: values[m.group(0)], vv))
-        else:
-            outcmd.append(vv)
-    return outcmd
+    template = CommandTemplate(command, filenames_templates_regex)
+    _substitute_values_check_errors(template.templates, values)
+    return template.substitute(values)
 
 def get_filenames_templates_dict(inputs, outputs):
     '''
@@ -1266,6 +1398,205 @@ class BuildDirLock:
             msvcrt.locking(self.lockfile.fileno(), msvcrt.LK_UNLCK, 1)
         self.lockfile.close()
 
+def determine_worker_count():
+    try:
+        # Fails in some weird environments such as Debian
+        # reproducible build.
+        return multiprocessing.cpu_count()
+    except Exception:
+        return 1
+
+def get_user_cache_dir():
+    '''
+    Returns the per-user directory in which Meson keeps caches that are shared
+    between build directories. Setting MESON_CACHE_DIR overrides the location;
+    setting it to an empty string disables these caches and returns None.
+    '''
+    cachedir = os.environ.get('MESON_CACHE_DIR')
+    if cachedir is not None:
+        return cachedir or None
+    if is_windows():
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~/AppData/Local'))
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(base, 'meson')
+
+def file_stamp(path):
+    '''
+    Returns a tuple identifying the current contents of @path cheaply, without
+    reading it, or None if it does not exist. Used to validate cache entries.
+    '''
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+# Every PersistentCache created, so they can all be written out at once
+_persistent_caches = []
+
+class PersistentCache:
+    '''
+    A dictionary pickled into the user cache directory. Loading is lazy and
+    saving is atomic, so concurrent Meson processes can share one file: the
+    last writer wins, which at worst drops some entries. Entries are only
+    valid for the Meson version that wrote them.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.filename = None
+        self.data = None
+        self.dirty = False
+        _persistent_caches.append(self)
+
+    def _load(self):
+        if self.data is not None:
+            return self.data
+        self.data = {}
+        self.filename = None
+        cachedir = get_user_cache_dir()
+        if not cachedir:
+            return self.data
+        self.filename = os.path.join(cachedir, self.name + '.dat')
+        from . import coredata
+        try:
+            with open(self.filename, 'rb') as f:
+                version, data = pickle.load(f)
+            if version == coredata.version and isinstance(data, dict):
+                self.data = data
+        except Exception:
+            # A missing, truncated or foreign cache file is just a cache miss.
+            pass
+        return self.data
+
+    def get(self, key, default=None):
+        return self._load().get(key, default)
+
+    def __setitem__(self, key, value):
+        self._load()[key] = value
+        self.dirty = True
+
+    def __delitem__(self, key):
+        if key in self._load():
+            del self.data[key]
+            self.dirty = True
+
+    def clear(self):
+        '''Forgets the in-memory contents so the next access reloads the file'''
+        self.data = None
+        self.dirty = False
+
+    def save(self):
+        if self.filename is None or not self.dirty:
+            return
+        from . import coredata
+        try:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            tempfilename = '{}.{}~'.format(self.filename, os.getpid())
+            with open(tempfilename, 'wb') as f:
+                pickle.dump((coredata.version, self.data), f)
+            os.replace(tempfilename, self.filename)
+            self.dirty = False
+        except OSError as e:
+            mlog.debug('Could not write cache file {!r}: {}'.format(self.filename, e))
+
+def save_persistent_caches():
+    for cache in _persistent_caches:
+        cache.save()
+
+class ProgramCache:
+    '''
+    Remembers where programs were found in PATH and what they printed when
+    probed, so that reconfiguring does not have to search for them and spawn
+    them again. Entries are keyed on the environment that affects the result
+    and are only reused while the directories in PATH and the files involved
+    are unchanged. Each build directory keeps one in its coredata, and all
+    of them share their entries through the user cache directory so that new
+    build directories can skip detecting the same toolchain again.
+    '''
+
+    # Variables that change which program is found or what it prints
+    env_vars = ('PATH', 'LANG', 'LC_ALL', 'LC_MESSAGES')
+    # Entries of all build directories, keyed like the entries of each one
+    shared = PersistentCache('programs')
+
+    def __init__(self):
+        self.entries = {}
+
+    def key(self, *args):
+        return args + tuple(os.environ.get(x) for x in self.env_vars)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = ProgramCache.shared.get(key)
+            if entry is None:
+                return None
+        stamps, value = entry
+        if any(file_stamp(f) != stamp for f, stamp in stamps):
+            self.entries.pop(key, None)
+            return None
+        self.entries[key] = entry
+        return value
+
+    def set(self, key, value, files):
+        dirs = [x for x in os.environ.get('PATH', '').split(os.pathsep) if x]
+        entry = (tuple((x, file_stamp(x)) for x in dirs + files), value)
+        self.entries[key] = entry
+        ProgramCache.shared[key] = entry
+
+    def search(self, name, search_dir, func):
+        '''
+        Returns func(name, search_dir), which must return the command list
+        found for the program @name, from the cache if possible.
+        '''
+        # Paths are resolved relative to the current directory, only bare
+        # names are looked up in PATH
+        if has_path_sep(name):
+            return func(name, search_dir)
+        key = self.key('search', name, search_dir)
+        command = self.get(key)
+        if command is None:
+            command = func(name, search_dir)
+            files = [x for x in command if x is not None and os.path.isabs(x)]
+            if search_dir is not None:
+                files.append(search_dir)
+            self.set(key, command, files)
+        return list(command)
+
+    def run(self, args, write=None):
+        '''
+        A cached Popen_safe() for commands whose output only depends on the
+        programs being run, such as version queries. The returned process is
+        a subprocess.CompletedProcess when the result came from the cache.
+        '''
+        key = self.key('run', tuple(args), write)
+        res = self.get(key)
+        if res is not None:
+            returncode, out, err = res
+            return subprocess.CompletedProcess(args, returncode, out, err), out, err
+        if write is None:
+            p, out, err = Popen_safe(args)
+        else:
+            p, out, err = Popen_safe(args, write=write, stdin=subprocess.PIPE)
+        self.set(key, (p.returncode, out, err), self.program_files(args))
+        return p, out, err
+
+    @staticmethod
+    def program_files(args):
+        'Returns the files of the programs in the command line @args'
+        files = []
+        for i in args:
+            if not i.startswith('-'):
+                i = shutil.which(i)
+                if i is not None:
+                    files.append(os.path.abspath(i))
+        return files
+
+# The ProgramCache of the build directory being configured
+program_cache = ProgramCache()
+
 def relpath(path, start):
     # On Windows a relative path can't be evaluated for paths on two different
     # drives (i.e. c:\foo and f:\bar).  The only thing left to do is to use the
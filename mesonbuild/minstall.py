@@ -12,12 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import sys, pickle, os, shutil, subprocess, errno
+import sys, pickle, os, shutil, subprocess, errno, stat
 import shlex
+import functools
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from glob import glob
 from .scripts import depfixer
 from .scripts import destdir_join
-from .mesonlib import is_windows, Popen_safe
+from .mesonlib import is_windows, Popen_safe, MesonException, determine_worker_count
 from .mtest import rebuild_all
 try:
     from __main__ import __file__ as main_file
@@ -32,6 +36,11 @@ build definitions so that it will not break when the change happens.'''
 
 selinux_updates = []
 
+copy_strategies = ['auto', 'copy', 'reflink', 'hardlink', 'symlink']
+
+# From linux/fs.h
+FICLONE = 0x40049409
+
 def add_arguments(parser):
     parser.add_argument('-C', default='.', dest='wd',
                         help='directory to cd into before running')
@@ -39,6 +48,13 @@ def add_arguments(parser):
                         help='Do not rebuild before installing.')
     parser.add_argument('--only-changed', default=False, action='store_true',
                         help='Only overwrite files that are older than the copied file.')
+    parser.add_argument('--incremental', default=False, action='store_true',
+                        help='Do not install files again that have not changed since the last install.')
+    parser.add_argument('--num-processes', default=determine_worker_count(), type=int,
+                        help='How many files to install in parallel, 1 to install them '
+                             'one after the other (default: number of CPU cores).')
+    parser.add_argument('--copy-strategy', default='auto', choices=copy_strategies,
+                        help='How to install files that are not modified once installed (default: %(default)s).')
 
 class DirMaker:
     def __init__(self, lf):
@@ -183,6 +199,49 @@ def get_destdir_path(d, path):
     return output
 
 
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def file_stat(path):
+    try:
+        st = os.stat(path, follow_symlinks=False)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+def reflink_file(from_file, to_file):
+    '''
+    Makes @to_file a copy-on-write clone of @from_file. Raises OSError if
+    the file system does not support it.
+    '''
+    import fcntl
+    with open(from_file, 'rb') as src, open(to_file, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+def copy_file_range(from_file, to_file):
+    '''
+    Copies @from_file to @to_file inside the kernel, which may share the
+    data blocks on file systems that support it. Raises OSError if the
+    kernel cannot copy between these files.
+    '''
+    with open(from_file, 'rb') as src, open(to_file, 'wb') as dst:
+        while os.copy_file_range(src.fileno(), dst.fileno(), 1 << 30):
+            pass
+
+def keeps_mode(path, install_mode, umask):
+    '''Checks whether set_mode() leaves the mode and owner of @path as is'''
+    if install_mode is not None and (install_mode.perms_s or install_mode.owner or install_mode.group) is not None:
+        return False
+    if umask == 'preserve':
+        return True
+    st = os.stat(path)
+    perms = 0o777 if st.st_mode & 0o111 else 0o666
+    return stat.S_IMODE(st.st_mode) == perms & ~umask
+
 def check_for_stampfile(fname):
     '''Some languages e.g. Rust have output files
     whose names are not known at configure time.
@@ -214,6 +273,150 @@ class Installer:
         self.did_install_something = False
         self.options = options
         self.lf = lf
+        self.executor = None
+        # Results of the jobs run by the executor, in submission order, and
+        # the files they install
+        self.jobs = []
+        self.pending_files = set()
+        self.job = threading.local()
+        # What was installed where by the last incremental install, and by
+        # this one
+        self.old_state = {}
+        self.state = {}
+        # Ways of copying found not to work between two devices
+        self.failed_copies = set()
+
+    def log(self, line):
+        '''
+        Appends @line to the install log. Lines logged by jobs and while jobs
+        are pending are written out by wait_jobs(), in submission order.
+        '''
+        if getattr(self.job, 'log', None) is not None:
+            self.job.log.append(line)
+        elif self.jobs:
+            self.jobs.append(self.done_job([], [line]))
+        else:
+            append_to_log(self.lf, line)
+
+    def output(self, msg):
+        '''Prints @msg, in submission order like log()'''
+        if getattr(self.job, 'output', None) is not None:
+            self.job.output.append(msg)
+        elif self.jobs:
+            self.jobs.append(self.done_job([msg], []))
+        else:
+            print(msg)
+
+    @staticmethod
+    def done_job(output, lines):
+        f = Future()
+        f.set_result((output, lines, None))
+        return f
+
+    def submit_file(self, from_file, to_file, *args):
+        '''
+        Calls install_file() in a worker thread if installing in parallel. Its
+        output and install log lines are kept aside until wait_jobs(), so that
+        they do not depend on the number of workers.
+        '''
+        if self.executor is None:
+            self.install_file(from_file, to_file, *args)
+            return
+        if to_file in self.pending_files:
+            # Installed twice, the last one wins
+            self.wait_jobs()
+        self.pending_files.add(to_file)
+        self.jobs.append(self.executor.submit(self.run_job, self.install_file, from_file, to_file, *args))
+
+    def run_job(self, func, *args):
+        # Errors are returned along with what the job printed before them,
+        # for wait_jobs() to raise them in submission order
+        output = self.job.output = []
+        lines = self.job.log = []
+        exception = None
+        try:
+            func(*args)
+        except Exception as e:
+            exception = e
+        self.job.output = self.job.log = None
+        return output, lines, exception
+
+    def wait_jobs(self):
+        jobs = self.jobs
+        self.jobs = []
+        self.pending_files = set()
+        for f in jobs:
+            output, lines, exception = f.result()
+            for msg in output:
+                print(msg)
+            for line in lines:
+                append_to_log(self.lf, line)
+            if exception is not None:
+                raise exception
+
+    def load_state(self, filename):
+        if self.options.incremental:
+            try:
+                with open(filename, 'rb') as f:
+                    self.old_state = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                self.old_state = {}
+
+    def save_state(self, filename):
+        if self.options.incremental:
+            with open(filename, 'wb') as f:
+                pickle.dump(self.state, f)
+        elif os.path.exists(filename):
+            # Files installed now were not recorded, so do not trust the
+            # rest either
+            os.remove(filename)
+
+    def is_up_to_date(self, from_file, to_file, params):
+        '''
+        Checks whether @to_file was installed from @from_file with @params by
+        the last incremental install and neither of them changed since. The
+        source may have been rewritten with the same contents.
+        '''
+        entry = self.old_state.get(to_file)
+        if entry is None:
+            return False
+        old_from_file, old_params, from_stat, digest, to_stat = entry
+        if old_from_file != from_file or old_params != params or file_stat(to_file) != to_stat:
+            return False
+        new_from_stat = file_stat(from_file)
+        if new_from_stat != from_stat:
+            if new_from_stat is None or new_from_stat[0] != from_stat[0] or file_digest(from_file) != digest:
+                return False
+            entry = (from_file, params, new_from_stat, digest, to_stat)
+        self.state[to_file] = entry
+        return True
+
+    def record_state(self, from_file, to_file, params):
+        if self.options.incremental and not os.path.islink(from_file):
+            self.state[to_file] = (from_file, params, file_stat(from_file),
+                                   file_digest(from_file), file_stat(to_file))
+
+    def install_file(self, from_file, to_file, install_mode, umask, fixup=None, params=()):
+        '''
+        Installs @from_file to @to_file and sets its mode, then calls @fixup
+        with the installed file to strip it or change its rpath. @params must
+        describe what @fixup does; in incremental mode the file is skipped if
+        it was installed with the same @params and nothing changed since.
+        '''
+        params = (install_mode and (install_mode.perms_s, install_mode.owner, install_mode.group),
+                  umask) + tuple(params)
+        if self.options.incremental and self.is_up_to_date(from_file, to_file, params):
+            self.output('Keeping up-to-date file %s' % to_file)
+            self.log(to_file)
+            return
+        # Installed files that are modified in place must not share their
+        # data with the source
+        link = fixup is None and not os.path.islink(from_file) and keeps_mode(from_file, install_mode, umask)
+        self.do_copyfile(from_file, to_file, link)
+        set_mode(to_file, install_mode, umask)
+        if fixup is not None:
+            fixup(to_file)
+        self.record_state(from_file, to_file, params)
 
     def should_preserve_existing_file(self, from_file, to_file):
         if not self.options.only_changed:
@@ -225,7 +428,40 @@ class Installer:
         to_time = os.stat(to_file).st_mtime
         return from_time <= to_time
 
-    def do_copyfile(self, from_file, to_file):
+    def copy_file(self, from_file, to_file, link):
+        '''
+        Copies @from_file to @to_file with the strategy chosen by the user,
+        falling back to the next cheapest one when it is not possible. If
+        @link is false, @to_file must not share its data with @from_file.
+        '''
+        strategy = self.options.copy_strategy
+        devices = (os.stat(from_file).st_dev, os.stat(os.path.dirname(to_file)).st_dev)
+        methods = []
+        if link and strategy == 'symlink':
+            methods.append(('symlink', lambda: os.symlink(os.path.abspath(from_file), to_file)))
+        if link and strategy == 'hardlink':
+            methods.append(('hardlink', lambda: os.link(from_file, to_file)))
+        if strategy != 'copy' and sys.platform.startswith('linux'):
+            methods.append(('reflink', lambda: reflink_file(from_file, to_file)))
+        if strategy not in ('copy', 'reflink') and hasattr(os, 'copy_file_range'):
+            methods.append(('copy_file_range', lambda: copy_file_range(from_file, to_file)))
+        for name, method in methods:
+            if (name, devices) in self.failed_copies:
+                continue
+            try:
+                method()
+            except OSError:
+                self.failed_copies.add((name, devices))
+                if os.path.lexists(to_file):
+                    os.remove(to_file)
+                continue
+            if name not in ('symlink', 'hardlink'):
+                shutil.copystat(from_file, to_file)
+            return
+        shutil.copyfile(from_file, to_file)
+        shutil.copystat(from_file, to_file)
+
+    def do_copyfile(self, from_file, to_file, link=False):
         outdir = os.path.split(to_file)[0]
         if not os.path.isfile(from_file) and not os.path.islink(from_file):
             raise RuntimeError('Tried to install something that isn\'t a file:'
@@ -238,11 +474,14 @@ class Installer:
                 raise RuntimeError('Destination {!r} already exists and is not '
                                    'a file'.format(to_file))
             if self.should_preserve_existing_file(from_file, to_file):
-                append_to_log(self.lf, '# Preserving old file %s\n' % to_file)
-                print('Preserving existing file %s' % to_file)
+                self.log('# Preserving old file %s\n' % to_file)
+                self.output('Preserving existing file %s' % to_file)
                 return False
             os.remove(to_file)
-        print('Installing %s to %s' % (from_file, outdir))
+        elif os.path.islink(to_file):
+            # Dangling symlink, possibly installed with --copy-strategy=symlink
+            os.remove(to_file)
+        self.output('Installing %s to %s' % (from_file, outdir))
         if os.path.islink(from_file):
             if not os.path.exists(from_file):
                 # Dangling symlink. Replicate as is.
@@ -250,14 +489,13 @@ class Installer:
             else:
                 # Remove this entire branch when changing the behaviour to duplicate
                 # symlinks rather than copying what they point to.
-                print(symlink_warning)
+                self.output(symlink_warning)
                 shutil.copyfile(from_file, to_file)
                 shutil.copystat(from_file, to_file)
         else:
-            shutil.copyfile(from_file, to_file)
-            shutil.copystat(from_file, to_file)
+            self.copy_file(from_file, to_file, link)
         selinux_updates.append(to_file)
-        append_to_log(self.lf, to_file)
+        self.log(to_file)
         return True
 
     def do_copydir(self, data, src_dir, dst_dir, exclude, install_mode):
@@ -304,6 +542,7 @@ class Installer:
                 if os.path.isdir(abs_dst):
                     continue
                 if os.path.exists(abs_dst):
+                    self.wait_jobs()
                     print('Tried to copy directory %s but a file of that name already exists.' % abs_dst)
                     sys.exit(1)
                 data.dirmaker.makedirs(abs_dst)
@@ -316,15 +555,14 @@ class Installer:
                     continue
                 abs_dst = os.path.join(dst_dir, filepart)
                 if os.path.isdir(abs_dst):
-                    print('Tried to copy file %s but a directory of that name already exists.' % abs_dst)
+                    self.output('Tried to copy file %s but a directory of that name already exists.' % abs_dst)
                 parent_dir = os.path.dirname(abs_dst)
                 if not os.path.isdir(parent_dir):
                     os.mkdir(parent_dir)
                     shutil.copystat(os.path.dirname(abs_src), parent_dir)
                 # FIXME: what about symlinks?
-                self.do_copyfile(abs_src, abs_dst)
-                set_mode(abs_dst, install_mode, data.install_umask)
-                append_to_log(self.lf, abs_dst)
+                self.submit_file(abs_src, abs_dst, install_mode, data.install_umask)
+                self.log(abs_dst)
 
     def do_install(self, datafilename):
         with open(datafilename, 'rb') as ifile:
@@ -335,15 +573,32 @@ class Installer:
         if d.install_umask != 'preserve':
             os.umask(d.install_umask)
 
+        statefilename = os.path.join(os.path.dirname(datafilename), 'install-state.dat')
+        self.load_state(statefilename)
+
         self.did_install_something = False
         try:
             d.dirmaker = DirMaker(self.lf)
             with d.dirmaker:
-                self.install_subdirs(d) # Must be first, because it needs to delete the old subtree.
-                self.install_targets(d)
-                self.install_headers(d)
-                self.install_man(d)
-                self.install_data(d)
+                if self.options.num_processes > 1:
+                    # Like meson test, this uses threads despite the option
+                    # name. The jobs spend their time in system calls and in
+                    # strip, which release the GIL, while worker processes
+                    # would have to be forked from this multi-threaded
+                    # process and be sent the install data.
+                    self.executor = ThreadPoolExecutor(max_workers=self.options.num_processes)
+                try:
+                    self.install_subdirs(d) # Must be first, because it needs to delete the old subtree.
+                    self.install_targets(d)
+                    self.install_headers(d)
+                    self.install_man(d)
+                    self.install_data(d)
+                    self.wait_jobs()
+                finally:
+                    if self.executor is not None:
+                        self.executor.shutdown()
+                        self.executor = None
+                self.save_state(statefilename)
                 restore_selinux_contexts()
                 self.run_install_script(d)
                 if not self.did_install_something:
@@ -361,7 +616,7 @@ class Installer:
         for (src_dir, dst_dir, mode, exclude) in d.install_subdirs:
             self.did_install_something = True
             full_dst_dir = get_destdir_path(d, dst_dir)
-            print('Installing subdir %s to %s' % (src_dir, full_dst_dir))
+            self.output('Installing subdir %s to %s' % (src_dir, full_dst_dir))
             d.dirmaker.makedirs(full_dst_dir, exist_ok=True)
             self.do_copydir(d, src_dir, full_dst_dir, exclude, mode)
 
@@ -373,8 +628,7 @@ class Installer:
             mode = i[2]
             outdir = os.path.dirname(outfilename)
             d.dirmaker.makedirs(outdir, exist_ok=True)
-            self.do_copyfile(fullfilename, outfilename)
-            set_mode(outfilename, mode, d.install_umask)
+            self.submit_file(fullfilename, outfilename, mode, d.install_umask)
 
     def install_man(self, d):
         for m in d.man:
@@ -384,8 +638,7 @@ class Installer:
             outdir = os.path.dirname(outfilename)
             d.dirmaker.makedirs(outdir, exist_ok=True)
             install_mode = m[2]
-            self.do_copyfile(full_source_filename, outfilename)
-            set_mode(outfilename, install_mode, d.install_umask)
+            self.submit_file(full_source_filename, outfilename, install_mode, d.install_umask)
 
     def install_headers(self, d):
         for t in d.headers:
@@ -396,8 +649,7 @@ class Installer:
             outfilename = os.path.join(outdir, fname)
             install_mode = t[2]
             d.dirmaker.makedirs(outdir, exist_ok=True)
-            self.do_copyfile(fullfilename, outfilename)
-            set_mode(outfilename, install_mode, d.install_umask)
+            self.submit_file(fullfilename, outfilename, install_mode, d.install_umask)
 
     def run_install_script(self, d):
         env = {'MESON_SOURCE_ROOT': d.source_dir,
@@ -430,7 +682,7 @@ class Installer:
             if not os.path.exists(t.fname):
                 # For example, import libraries of shared modules are optional
                 if t.optional:
-                    print('File {!r} not found, skipping'.format(t.fname))
+                    self.output('File {!r} not found, skipping'.format(t.fname))
                     continue
                 else:
                     raise RuntimeError('File {!r} could not be found'.format(t.fname))
@@ -447,24 +699,18 @@ class Installer:
             if not os.path.exists(fname):
                 raise RuntimeError('File {!r} could not be found'.format(fname))
             elif os.path.isfile(fname):
-                self.do_copyfile(fname, outname)
-                set_mode(outname, install_mode, d.install_umask)
-                if should_strip and d.strip_bin is not None:
-                    if fname.endswith('.jar'):
-                        print('Not stripping jar target:', os.path.basename(fname))
-                        continue
-                    print('Stripping target {!r}'.format(fname))
-                    ps, stdo, stde = Popen_safe(d.strip_bin + [outname])
-                    if ps.returncode != 0:
-                        print('Could not strip file.\n')
-                        print('Stdout:\n%s\n' % stdo)
-                        print('Stderr:\n%s\n' % stde)
-                        sys.exit(1)
+                if should_strip and d.strip_bin is not None and fname.endswith('.jar'):
+                    self.output('Not stripping jar target: ' + os.path.basename(fname))
+                    self.submit_file(fname, outname, install_mode, d.install_umask)
+                    continue
+                fixup = functools.partial(self.fix_target, d, fname, should_strip, install_rpath,
+                                          final_path, install_name_mappings)
+                params = (should_strip and d.strip_bin, install_rpath, final_path, install_name_mappings)
+                self.submit_file(fname, outname, install_mode, d.install_umask, fixup, params)
                 pdb_filename = os.path.splitext(fname)[0] + '.pdb'
                 if not should_strip and os.path.exists(pdb_filename):
                     pdb_outname = os.path.splitext(outname)[0] + '.pdb'
-                    self.do_copyfile(pdb_filename, pdb_outname)
-                    set_mode(pdb_outname, install_mode, d.install_umask)
+                    self.submit_file(pdb_filename, pdb_outname, install_mode, d.install_umask)
             elif os.path.isdir(fname):
                 fname = os.path.join(d.build_dir, fname.rstrip('/'))
                 outname = os.path.join(outdir, os.path.basename(fname))
@@ -480,21 +726,29 @@ class Installer:
                     except FileNotFoundError:
                         pass
                     os.symlink(to, symlinkfilename)
-                    append_to_log(self.lf, symlinkfilename)
+                    self.log(symlinkfilename)
                 except (NotImplementedError, OSError):
                     if not printed_symlink_error:
-                        print("Symlink creation does not work on this platform. "
-                              "Skipping all symlinking.")
+                        self.output("Symlink creation does not work on this platform. "
+                                    "Skipping all symlinking.")
                         printed_symlink_error = True
-            if os.path.isfile(outname):
-                try:
-                    depfixer.fix_rpath(outname, install_rpath, final_path,
-                                       install_name_mappings, verbose=False)
-                except SystemExit as e:
-                    if isinstance(e.code, int) and e.code == 0:
-                        pass
-                    else:
-                        raise
+
+    def fix_target(self, d, fname, should_strip, install_rpath, final_path, install_name_mappings, outname):
+        if should_strip and d.strip_bin is not None:
+            self.output('Stripping target {!r}'.format(fname))
+            ps, stdo, stde = Popen_safe(d.strip_bin + [outname])
+            if ps.returncode != 0:
+                self.output('Stdout:\n%s\n' % stdo)
+                self.output('Stderr:\n%s\n' % stde)
+                raise MesonException('Could not strip file {!r}.'.format(outname))
+        try:
+            depfixer.fix_rpath(outname, install_rpath, final_path,
+                               install_name_mappings, verbose=False)
+        except SystemExit as e:
+            if isinstance(e.code, int) and e.code == 0:
+                pass
+            else:
+                raise
 
 def run(opts):
     datafilename = 'meson-private/install.dat'
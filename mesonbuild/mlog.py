@@ -17,6 +17,7 @@ import io
 import sys
 import time
 import platform
+import threading
 from contextlib import contextmanager
 
 """This is (mostly) a standalone module used to write logging
@@ -49,6 +50,8 @@ log_timestamp_start = None
 log_fatal_warnings = False
 log_disable_stdout = False
 log_errors_only = False
+# Per-thread list of log calls being recorded by capture()
+_capture = threading.local()
 
 def disable():
     global log_disable_stdout
@@ -155,7 +158,35 @@ def force_print(*args, **kwargs):
         cleaned = raw.encode('ascii', 'replace').decode('ascii')
         print(cleaned, end='')
 
+def _captured(func, args, kwargs):
+    records = getattr(_capture, 'records', None)
+    if records is None:
+        return False
+    records.append((func, args, kwargs))
+    return True
+
+@contextmanager
+def capture():
+    '''
+    Records the debug() and log() calls made by the current thread instead of
+    writing them out, so that work done in a worker thread can be logged
+    later in a deterministic order with replay().
+    '''
+    previous = getattr(_capture, 'records', None)
+    records = []
+    _capture.records = records
+    try:
+        yield records
+    finally:
+        _capture.records = previous
+
+def replay(records):
+    for func, args, kwargs in records:
+        func(*args, **kwargs)
+
 def debug(*args, **kwargs):
+    if _captured(debug, args, kwargs):
+        return
     arr = process_markup(args, False)
     if log_file is not None:
         print(*arr, file=log_file, **kwargs) # Log file never gets ANSI codes.
@@ -163,6 +194,8 @@ def debug(*args, **kwargs):
 
 def log(*args, is_error=False, **kwargs):
     global log_errors_only
+    if _captured(log, args, dict(kwargs, is_error=is_error)):
+        return
     arr = process_markup(args, False)
     if log_file is not None:
         print(*arr, file=log_file, **kwargs) # Log file never gets ANSI codes.
@@ -229,11 +262,24 @@ def format_list(list):
     else:
         return ''
 
+def _nest(depth):
+    global log_depth
+    log_depth += depth
+
 @contextmanager
 def nested():
-    global log_depth
-    log_depth += 1
+    records = getattr(_capture, 'records', None)
+    if records is not None:
+        # Nesting is replayed along with the messages, the depth of the
+        # current output is not changed
+        records.append((_nest, (1,), {}))
+        try:
+            yield
+        finally:
+            records.append((_nest, (-1,), {}))
+        return
+    _nest(1)
     try:
         yield
     finally:
-        log_depth -= 1
+        _nest(-1)
@@ -20,9 +20,9 @@ import platform
 import cProfile as profile
 import argparse
 
-from . import environment, interpreter, mesonlib
+from . import environment, interpreter, interpreterbase, mesonlib
 from . import build
-from . import mlog, coredata
+from . import mlog, mtrace, coredata
 from . import mintro
 from .mconf import make_lower_case
 from .mesonlib import MesonException
@@ -39,6 +39,9 @@ def add_arguments(parser):
                         version=coredata.version)
     parser.add_argument('--profile-self', action='store_true', dest='profile',
                         help=argparse.SUPPRESS)
+    parser.add_argument('--profile-configure', action='store_true',
+                        help='Record where configuring spends its time into ' +
+                             'meson-logs/' + mtrace.trace_fname + '.')
     parser.add_argument('--fatal-meson-warnings', action='store_true', dest='fatal_warnings',
                         help='Make all Meson warnings fatal')
     parser.add_argument('--reconfigure', action='store_true',
@@ -159,8 +162,17 @@ class MesonApp:
         mlog.initialize(env.get_log_dir(), self.options.fatal_warnings)
         if self.options.profile:
             mlog.set_timestamp_start(time.monotonic())
-        with mesonlib.BuildDirLock(self.build_dir):
-            self._generate(env)
+        if self.options.profile_configure:
+            mtrace.start()
+        try:
+            with mesonlib.BuildDirLock(self.build_dir):
+                with mtrace.span('meson setup', 'setup'):
+                    self._generate(env)
+        finally:
+            if self.options.profile_configure:
+                mtrace.stop()
+                fname = mtrace.write(env.get_log_dir())
+                mlog.log('Configure profile written to', mlog.bold(fname))
 
     def _generate(self, env):
         mlog.debug('Build started at', datetime.datetime.now().isoformat())
@@ -177,6 +189,9 @@ class MesonApp:
             mlog.log('Build type:', mlog.bold('native build'))
         b = build.Build(env)
 
+        # Several configures can run in one process, as in the tests
+        interpreterbase.FeatureNew.reset()
+        interpreterbase.FeatureDeprecated.reset()
         intr = interpreter.Interpreter(b)
         if env.is_cross_build():
             mlog.log('Host machine cpu family:', mlog.bold(intr.builtin['host_machine'].cpu_family_method([], {})))
@@ -190,10 +205,13 @@ class MesonApp:
                 fname = os.path.join(self.build_dir, 'meson-private', 'profile-interpreter.log')
                 profile.runctx('intr.run()', globals(), locals(), filename=fname)
             else:
-                intr.run()
+                with mtrace.span('interpreter', 'setup'):
+                    intr.run()
         except Exception as e:
             mintro.write_meson_info_file(b, [e])
             raise
+        finally:
+            mesonlib.save_persistent_caches()
         # Print all default option values that don't match the current value
         for def_opt_name, def_opt_value, cur_opt_value in intr.get_non_matching_default_options():
             mlog.log('Option', mlog.bold(def_opt_name), 'is:',
@@ -213,7 +231,8 @@ class MesonApp:
                 fname = os.path.join(self.build_dir, 'meson-private', fname)
                 profile.runctx('intr.backend.generate(intr)', globals(), locals(), filename=fname)
             else:
-                intr.backend.generate(intr)
+                with mtrace.span('backend', 'setup', {'backend': intr.backend.name}):
+                    intr.backend.generate(intr)
             build.save(b, dumpfile)
             # Post-conf scripts must be run after writing coredata or else introspection fails.
             intr.backend.run_postconf_scripts()
@@ -227,7 +246,8 @@ class MesonApp:
                 fname = os.path.join(self.build_dir, 'meson-private', 'profile-introspector.log')
                 profile.runctx('mintro.generate_introspection_file(b, intr.backend)', globals(), locals(), filename=fname)
             else:
-                mintro.generate_introspection_file(b, intr.backend)
+                with mtrace.span('introspection', 'setup'):
+                    mintro.generate_introspection_file(b, intr.backend)
             mintro.write_meson_info_file(b, [], True)
         except Exception as e:
             mintro.write_meson_info_file(b, [e])
@@ -1,7 +1,8 @@
 import os, subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 from . import mlog
-from .mesonlib import Popen_safe
+from .mesonlib import Popen_safe, determine_worker_count
 from .wrap.wrap import API_ROOT, PackageDefinition, Resolver, WrapException
 from .wrap import wraptool
 
@@ -11,7 +12,7 @@ def update_wrapdb_file(wrap, repo_dir, options):
     new_branch, new_revision = wraptool.get_latest_version(wrap.name)
     if new_branch == branch and new_revision == revision:
         mlog.log('  -> Up to date.')
-        return
+        return True
     wraptool.update_wrap_file(wrap.filename, wrap.name, new_branch, new_revision)
     msg = ['  -> New wrap file downloaded.']
     # Meson reconfigure won't use the new wrap file as long as the source
@@ -20,11 +21,12 @@ def update_wrapdb_file(wrap, repo_dir, options):
     if os.path.isdir(repo_dir):
         msg += ['To use it, delete', mlog.bold(repo_dir), 'and run', mlog.bold('meson --reconfigure')]
     mlog.log(*msg)
+    return True
 
 def update_file(wrap, repo_dir, options):
     patch_url = wrap.values.get('patch_url', '')
     if patch_url.startswith(API_ROOT):
-        update_wrapdb_file(wrap, repo_dir, options)
+        return update_wrapdb_file(wrap, repo_dir, options)
     elif not os.path.isdir(repo_dir):
         # The subproject is not needed, or it is a tarball extracted in
         # 'libfoo-1.0' directory and the version has been bumped and the new
@@ -37,6 +39,17 @@ def update_file(wrap, repo_dir, options):
         # version.
         mlog.log('  -> Subproject has not changed, or the new source/patch needs to be extracted on the same location.\n' +
                  '     In that case, delete', mlog.bold(repo_dir), 'and run', mlog.bold('meson --reconfigure'))
+    return True
+
+def run_command(cmd, workingdir, check=False):
+    # The output is logged instead of inherited so that it stays together
+    # with the other messages about the subproject when running in parallel.
+    p, out, _ = Popen_safe(cmd, cwd=workingdir, stdin=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    if out.strip():
+        mlog.log(out.rstrip())
+    if check and p.returncode != 0:
+        raise subprocess.CalledProcessError(p.returncode, cmd)
+    return p.returncode
 
 def git(cmd, workingdir):
     return subprocess.check_output(['git', '-C', workingdir] + cmd,
@@ -50,7 +63,7 @@ def git_show(repo_dir):
 def update_git(wrap, repo_dir, options):
     if not os.path.isdir(repo_dir):
         mlog.log('  -> Not used.')
-        return
+        return True
     revision = wrap.get('revision')
     ret = git(['rev-parse', '--abbrev-ref', 'HEAD'], repo_dir).strip()
     if ret == 'HEAD':
@@ -63,7 +76,7 @@ def update_git(wrap, repo_dir, options):
             mlog.log('  -> Could not checkout revision', mlog.cyan(revision))
             mlog.log(mlog.red(out))
             mlog.log(mlog.red(str(e)))
-            return
+            return False
     elif ret == revision:
         try:
             # We are in the same branch, pull latest commits
@@ -73,7 +86,7 @@ def update_git(wrap, repo_dir, options):
             mlog.log('  -> Could not rebase', mlog.bold(repo_dir), 'please fix and try again.')
             mlog.log(mlog.red(out))
             mlog.log(mlog.red(str(e)))
-            return
+            return False
     else:
         # We are in another branch, probably user created their own branch and
         # we should rebase it on top of wrap's branch.
@@ -86,63 +99,66 @@ def update_git(wrap, repo_dir, options):
                 mlog.log('  -> Could not rebase', mlog.bold(repo_dir), 'please fix and try again.')
                 mlog.log(mlog.red(out))
                 mlog.log(mlog.red(str(e)))
-                return
+                return False
         else:
             mlog.log('  -> Target revision is', mlog.bold(revision), 'but currently in branch is', mlog.bold(ret), '\n' +
                      '     To rebase your branch on top of', mlog.bold(revision), 'use', mlog.bold('--rebase'), 'option.')
-            return
+            return False
 
     git(['submodule', 'update'], repo_dir)
     git_show(repo_dir)
+    return True
 
 def update_hg(wrap, repo_dir, options):
     if not os.path.isdir(repo_dir):
         mlog.log('  -> Not used.')
-        return
+        return True
     revno = wrap.get('revision')
     if revno.lower() == 'tip':
         # Failure to do pull is not a fatal error,
         # because otherwise you can't develop without
         # a working net connection.
-        subprocess.call(['hg', 'pull'], cwd=repo_dir)
+        run_command(['hg', 'pull'], repo_dir)
     else:
-        if subprocess.call(['hg', 'checkout', revno], cwd=repo_dir) != 0:
-            subprocess.check_call(['hg', 'pull'], cwd=repo_dir)
-            subprocess.check_call(['hg', 'checkout', revno], cwd=repo_dir)
+        if run_command(['hg', 'checkout', revno], repo_dir) != 0:
+            run_command(['hg', 'pull'], repo_dir, check=True)
+            run_command(['hg', 'checkout', revno], repo_dir, check=True)
+    return True
 
 def update_svn(wrap, repo_dir, options):
     if not os.path.isdir(repo_dir):
         mlog.log('  -> Not used.')
-        return
+        return True
     revno = wrap.get('revision')
-    p, out = Popen_safe(['svn', 'info', '--show-item', 'revision', repo_dir])
-    current_revno = out
+    p, out, _ = Popen_safe(['svn', 'info', '--show-item', 'revision', repo_dir])
+    current_revno = out.strip()
     if current_revno == revno:
-        return
+        return True
     if revno.lower() == 'head':
         # Failure to do pull is not a fatal error,
         # because otherwise you can't develop without
         # a working net connection.
-        subprocess.call(['svn', 'update'], cwd=repo_dir)
+        run_command(['svn', 'update'], repo_dir)
     else:
-        subprocess.check_call(['svn', 'update', '-r', revno], cwd=repo_dir)
+        run_command(['svn', 'update', '-r', revno], repo_dir, check=True)
+    return True
 
 def update(wrap, repo_dir, options):
     mlog.log('Updating %s...' % wrap.name)
     if wrap.type == 'file':
-        update_file(wrap, repo_dir, options)
+        return update_file(wrap, repo_dir, options)
     elif wrap.type == 'git':
-        update_git(wrap, repo_dir, options)
+        return update_git(wrap, repo_dir, options)
     elif wrap.type == 'hg':
-        update_hg(wrap, repo_dir, options)
+        return update_hg(wrap, repo_dir, options)
     elif wrap.type == 'svn':
-        update_svn(wrap, repo_dir, options)
-    else:
-        mlog.log('  -> Cannot update', wrap.type, 'subproject')
+        return update_svn(wrap, repo_dir, options)
+    mlog.log('  -> Cannot update', wrap.type, 'subproject')
+    return False
 
 def checkout(wrap, repo_dir, options):
     if wrap.type != 'git' or not os.path.isdir(repo_dir):
-        return
+        return True
     branch_name = options.branch_name if options.branch_name else wrap.get('revision')
     cmd = ['checkout', branch_name, '--']
     if options.b:
@@ -154,24 +170,31 @@ def checkout(wrap, repo_dir, options):
     except subprocess.CalledProcessError as e:
         out = e.output.decode().strip()
         mlog.log('  -> ', mlog.red(out))
+        return False
+    return True
 
 def download(wrap, repo_dir, options):
     mlog.log('Download %s...' % wrap.name)
     if os.path.isdir(repo_dir):
         mlog.log('  -> Already downloaded')
-        return
+        return True
     try:
         r = Resolver(os.path.dirname(repo_dir))
+        r.quiet = options.num_processes > 1
         r.resolve(wrap.name)
         mlog.log('  -> done')
     except WrapException as e:
         mlog.log('  ->', mlog.red(str(e)))
+        return False
+    return True
 
 def add_common_arguments(p):
     p.add_argument('--sourcedir', default='.',
                    help='Path to source directory')
     p.add_argument('subprojects', nargs='*',
                    help='List of subprojects (default: all)')
+    p.add_argument('--num-processes', default=determine_worker_count(), type=int,
+                   help='How many subprojects to process in parallel.')
 
 def add_arguments(parser):
     subparsers = parser.add_subparsers(title='Commands', dest='command')
@@ -215,12 +238,52 @@ def run(options):
         else:
             files.append(f)
     if not files:
-        for f in os.listdir(subprojects_dir):
+        for f in sorted(os.listdir(subprojects_dir)):
             if f.endswith('.wrap'):
                 files.append(os.path.join(subprojects_dir, f))
-    for f in files:
+    if options.subprojects_func is download:
+        # Fetch the archives of all file wraps at once, they are then
+        # extracted one by one from the package cache.
+        names = [os.path.basename(f)[:-5] for f in files]
+        for name, e in Resolver(subprojects_dir).prefetch(names, options.num_processes):
+            mlog.debug('Prefetching {} failed: {}'.format(name, e))
+
+    def process(f):
         wrap = PackageDefinition(f)
         directory = wrap.values.get('directory', wrap.name)
         repo_dir = os.path.join(subprojects_dir, directory)
-        options.subprojects_func(wrap, repo_dir, options)
-    return 0
+        try:
+            success = options.subprojects_func(wrap, repo_dir, options)
+        except (subprocess.CalledProcessError, WrapException, OSError) as e:
+            mlog.log('  ->', mlog.red(str(e)))
+            success = False
+        return wrap.name, success
+
+    def process_captured(f):
+        with mlog.capture() as records:
+            result = process(f)
+        return result, records
+
+    failed = []
+    if options.num_processes > 1 and len(files) > 1:
+        # The messages of each subproject are logged together, in the order
+        # of the subprojects, as soon as the subproject and all the ones
+        # before it are done.
+        with ThreadPoolExecutor(max_workers=options.num_processes) as executor:
+            for (name, success), records in executor.map(process_captured, files):
+                mlog.replay(records)
+                if not success:
+                    failed.append(name)
+    else:
+        for f in files:
+            name, success = process(f)
+            if not success:
+                failed.append(name)
+    if len(files) > 1:
+        mlog.log('')
+        if failed:
+            mlog.log('Processed', len(files), 'subprojects,', mlog.red(str(len(failed))), 'failed:',
+                     ', '.join(failed))
+        else:
+            mlog.log('Processed', len(files), 'subprojects,', mlog.green('none failed'))
+    return 1 if failed else 0
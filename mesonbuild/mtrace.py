@@ -0,0 +1,106 @@
+# Copyright 2019 The Meson development team
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import time
+import threading
+
+"""This is a standalone module that records where Meson spends its time
+while configuring a project. Spans are written out in the Chrome trace
+event format, which chrome://tracing, Perfetto and speedscope can show.
+Recording is off unless start() has been called, and span() is cheap
+enough to leave in place when it is."""
+
+trace_fname = 'profile-configure.json'
+enabled = False
+_start = None
+_events = []
+_thread_names = {}
+
+class _NullSpan:
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, *args):
+        return False
+
+_null_span = _NullSpan()
+
+class _Span:
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.begin = time.perf_counter()
+        return self.args
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end = time.perf_counter()
+        thread = threading.current_thread()
+        _thread_names[thread.ident] = thread.name
+        event = {'name': self.name,
+                 'cat': self.category,
+                 'ph': 'X',
+                 'pid': os.getpid(),
+                 'tid': thread.ident,
+                 'ts': round((self.begin - _start) * 1e6, 3),
+                 'dur': round((end - self.begin) * 1e6, 3),
+                 }
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        if self.args:
+            event['args'] = self.args
+        # list.append() is atomic, so worker threads can record spans too.
+        _events.append(event)
+        return False
+
+def start():
+    global enabled, _start
+    _events.clear()
+    _thread_names.clear()
+    _start = time.perf_counter()
+    enabled = True
+
+def stop():
+    global enabled
+    enabled = False
+
+def span(name, category, args=None):
+    '''
+    Returns a context manager that records the time spent in its body as a
+    span called @name. The dictionary it returns from __enter__ becomes the
+    arguments of the span, so details found out along the way can be added.
+    '''
+    if not enabled:
+        return _null_span
+    return _Span(name, category, dict(args) if args else {})
+
+def get_events():
+    metadata = [{'name': 'thread_name',
+                 'ph': 'M',
+                 'pid': os.getpid(),
+                 'tid': tid,
+                 'args': {'name': name},
+                 } for tid, name in _thread_names.items()]
+    return metadata + sorted(_events, key=lambda e: e['ts'])
+
+def write(logdir):
+    '''Writes the recorded spans into @logdir and returns the file name'''
+    fname = os.path.join(logdir, trace_fname)
+    with open(fname, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': get_events(), 'displayTimeUnit': 'ms'}, f)
+    return fname
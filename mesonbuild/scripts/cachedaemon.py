@@ -0,0 +1,238 @@
+# Copyright 2019 The Meson development team
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A daemon that makes build directories sharing the compile cache run
+each command only once, even when they run it at the same time.
+
+Before running a command whose outputs are not in the cache yet,
+cachedcompile claims its key over a Unix socket in the cache directory.
+Other build directories that claim the same key wait until the claim is
+given up, by closing the connection, and then find the outputs in the
+cache instead of running the command themselves. Without the daemon
+each of them runs the command. The outputs themselves stay in the
+cache directory, where the page cache shares them between processes."""
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+from .. import mesonlib
+from . import cachedcompile
+
+socket_name = 'daemon.sock'
+
+class ClaimServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, cachedir, idle_timeout):
+        self.cachedir = cachedir
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        # Keys that are being computed, with an event set when they are not
+        self.claims = {}
+        self.stats = {'claims': 0, 'hits': 0, 'waits': 0}
+        self.last_request = time.monotonic()
+        super().__init__(os.path.join(cachedir, socket_name), ClaimHandler)
+
+    def claim(self, key):
+        '''
+        Returns True if the caller now holds the claim on @key and must
+        compute it, or False if it is in the cache. Waits while someone
+        else holds the claim.
+        '''
+        entry = os.path.join(self.cachedir, key[:2], key)
+        waited = False
+        while True:
+            with self.lock:
+                self.last_request = time.monotonic()
+                if os.path.isdir(entry):
+                    self.stats['hits'] += 1
+                    return False
+                event = self.claims.get(key)
+                if event is None:
+                    self.claims[key] = threading.Event()
+                    self.stats['claims'] += 1
+                    return True
+                if not waited:
+                    self.stats['waits'] += 1
+                    waited = True
+            event.wait()
+
+    def release(self, key):
+        with self.lock:
+            self.claims.pop(key).set()
+
+    def service_actions(self):
+        if time.monotonic() - self.last_request > self.idle_timeout and not self.claims:
+            threading.Thread(target=self.shutdown).start()
+
+class ClaimHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        claimed = []
+        try:
+            for line in self.rfile:
+                request = json.loads(line.decode('utf-8'))
+                op = request.get('op')
+                if op == 'claim':
+                    key = request['key']
+                    if self.server.claim(key):
+                        claimed.append(key)
+                        reply = {'result': 'compute'}
+                    else:
+                        reply = {'result': 'hit'}
+                elif op == 'stats':
+                    with self.server.lock:
+                        reply = dict(self.server.stats, running=len(self.server.claims))
+                elif op == 'stop':
+                    threading.Thread(target=self.server.shutdown).start()
+                    reply = {}
+                else:
+                    reply = {'error': 'unknown operation {!r}'.format(op)}
+                self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+        finally:
+            # Closing the connection gives up its claims, also when the
+            # client was killed before it stored its outputs.
+            for key in claimed:
+                self.server.release(key)
+
+def connect(cachedir):
+    '''
+    Returns a connection to the daemon of @cachedir, or None if it is not
+    running or Unix sockets are not available.
+    '''
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(os.path.join(cachedir, socket_name))
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+def request(sock, req):
+    sock.sendall(json.dumps(req).encode('utf-8') + b'\n')
+    reply = b''
+    while not reply.endswith(b'\n'):
+        data = sock.recv(4096)
+        if not data:
+            raise OSError('The compile cache daemon closed the connection')
+        reply += data
+    return json.loads(reply.decode('utf-8'))
+
+def claim(cachedir, key):
+    '''
+    Claims @key and returns the connection that holds the claim, which the
+    caller closes once the outputs are in the cache or the command failed.
+    Returns None without the daemon, or when the outputs are in the cache.
+    '''
+    sock = connect(cachedir)
+    if sock is None:
+        return None
+    try:
+        if request(sock, {'op': 'claim', 'key': key})['result'] == 'compute':
+            return sock
+    except (OSError, ValueError, KeyError):
+        pass
+    sock.close()
+    return None
+
+def serve(cachedir, idle_timeout):
+    os.makedirs(cachedir, exist_ok=True)
+    path = os.path.join(cachedir, socket_name)
+    if os.path.exists(path):
+        sock = connect(cachedir)
+        if sock is not None:
+            sock.close()
+            print('The compile cache daemon is already running.')
+            return 1
+        # Left behind by a daemon that was killed
+        os.unlink(path)
+    server = ClaimServer(cachedir, idle_timeout)
+    try:
+        server.serve_forever(poll_interval=1)
+    finally:
+        server.server_close()
+        os.unlink(path)
+    return 0
+
+def start(cachedir, idle_timeout):
+    sock = connect(cachedir)
+    if sock is not None:
+        sock.close()
+        print('The compile cache daemon is already running.')
+        return 0
+    cmd = mesonlib.meson_command + ['--internal', 'cachedaemon', '--foreground',
+                                    '--idle-timeout', str(idle_timeout)]
+    env = os.environ.copy()
+    env['MESON_CACHE_DIR'] = os.path.dirname(cachedir)
+    subprocess.Popen(cmd, env=env, start_new_session=True,
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL)
+    # Wait until it accepts connections
+    for _ in range(100):
+        sock = connect(cachedir)
+        if sock is not None:
+            sock.close()
+            return 0
+        time.sleep(0.05)
+    print('The compile cache daemon did not start.')
+    return 1
+
+def run(args):
+    parser = argparse.ArgumentParser(prog='meson --internal cachedaemon')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--foreground', action='store_true',
+                       help='Run the daemon without detaching from the terminal.')
+    group.add_argument('--stop', action='store_true',
+                       help='Stop the running daemon.')
+    group.add_argument('--status', action='store_true',
+                       help='Print what the running daemon has done.')
+    parser.add_argument('--idle-timeout', type=int, default=3600,
+                        help='Seconds without requests after which the daemon exits.')
+    options = parser.parse_args(args)
+    cachedir = cachedcompile.get_cache_dir()
+    if cachedir is None:
+        print('The user cache directory is disabled.')
+        return 1
+    if not hasattr(socket, 'AF_UNIX'):
+        print('The compile cache daemon needs Unix domain sockets.')
+        return 1
+    if options.foreground:
+        return serve(cachedir, options.idle_timeout)
+    if options.stop or options.status:
+        sock = connect(cachedir)
+        if sock is None:
+            print('The compile cache daemon is not running.')
+            return 1
+        with sock:
+            if options.stop:
+                request(sock, {'op': 'stop'})
+                return 0
+            stats = request(sock, {'op': 'stats'})
+        print('Claims:  {}'.format(stats['claims']))
+        print('Hits:    {}'.format(stats['hits']))
+        print('Waits:   {}'.format(stats['waits']))
+        print('Running: {}'.format(stats['running']))
+        return 0
+    return start(cachedir, options.idle_timeout)
+
+if __name__ == '__main__':
+    sys.exit(run(sys.argv[1:]))
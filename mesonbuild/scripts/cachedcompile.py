@@ -0,0 +1,344 @@
+# Copyright 2019 The Meson development team
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs a compiler command, reusing its outputs from an earlier run with
+the same preprocessed source, compiler and arguments if there was one.
+
+Outputs are kept in the compile directory of the user cache directory,
+keyed by a hash of all of those, so that every build directory of a
+source tree shares them. Each of the 256 subdirectories of the cache is
+trimmed to its share of the size limit, least recently used entries
+first, when an entry is added to it."""
+
+import argparse
+import hashlib
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from ..mesonlib import get_user_cache_dir
+from . import cachedaemon
+
+cache_version = b'3'
+
+# Arguments that make the compiler read or write files that are not part
+# of the key or are not stored, so compiling with them is never cached.
+uncacheable_args = ('--coverage', '-ftest-coverage', '-fprofile-arcs', '-fprofile-use',
+                    '-fauto-profile', '-save-temps', '-gsplit-dwarf', '-fdump-',
+                    '-fstack-usage', '-fcallgraph-info')
+
+# Arguments that are dropped, with the number of values that follow
+# them, when preprocessing instead of compiling.
+compile_only_args = {'-c': 0, '-o': 1, '-MD': 0, '-MMD': 0, '-MP': 0,
+                     '-MF': 1, '-MT': 1, '-MQ': 1}
+
+# Arguments followed by a file that the compiler reads without it showing
+# up in the preprocessed source, so its contents are part of the key.
+file_args = ('-include', '-include-pch', '-imacros')
+file_prefix_args = ('-fsanitize-blacklist=', '-fsanitize-ignorelist=')
+
+# With -fpch-preprocess, GCC names the precompiled header it used
+# instead of writing out its contents.
+pch_pragma = re.compile(rb'^#pragma GCC pch_preprocess "(.*)"$', re.MULTILINE)
+
+def get_cache_dir():
+    cachedir = get_user_cache_dir()
+    if cachedir is None:
+        return None
+    return os.path.join(cachedir, 'compile')
+
+def expand_response_files(command):
+    result = []
+    for arg in command:
+        if arg.startswith('@') and os.path.isfile(arg[1:]):
+            with open(arg[1:], encoding='utf-8') as f:
+                result += shlex.split(f.read())
+        else:
+            result.append(arg)
+    return result
+
+def get_preprocess_command(command):
+    result = []
+    skip = 0
+    for arg in command:
+        if skip:
+            skip -= 1
+        elif arg in compile_only_args:
+            skip = compile_only_args[arg]
+        elif not arg.startswith('-o'):
+            result.append(arg)
+    return result + ['-E']
+
+def compiler_identity(exe):
+    path = shutil.which(exe)
+    if path is None:
+        return exe.encode()
+    st = os.stat(path)
+    return '{}:{}:{}'.format(os.path.realpath(path), st.st_size, st.st_mtime_ns).encode()
+
+def hash_file(h, path):
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(65536), b''):
+                h.update(block)
+    except OSError:
+        h.update(b'\0missing')
+
+def get_read_files(command, preprocessed):
+    '''
+    Returns the files that @command reads besides the ones whose contents
+    are in its @preprocessed source.
+    '''
+    files = set()
+    for prev, arg in zip(command, command[1:]):
+        if prev in file_args:
+            files.add(arg)
+            if prev == '-include':
+                # The compiler uses a precompiled header next to the
+                # header in place of it
+                files.update(arg + ext for ext in ('.gch', '.pch') if os.path.exists(arg + ext))
+    for arg in command:
+        if arg.startswith(file_prefix_args):
+            files.add(arg.split('=', 1)[1])
+    files.update(m.decode(errors='surrogateescape') for m in pch_pragma.findall(preprocessed))
+    return sorted(files)
+
+def get_custom_key(command, inputs, outputs):
+    '''
+    Returns the key of the outputs of the custom target @command, from the
+    contents of its @inputs and of the other files named in it.
+    '''
+    h = hashlib.sha256()
+    h.update(cache_version + b'\0custom\0')
+    h.update(compiler_identity(command[0]) + b'\0')
+    for arg in command:
+        h.update(arg.encode(errors='surrogateescape') + b'\0')
+    for output in outputs:
+        h.update(output.encode(errors='surrogateescape') + b'\0')
+    files = set(inputs)
+    files.update(arg for arg in command[1:] if arg not in outputs and os.path.isfile(arg))
+    for path in sorted(files):
+        h.update(b'\0' + path.encode(errors='surrogateescape') + b'\0')
+        hash_file(h, path)
+    return h.hexdigest()
+
+def get_key(command):
+    '''
+    Returns the key of the outputs of @command, or None if they should not
+    be cached. The working directory is not part of the key, so objects
+    are shared between build directories, and the debug information of an
+    object names the directory it was first compiled in.
+    '''
+    command = expand_response_files(command)
+    if any(arg.startswith(uncacheable_args) for arg in command):
+        return None
+    p = subprocess.run(get_preprocess_command(command), stdout=subprocess.PIPE,
+                       stderr=subprocess.DEVNULL)
+    if p.returncode != 0:
+        return None
+    h = hashlib.sha256()
+    h.update(cache_version + b'\0')
+    for exe in command[:2] if command[0] == 'ccache' else command[:1]:
+        h.update(compiler_identity(exe) + b'\0')
+    for arg in command:
+        h.update(arg.encode(errors='surrogateescape') + b'\0')
+    # With -g, GCC names the working directory in a line marker
+    cwd_marker = '"{}//"'.format(os.getcwd()).encode(errors='surrogateescape')
+    h.update(p.stdout.replace(cwd_marker, b'""'))
+    for path in get_read_files(command, p.stdout):
+        h.update(b'\0' + path.encode(errors='surrogateescape') + b'\0')
+        hash_file(h, path)
+    return h.hexdigest()
+
+def count(cachedir, stat):
+    # Appending a single byte is atomic, so the size of the file is the
+    # count even when many compilers run at once.
+    os.makedirs(os.path.join(cachedir, 'stats'), exist_ok=True)
+    with open(os.path.join(cachedir, 'stats', stat), 'ab') as f:
+        f.write(b'.')
+
+def get_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                size += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return size
+
+def trim(shard, max_size):
+    entries = []
+    for e in os.scandir(shard):
+        if e.is_dir() and not e.name.startswith('tmp'):
+            entries.append((e.stat().st_mtime, get_size(e.path), e.path))
+    total = sum(size for _, size, _ in entries)
+    if total <= max_size:
+        return
+    for _, size, path in sorted(entries):
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        if total <= max_size * 0.9:
+            break
+
+def write_output(data, stream):
+    if data:
+        stream.flush()
+        stream.buffer.write(data)
+        stream.flush()
+
+def get_entry_files(outputs, depfile):
+    files = [('out%d' % i, output) for i, output in enumerate(outputs)]
+    if depfile is not None:
+        files.append(('depfile', depfile))
+    return files
+
+def restore(entry, outputs, depfile):
+    for name, dst in get_entry_files(outputs, depfile):
+        src = os.path.join(entry, name)
+        if name == 'depfile' and not os.path.exists(src):
+            continue
+        tmp = dst + '.tmp'
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    for name, stream in (('stdout', sys.stdout), ('stderr', sys.stderr)):
+        with open(os.path.join(entry, name), 'rb') as f:
+            write_output(f.read(), stream)
+    # Entries are trimmed least recently used first
+    os.utime(entry)
+
+def store(entry, outputs, depfile, stdout, stderr):
+    shard = os.path.dirname(entry)
+    os.makedirs(shard, exist_ok=True)
+    tmpdir = tempfile.mkdtemp(prefix='tmp', dir=shard)
+    try:
+        for name, src in get_entry_files(outputs, depfile):
+            if name != 'depfile' or os.path.exists(src):
+                shutil.copyfile(src, os.path.join(tmpdir, name))
+        for name, data in (('stdout', stdout), ('stderr', stderr)):
+            with open(os.path.join(tmpdir, name), 'wb') as f:
+                f.write(data)
+        os.rename(tmpdir, entry)
+    except OSError:
+        # Another compiler stored the same entry first
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def run_cached(cachedir, key, outputs, depfile, max_size, command):
+    entry = os.path.join(cachedir, key[:2], key)
+    # With the daemon running, this waits while another build directory
+    # runs the same command, and then finds its outputs in the cache.
+    claim = cachedaemon.claim(cachedir, key)
+    try:
+        if os.path.isdir(entry):
+            try:
+                restore(entry, outputs, depfile)
+                count(cachedir, 'hits')
+                return 0
+            except OSError:
+                # The entry was trimmed while it was being read
+                pass
+        count(cachedir, 'misses')
+        p = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        write_output(p.stdout, sys.stdout)
+        write_output(p.stderr, sys.stderr)
+        if p.returncode == 0 and all(os.path.isfile(o) for o in outputs):
+            store(entry, outputs, depfile, p.stdout, p.stderr)
+            trim(os.path.dirname(entry), max_size * 1024 * 1024 / 256)
+        return p.returncode
+    finally:
+        if claim is not None:
+            claim.close()
+
+def get_stats(cachedir):
+    stats = {}
+    for stat in ('hits', 'misses', 'uncacheable'):
+        try:
+            stats[stat] = os.path.getsize(os.path.join(cachedir, 'stats', stat))
+        except OSError:
+            stats[stat] = 0
+    stats['entries'] = 0
+    stats['size'] = 0
+    if os.path.isdir(cachedir):
+        for shard in os.scandir(cachedir):
+            if shard.is_dir() and shard.name != 'stats':
+                for e in os.scandir(shard.path):
+                    if not e.name.startswith('tmp'):
+                        stats['entries'] += 1
+                        stats['size'] += get_size(e.path)
+    return stats
+
+def print_stats(cachedir):
+    stats = get_stats(cachedir)
+    lookups = stats['hits'] + stats['misses']
+    rate = 100.0 * stats['hits'] / lookups if lookups else 0.0
+    print('Cache directory: {}'.format(cachedir))
+    print('Hits:            {}'.format(stats['hits']))
+    print('Misses:          {}'.format(stats['misses']))
+    print('Hit rate:        {:.1f}%'.format(rate))
+    print('Uncacheable:     {}'.format(stats['uncacheable']))
+    print('Entries:         {}'.format(stats['entries']))
+    print('Size:            {:.1f} MiB'.format(stats['size'] / (1024 * 1024)))
+
+def run(args):
+    parser = argparse.ArgumentParser(prog='meson --internal cachedcompile')
+    parser.add_argument('--depfile', default=None,
+                        help='Dependency file written by the compiler.')
+    parser.add_argument('--custom', action='store_true',
+                        help='Run a custom target command instead of a compiler.')
+    parser.add_argument('--input', dest='inputs', action='append', default=[],
+                        help='File read by a custom target command.')
+    parser.add_argument('--output', dest='outputs', action='append', default=[],
+                        help='File written by the command.')
+    parser.add_argument('--max-size', type=int, default=5120,
+                        help='Maximum size of the cache in MiB.')
+    parser.add_argument('--stats', action='store_true',
+                        help='Print the hit rate and size of the cache and exit.')
+    parser.add_argument('--clear', action='store_true',
+                        help='Remove everything from the cache and exit.')
+    parser.add_argument('command', nargs=argparse.REMAINDER,
+                        help='Command to run, after --.')
+    options = parser.parse_args(args)
+    cachedir = get_cache_dir()
+    if options.stats or options.clear:
+        if cachedir is None:
+            print('The user cache directory is disabled.')
+            return 1
+        if options.clear:
+            shutil.rmtree(cachedir, ignore_errors=True)
+        else:
+            print_stats(cachedir)
+        return 0
+    command = options.command
+    if command and command[0] == '--':
+        command = command[1:]
+    if not options.outputs or not command:
+        parser.error('an output and a command are required')
+    if cachedir is None:
+        return subprocess.call(command)
+    if options.custom:
+        key = get_custom_key(command, options.inputs, options.outputs)
+    else:
+        key = get_key(command)
+    if key is None:
+        count(cachedir, 'uncacheable')
+        return subprocess.call(command)
+    return run_cached(cachedir, key, options.outputs, options.depfile,
+                      options.max_size, command)
+
+if __name__ == '__main__':
+    sys.exit(run(sys.argv[1:]))
@@ -13,12 +13,30 @@
 # limitations under the License.
 
 
-import sys, struct
+import sys, struct, mmap
 import shutil, subprocess
 
 from ..mesonlib import OrderedSet
 
 SHT_STRTAB = 3
+SHT_NOBITS = 8
+SHT_DYNSYM = 11
+SHT_GNU_VERDEF = 0x6ffffffd
+SHT_GNU_VERSYM = 0x6fffffff
+SHF_WRITE = 0x1
+SHF_ALLOC = 0x2
+SHF_EXECINSTR = 0x4
+SHN_UNDEF = 0
+SHN_ABS = 0xfff1
+SHN_COMMON = 0xfff2
+STB_GLOBAL = 1
+STB_WEAK = 2
+STB_GNU_UNIQUE = 10
+STT_OBJECT = 1
+STT_GNU_IFUNC = 10
+VER_FLG_BASE = 0x1
+VERSYM_HIDDEN = 0x8000
+VERSYM_VERSION = 0x7fff
 DT_NEEDED = 1
 DT_RPATH = 15
 DT_RUNPATH = 29
@@ -53,90 +71,100 @@ class DataSizes:
             self.Off = p + 'I'
             self.OffSize = 4
 
-class DynamicEntry(DataSizes):
-    def __init__(self, ifile, ptrsize, is_le):
-        super().__init__(ptrsize, is_le)
-        self.ptrsize = ptrsize
+class ElfStructs:
+    '''
+    The precompiled layouts of the ELF structures depfixer reads, for one
+    word size and endianness.
+    '''
+    def __init__(self, ptrsize, is_le):
+        p = '<' if is_le else '>'
+        # Elf_Ehdr after e_ident: e_type, e_machine, e_version, e_entry,
+        # e_phoff, e_shoff, e_flags, e_ehsize, e_phentsize, e_phnum,
+        # e_shentsize, e_shnum, e_shstrndx
+        # Elf_Shdr: sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size,
+        # sh_link, sh_info, sh_addralign, sh_entsize
+        # Elf_Dyn: d_tag, d_val
+        # Elf_Sym: st_name, st_info, st_other, st_shndx, st_value, st_size
+        # on 64 bits, st_name, st_value, st_size, st_info, st_other, st_shndx
+        # on 32 bits
         if ptrsize == 64:
-            self.d_tag = struct.unpack(self.Sxword, ifile.read(self.SxwordSize))[0]
-            self.val = struct.unpack(self.XWord, ifile.read(self.XWordSize))[0]
+            self.header = struct.Struct(p + 'HHIQQQIHHHHHH')
+            self.section = struct.Struct(p + 'IIQQQQIIQQ')
+            self.dynamic = struct.Struct(p + 'qQ')
+            self.symbol = struct.Struct(p + 'IBBHQQ')
         else:
-            self.d_tag = struct.unpack(self.Sword, ifile.read(self.SwordSize))[0]
-            self.val = struct.unpack(self.Word, ifile.read(self.WordSize))[0]
+            self.header = struct.Struct(p + 'HHIIIIIHHHHHH')
+            self.section = struct.Struct(p + 'IIIIIIIIII')
+            self.dynamic = struct.Struct(p + 'iI')
+            self.symbol = struct.Struct(p + 'IIIBBH')
+        # Elf_Versym
+        self.versym = struct.Struct(p + 'H')
+        # Elf_Verdef: vd_version, vd_flags, vd_ndx, vd_cnt, vd_hash, vd_aux,
+        # vd_next
+        self.verdef = struct.Struct(p + 'HHHHIII')
+        # Elf_Verdaux: vda_name, vda_next
+        self.verdaux = struct.Struct(p + 'II')
+
+elf_structs = {}
+
+def get_elf_structs(ptrsize, is_le):
+    try:
+        return elf_structs[(ptrsize, is_le)]
+    except KeyError:
+        return elf_structs.setdefault((ptrsize, is_le), ElfStructs(ptrsize, is_le))
 
-    def write(self, ofile):
-        if self.ptrsize == 64:
-            ofile.write(struct.pack(self.Sxword, self.d_tag))
-            ofile.write(struct.pack(self.XWord, self.val))
-        else:
-            ofile.write(struct.pack(self.Sword, self.d_tag))
-            ofile.write(struct.pack(self.Word, self.val))
+class DynamicEntry:
+    def __init__(self, data, offset, structs):
+        self.structs = structs
+        self.d_tag, self.val = structs.dynamic.unpack_from(data, offset)
 
-class SectionHeader(DataSizes):
-    def __init__(self, ifile, ptrsize, is_le):
-        super().__init__(ptrsize, is_le)
-        if ptrsize == 64:
-            is_64 = True
-        else:
-            is_64 = False
-# Elf64_Word
-        self.sh_name = struct.unpack(self.Word, ifile.read(self.WordSize))[0]
-# Elf64_Word
-        self.sh_type = struct.unpack(self.Word, ifile.read(self.WordSize))[0]
-# Elf64_Xword
-        if is_64:
-            self.sh_flags = struct.unpack(self.XWord, ifile.read(self.XWordSize))[0]
-        else:
-            self.sh_flags = struct.unpack(self.Word, ifile.read(self.WordSize))[0]
-# Elf64_Addr
-        self.sh_addr = struct.unpack(self.Addr, ifile.read(self.AddrSize))[0]
-# Elf64_Off
-        self.sh_offset = struct.unpack(self.Off, ifile.read(self.OffSize))[0]
-# Elf64_Xword
-        if is_64:
-            self.sh_size = struct.unpack(self.XWord, ifile.read(self.XWordSize))[0]
-        else:
-            self.sh_size = struct.unpack(self.Word, ifile.read(self.WordSize))[0]
-# Elf64_Word
-        self.sh_link = struct.unpack(self.Word, ifile.read(self.WordSize))[0]
-# Elf64_Word
-        self.sh_info = struct.unpack(self.Word, ifile.read(self.WordSize))[0]
-# Elf64_Xword
-        if is_64:
-            self.sh_addralign = struct.unpack(self.XWord, ifile.read(self.XWordSize))[0]
-        else:
-            self.sh_addralign = struct.unpack(self.Word, ifile.read(self.WordSize))[0]
-# Elf64_Xword
-        if is_64:
-            self.sh_entsize = struct.unpack(self.XWord, ifile.read(self.XWordSize))[0]
-        else:
-            self.sh_entsize = struct.unpack(self.Word, ifile.read(self.WordSize))[0]
+    def write(self, data, offset):
+        self.structs.dynamic.pack_into(data, offset, self.d_tag, self.val)
+
+class SectionHeader:
+    def __init__(self, data, offset, structs):
+        (self.sh_name, self.sh_type, self.sh_flags, self.sh_addr, self.sh_offset,
+         self.sh_size, self.sh_link, self.sh_info, self.sh_addralign,
+         self.sh_entsize) = structs.section.unpack_from(data, offset)
 
 class Elf(DataSizes):
-    def __init__(self, bfile, verbose=True):
+    def __init__(self, bfile, verbose=True, readonly=False):
         self.bfile = bfile
         self.verbose = verbose
-        self.bf = open(bfile, 'r+b')
+        self.bf = None
+        self.data = None
+        self.bf = open(bfile, 'rb' if readonly else 'r+b')
         try:
             (self.ptrsize, self.is_le) = self.detect_elf_type()
             super().__init__(self.ptrsize, self.is_le)
+            self.structs = get_elf_structs(self.ptrsize, self.is_le)
+            # Map the file so that headers and strings are read from memory
+            # instead of with a read() for every field
+            self.data = mmap.mmap(self.bf.fileno(), 0,
+                                  access=mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE)
             self.parse_header()
             self.parse_sections()
             self.parse_dynamic()
         except:
-            self.bf.close()
+            self.close()
             raise
 
     def __enter__(self):
         return self
 
     def __del__(self):
-        if self.bf:
-            self.bf.close()
+        self.close()
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.bf.close()
-        self.bf = None
+        self.close()
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+        if self.bf:
+            self.bf.close()
+            self.bf = None
 
     def detect_elf_type(self):
         data = self.bf.read(6)
@@ -161,63 +189,173 @@ class Elf(DataSizes):
         return ptrsize, is_le
 
     def parse_header(self):
-        self.bf.seek(0)
-        self.e_ident = struct.unpack('16s', self.bf.read(16))[0]
-        self.e_type = struct.unpack(self.Half, self.bf.read(self.HalfSize))[0]
-        self.e_machine = struct.unpack(self.Half, self.bf.read(self.HalfSize))[0]
-        self.e_version = struct.unpack(self.Word, self.bf.read(self.WordSize))[0]
-        self.e_entry = struct.unpack(self.Addr, self.bf.read(self.AddrSize))[0]
-        self.e_phoff = struct.unpack(self.Off, self.bf.read(self.OffSize))[0]
-        self.e_shoff = struct.unpack(self.Off, self.bf.read(self.OffSize))[0]
-        self.e_flags = struct.unpack(self.Word, self.bf.read(self.WordSize))[0]
-        self.e_ehsize = struct.unpack(self.Half, self.bf.read(self.HalfSize))[0]
-        self.e_phentsize = struct.unpack(self.Half, self.bf.read(self.HalfSize))[0]
-        self.e_phnum = struct.unpack(self.Half, self.bf.read(self.HalfSize))[0]
-        self.e_shentsize = struct.unpack(self.Half, self.bf.read(self.HalfSize))[0]
-        self.e_shnum = struct.unpack(self.Half, self.bf.read(self.HalfSize))[0]
-        self.e_shstrndx = struct.unpack(self.Half, self.bf.read(self.HalfSize))[0]
+        self.e_ident = self.data[:16]
+        (self.e_type, self.e_machine, self.e_version, self.e_entry, self.e_phoff,
+         self.e_shoff, self.e_flags, self.e_ehsize, self.e_phentsize, self.e_phnum,
+         self.e_shentsize, self.e_shnum, self.e_shstrndx) = self.structs.header.unpack_from(self.data, 16)
 
     def parse_sections(self):
-        self.bf.seek(self.e_shoff)
-        self.sections = []
-        for i in range(self.e_shnum):
-            self.sections.append(SectionHeader(self.bf, self.ptrsize, self.is_le))
-
-    def read_str(self):
-        arr = []
-        x = self.bf.read(1)
-        while x != b'\0':
-            arr.append(x)
-            x = self.bf.read(1)
-            if x == b'':
-                raise RuntimeError('Tried to read past the end of the file')
-        return b''.join(arr)
+        size = self.structs.section.size
+        self.sections = [SectionHeader(self.data, self.e_shoff + i * size, self.structs)
+                         for i in range(self.e_shnum)]
+        # Index the sections by name, keeping the first one of each name
+        self.section_names = []
+        self.sections_by_name = {}
+        if self.e_shstrndx >= len(self.sections):
+            return
+        names = self.sections[self.e_shstrndx]
+        strtab = self.data[names.sh_offset:names.sh_offset + names.sh_size]
+        for i in self.sections:
+            end = strtab.find(b'\0', i.sh_name)
+            if end < 0:
+                # Not terminated within the section, as read_str() would do
+                name = self.read_str(names.sh_offset + i.sh_name)
+            else:
+                name = strtab[i.sh_name:end]
+            self.section_names.append(name)
+            self.sections_by_name.setdefault(name, i)
+
+    def read_str(self, offset):
+        end = self.data.find(b'\0', offset)
+        if end < 0:
+            raise RuntimeError('Tried to read past the end of the file')
+        return self.data[offset:end]
 
     def find_section(self, target_name):
-        section_names = self.sections[self.e_shstrndx]
-        for i in self.sections:
-            self.bf.seek(section_names.sh_offset + i.sh_name)
-            name = self.read_str()
-            if name == target_name:
-                return i
+        return self.sections_by_name.get(target_name)
 
     def parse_dynamic(self):
         sec = self.find_section(b'.dynamic')
         self.dynamic = []
         if sec is None:
             return
-        self.bf.seek(sec.sh_offset)
+        offset = sec.sh_offset
+        size = self.structs.dynamic.size
         while True:
-            e = DynamicEntry(self.bf, self.ptrsize, self.is_le)
+            e = DynamicEntry(self.data, offset, self.structs)
             self.dynamic.append(e)
             if e.d_tag == 0:
                 break
+            offset += size
+
+    def get_dynstr_offset(self):
+        '''
+        Returns the offset of the string table that dynamic entries point
+        into. Raises RuntimeError if the file has no .dynstr section.
+        '''
+        sec = self.find_section(b'.dynstr')
+        if sec is None:
+            raise RuntimeError('File "%s" has dynamic entries but no .dynstr section.' % self.bfile)
+        return sec.sh_offset
+
+    def get_soname(self):
+        for i in self.dynamic:
+            if i.d_tag == DT_SONAME:
+                return self.read_str(self.get_dynstr_offset() + i.val)
+        return None
+
+    def get_version_names(self, sec):
+        '''
+        Returns the names of the versions defined in section @sec, by
+        version index, and the index of the base version.
+        '''
+        strtab = self.sections[sec.sh_link]
+        names = {}
+        base = None
+        offset = sec.sh_offset
+        while True:
+            (_, vd_flags, vd_ndx, vd_cnt, _, vd_aux,
+             vd_next) = self.structs.verdef.unpack_from(self.data, offset)
+            if vd_cnt:
+                vda_name = self.structs.verdaux.unpack_from(self.data, offset + vd_aux)[0]
+                names[vd_ndx] = self.read_str(strtab.sh_offset + vda_name)
+            if vd_flags & VER_FLG_BASE:
+                base = vd_ndx
+            if not vd_next:
+                return names, base
+            offset += vd_next
+
+    def symbol_type(self, info, shndx):
+        '''
+        Returns the letter "nm" shows for an exported symbol with st_info
+        @info defined in section @shndx.
+        '''
+        bind = info >> 4
+        stype = info & 0xf
+        if shndx == SHN_COMMON:
+            return 'C'
+        if stype == STT_GNU_IFUNC:
+            return 'i'
+        if bind == STB_WEAK:
+            return 'V' if stype == STT_OBJECT else 'W'
+        if bind == STB_GNU_UNIQUE:
+            return 'u'
+        if shndx == SHN_ABS:
+            return 'A'
+        if shndx >= len(self.sections):
+            return '?'
+        sec = self.sections[shndx]
+        if sec.sh_flags & SHF_EXECINSTR:
+            return 'T'
+        if sec.sh_type == SHT_NOBITS:
+            return 'B'
+        if sec.sh_flags & SHF_WRITE:
+            return 'D'
+        if sec.sh_flags & SHF_ALLOC:
+            return 'R'
+        return 'N'
+
+    def get_exported_symbols(self):
+        '''
+        Returns the (name, type) of the symbols defined and exported by the
+        dynamic symbol table, in the order of "nm --dynamic --extern-only
+        --defined-only" does. Names have their version appended with @@, or
+        @ for hidden versions. Raises RuntimeError if there is no dynamic
+        symbol table.
+        '''
+        symtab = None
+        versym = None
+        verdef = None
+        for sec in self.sections:
+            if sec.sh_type == SHT_DYNSYM:
+                symtab = sec
+            elif sec.sh_type == SHT_GNU_VERSYM:
+                versym = sec
+            elif sec.sh_type == SHT_GNU_VERDEF:
+                verdef = sec
+        if symtab is None:
+            raise RuntimeError('File "%s" has no dynamic symbol table.' % self.bfile)
+        strtab = self.sections[symtab.sh_link].sh_offset
+        if verdef is not None:
+            version_names, base_version = self.get_version_names(verdef)
+        else:
+            version_names, base_version = {}, None
+        unpack = self.structs.symbol.unpack_from
+        is_64 = self.ptrsize == 64
+        size = symtab.sh_entsize or self.structs.symbol.size
+        symbols = []
+        for i in range(symtab.sh_size // size):
+            if is_64:
+                st_name, st_info, _, st_shndx, _, _ = unpack(self.data, symtab.sh_offset + i * size)
+            else:
+                st_name, _, _, st_info, _, st_shndx = unpack(self.data, symtab.sh_offset + i * size)
+            if st_shndx == SHN_UNDEF or (st_info >> 4) not in (STB_GLOBAL, STB_WEAK, STB_GNU_UNIQUE):
+                continue
+            name = basename = self.read_str(strtab + st_name)
+            if versym is not None:
+                vernum = self.structs.versym.unpack_from(self.data, versym.sh_offset + i * 2)[0]
+                version = version_names.get(vernum & VERSYM_VERSION)
+                # Like nm, the base version and versions of the same name
+                # as the symbol are not shown
+                if version is not None and (vernum & VERSYM_VERSION) != base_version and version != name:
+                    name += (b'@' if vernum & VERSYM_HIDDEN else b'@@') + version
+            symbols.append((basename, name, self.symbol_type(st_info, st_shndx)))
+        # nm sorts on the names without their version
+        symbols.sort(key=lambda x: x[0])
+        return [x[1:] for x in symbols]
 
     def print_section_names(self):
-        section_names = self.sections[self.e_shstrndx]
-        for i in self.sections:
-            self.bf.seek(section_names.sh_offset + i.sh_name)
-            name = self.read_str()
+        for name in self.section_names:
             print(name.decode())
 
     def print_soname(self):
@@ -231,14 +369,12 @@ class Elf(DataSizes):
         if soname is None or strtab is None:
             print("This file does not have a soname")
             return
-        self.bf.seek(strtab.val + soname.val)
-        print(self.read_str())
+        print(self.read_str(strtab.val + soname.val))
 
     def get_entry_offset(self, entrynum):
-        sec = self.find_section(b'.dynstr')
         for i in self.dynamic:
             if i.d_tag == entrynum:
-                return sec.sh_offset + i.val
+                return self.get_dynstr_offset() + i.val
         return None
 
     def print_rpath(self):
@@ -246,46 +382,39 @@ class Elf(DataSizes):
         if offset is None:
             print("This file does not have an rpath.")
         else:
-            self.bf.seek(offset)
-            print(self.read_str())
+            print(self.read_str(offset))
 
     def print_runpath(self):
         offset = self.get_entry_offset(DT_RUNPATH)
         if offset is None:
             print("This file does not have a runpath.")
         else:
-            self.bf.seek(offset)
-            print(self.read_str())
+            print(self.read_str(offset))
 
     def print_deps(self):
-        sec = self.find_section(b'.dynstr')
         deps = []
         for i in self.dynamic:
             if i.d_tag == DT_NEEDED:
                 deps.append(i)
         for i in deps:
-            offset = sec.sh_offset + i.val
-            self.bf.seek(offset)
-            name = self.read_str()
+            offset = self.get_dynstr_offset() + i.val
+            name = self.read_str(offset)
             print(name)
 
     def fix_deps(self, prefix):
-        sec = self.find_section(b'.dynstr')
         deps = []
         for i in self.dynamic:
             if i.d_tag == DT_NEEDED:
                 deps.append(i)
         for i in deps:
-            offset = sec.sh_offset + i.val
-            self.bf.seek(offset)
-            name = self.read_str()
+            offset = self.get_dynstr_offset() + i.val
+            name = self.read_str(offset)
             if name.startswith(prefix):
                 basename = name.split(b'/')[-1]
                 padding = b'\0' * (len(name) - len(basename))
                 newname = basename + padding
                 assert(len(newname) == len(name))
-                self.bf.seek(offset)
-                self.bf.write(newname)
+                self.data[offset:offset + len(newname)] = newname
 
     def fix_rpath(self, new_rpath):
         # The path to search for can be either rpath or runpath.
@@ -301,8 +430,7 @@ class Elf(DataSizes):
             if self.verbose:
                 print('File does not have rpath. It should be a fully static executable.')
             return
-        self.bf.seek(rp_off)
-        old_rpath = self.read_str()
+        old_rpath = self.read_str(rp_off)
         if len(old_rpath) < len(new_rpath):
             sys.exit("New rpath must not be longer than the old one.")
         # The linker does read-only string deduplication. If there is a
@@ -316,9 +444,7 @@ class Elf(DataSizes):
         if not new_rpath:
             self.remove_rpath_entry(entrynum)
         else:
-            self.bf.seek(rp_off)
-            self.bf.write(new_rpath)
-            self.bf.write(b'\0')
+            self.data[rp_off:rp_off + len(new_rpath) + 1] = new_rpath + b'\0'
 
     def remove_rpath_entry(self, entrynum):
         sec = self.find_section(b'.dynamic')
@@ -335,9 +461,10 @@ class Elf(DataSizes):
             if entry.d_tag == DT_MIPS_RLD_MAP_REL:
                 entry.val += 2 * (self.ptrsize // 8)
                 break
-        self.bf.seek(sec.sh_offset)
+        offset = sec.sh_offset
         for entry in self.dynamic:
-            entry.write(self.bf)
+            entry.write(self.data, offset)
+            offset += self.structs.dynamic.size
         return None
 
 def fix_elf(fname, new_rpath, verbose=True):
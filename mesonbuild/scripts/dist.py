@@ -13,8 +13,11 @@
 # limitations under the License.
 
 
+import gzip
 import lzma
 import os
+import queue
+import stat
 import sys
 import shutil
 import subprocess
@@ -22,34 +25,202 @@ import pickle
 import hashlib
 import tarfile, zipfile
 import tempfile
+import threading
+import time
 from glob import glob
+from mesonbuild import coredata
 from mesonbuild.environment import detect_ninja
-from mesonbuild.mesonlib import windows_proof_rmtree
+from mesonbuild.mesonlib import windows_proof_rmtree, OrderedSet
 from mesonbuild import mlog
 
-def create_hash(fname):
+archive_extensions = {'xztar': '.tar.xz',
+                      'gztar': '.tar.gz',
+                      'zip': '.zip'}
+
+def create_hash(fname, digest=None):
     hashname = fname + '.sha256sum'
-    m = hashlib.sha256()
-    m.update(open(fname, 'rb').read())
+    if digest is None:
+        m = hashlib.sha256()
+        with open(fname, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                m.update(chunk)
+        digest = m.hexdigest()
     with open(hashname, 'w') as f:
-        f.write('%s %s\n' % (m.hexdigest(), os.path.basename(fname)))
-
-
-def create_zip(zipfilename, packaging_dir):
-    prefix = os.path.dirname(packaging_dir)
-    removelen = len(prefix) + 1
-    with zipfile.ZipFile(zipfilename,
-                         'w',
-                         compression=zipfile.ZIP_DEFLATED,
-                         allowZip64=True) as zf:
-        zf.write(packaging_dir, packaging_dir[removelen:])
-        for root, dirs, files in os.walk(packaging_dir):
-            for d in dirs:
-                dname = os.path.join(root, d)
-                zf.write(dname, dname[removelen:])
-            for f in files:
-                fname = os.path.join(root, f)
-                zf.write(fname, fname[removelen:])
+        f.write('%s %s\n' % (digest, os.path.basename(fname)))
+
+
+class HashingFile:
+    '''
+    A file opened for writing that hashes what is written to it, so that
+    archives do not have to be read back to be hashed. It cannot seek, so
+    zip files written to it are streamed.
+    '''
+    def __init__(self, fname):
+        self.fname = fname
+        self.file = open(fname, 'wb')
+        self.hash = hashlib.sha256()
+
+    def write(self, data):
+        self.hash.update(data)
+        return self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ArchiveWriter(threading.Thread):
+    '''
+    Writes one archive in a thread of its own. The items given to put()
+    are handled by process_all() in that thread; zlib and lzma do not hold
+    the GIL while compressing, so all archives are compressed in parallel.
+    '''
+    def __init__(self, fname):
+        super().__init__()
+        self.out = HashingFile(fname)
+        self.queue = queue.Queue(maxsize=64)
+        self.error = None
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def finish(self):
+        '''Waits for the archive to be written and returns its SHA-256'''
+        self.queue.put(None)
+        self.join()
+        if self.error is not None:
+            raise self.error
+        return self.out.hash.hexdigest()
+
+    def run(self):
+        try:
+            try:
+                self.process_all()
+            finally:
+                self.out.close()
+        except BaseException as e:
+            self.error = e
+            # Keep the producer from blocking on a full queue
+            while self.queue.get() is not None:
+                pass
+
+    def items(self):
+        return iter(self.queue.get, None)
+
+
+class XzWriter(ArchiveWriter):
+    '''
+    Compresses the tar stream with the lzma module, with the settings
+    tarfile uses, so that the archive does not depend on whether or which
+    xz program is installed, or on the number of cores.
+    '''
+    def process_all(self):
+        compressor = lzma.LZMACompressor(format=lzma.FORMAT_XZ, check=lzma.CHECK_CRC64,
+                                         preset=lzma.PRESET_DEFAULT)
+        for data in self.items():
+            self.out.write(compressor.compress(data))
+        self.out.write(compressor.flush())
+
+
+class GzipWriter(ArchiveWriter):
+    '''Compresses the tar stream with gzip'''
+    def process_all(self):
+        with gzip.GzipFile(fileobj=self.out, mode='wb') as gz:
+            for data in self.items():
+                gz.write(data)
+
+
+class ZipWriter(ArchiveWriter):
+    '''Adds the (path, name) items it gets to a zip file'''
+    def process_all(self):
+        with zipfile.ZipFile(self.out, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+            for path, name in self.items():
+                zf.write(path, name)
+
+
+class TarStream:
+    '''
+    The file a tar archive is written to, which hands the stream in large
+    chunks to the writers compressing it.
+    '''
+    chunk_size = 1024 * 1024
+
+    def __init__(self, writers):
+        self.writers = writers
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            data = bytes(self.buffer)
+            for w in self.writers:
+                w.put(data)
+            self.buffer = bytearray()
+
+
+def walk_tree(path, name):
+    '''
+    Yields the (path, name, size) of @path and of everything below it, in
+    the order tarfile.add() would add them.
+    '''
+    st = os.lstat(path)
+    yield path, name, st.st_size if stat.S_ISREG(st.st_mode) else 0
+    if stat.S_ISDIR(st.st_mode):
+        for f in sorted(os.listdir(path)):
+            yield from walk_tree(os.path.join(path, f), name + '/' + f)
+
+
+def create_archives(distdir, dist_name, formats):
+    '''
+    Archives @distdir, under the name @dist_name, in all @formats at once
+    from a single walk of the tree. Returns the (file name, SHA-256) of the
+    archives.
+    '''
+    entries = list(walk_tree(distdir, dist_name))
+    total = sum(e[2] for e in entries)
+    writer_types = {'xztar': XzWriter, 'gztar': GzipWriter, 'zip': ZipWriter}
+    writers = [writer_types[fmt](distdir + archive_extensions[fmt]) for fmt in formats]
+    tar_writers = [w for w in writers if not isinstance(w, ZipWriter)]
+    zip_writers = [w for w in writers if isinstance(w, ZipWriter)]
+    for w in writers:
+        w.start()
+    try:
+        tf = None
+        if tar_writers:
+            stream = TarStream(tar_writers)
+            tf = tarfile.open(fileobj=stream, mode='w|')
+        done = 0
+        last_report = time.monotonic()
+        for path, name, size in entries:
+            if tf is not None:
+                tf.add(path, name, recursive=False)
+            for w in zip_writers:
+                w.put((path, name))
+            done += size
+            now = time.monotonic()
+            if now - last_report >= 1:
+                print('Archived {} of {} MiB ({}%)'.format(done >> 20, total >> 20, done * 100 // max(total, 1)))
+                last_report = now
+        if tf is not None:
+            tf.close()
+            stream.flush()
+    finally:
+        digests = []
+        errors = []
+        for w in writers:
+            try:
+                digests.append((w.out.fname, w.finish()))
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+    return digests
 
 def del_gitfiles(dirname):
     for f in glob(os.path.join(dirname, '.git*')):
@@ -98,7 +269,7 @@ def git_have_dirty_index(src_root):
     ret = subprocess.call(['git', '-C', src_root, 'diff-index', '--quiet', 'HEAD'])
     return ret == 1
 
-def create_dist_git(dist_name, src_root, bld_root, dist_sub, dist_scripts):
+def create_dist_git(dist_name, src_root, bld_root, dist_sub, dist_scripts, formats):
     if git_have_dirty_index(src_root):
         mlog.warning('Repository has uncommitted changes that will not be included in the dist tarball')
     distdir = os.path.join(dist_sub, dist_name)
@@ -109,15 +280,9 @@ def create_dist_git(dist_name, src_root, bld_root, dist_sub, dist_scripts):
     process_submodules(distdir)
     del_gitfiles(distdir)
     run_dist_scripts(distdir, dist_scripts)
-    xzname = distdir + '.tar.xz'
-    # Should use shutil but it got xz support only in 3.5.
-    with tarfile.open(xzname, 'w:xz') as tf:
-        tf.add(distdir, dist_name)
-    # Create only .tar.xz for now.
-    # zipname = distdir + '.zip'
-    # create_zip(zipname, distdir)
+    archives = create_archives(distdir, dist_name, formats)
     shutil.rmtree(distdir)
-    return (xzname, )
+    return archives
 
 
 def hg_have_dirty_index(src_root):
@@ -125,23 +290,20 @@ def hg_have_dirty_index(src_root):
     out = subprocess.check_output(['hg', '-R', src_root, 'summary'])
     return b'commit: (clean)' not in out
 
-def create_dist_hg(dist_name, src_root, bld_root, dist_sub, dist_scripts):
+def create_dist_hg(dist_name, src_root, bld_root, dist_sub, dist_scripts, formats):
     if hg_have_dirty_index(src_root):
         mlog.warning('Repository has uncommitted changes that will not be included in the dist tarball')
 
+    distdir = os.path.join(dist_sub, dist_name)
+    if os.path.exists(distdir):
+        shutil.rmtree(distdir)
     os.makedirs(dist_sub, exist_ok=True)
-    tarname = os.path.join(dist_sub, dist_name + '.tar')
-    xzname = tarname + '.xz'
-    subprocess.check_call(['hg', 'archive', '-R', src_root, '-S', '-t', 'tar', tarname])
+    subprocess.check_call(['hg', 'archive', '-R', src_root, '-S', '-t', 'files', distdir])
     if len(dist_scripts) > 0:
         mlog.warning('dist scripts are not supported in Mercurial projects')
-    with lzma.open(xzname, 'wb') as xf, open(tarname, 'rb') as tf:
-        shutil.copyfileobj(tf, xf)
-    os.unlink(tarname)
-    # Create only .tar.xz for now.
-    # zipname = os.path.join(dist_sub, dist_name + '.zip')
-    # subprocess.check_call(['hg', 'archive', '-R', src_root, '-S', '-t', 'zip', zipname])
-    return (xzname, )
+    archives = create_archives(distdir, dist_name, formats)
+    shutil.rmtree(distdir)
+    return archives
 
 
 def check_dist(packagename, meson_command):
@@ -151,8 +313,7 @@ def check_dist(packagename, meson_command):
     installdir = tempfile.mkdtemp()
     ninja_bin = detect_ninja()
     try:
-        tf = tarfile.open(packagename)
-        tf.extractall(unpackdir)
+        shutil.unpack_archive(packagename, unpackdir)
         srcdir = glob(os.path.join(unpackdir, '*'))[0]
         if subprocess.call(meson_command + ['--backend=ninja', srcdir, builddir]) != 0:
             print('Running Meson on distribution package failed')
@@ -185,23 +346,27 @@ def run(args):
     buildfile = os.path.join(priv_dir, 'build.dat')
 
     build = pickle.load(open(buildfile, 'rb'))
+    cdata = coredata.load(bld_root)
+    if 'dist_formats' in cdata.builtins:
+        formats = list(OrderedSet(cdata.get_builtin_option('dist_formats')))
+    else:
+        formats = ['xztar']
 
     dist_name = build.project_name + '-' + build.project_version
 
     _git = os.path.join(src_root, '.git')
     if os.path.isdir(_git) or os.path.isfile(_git):
-        names = create_dist_git(dist_name, src_root, bld_root, dist_sub, build.dist_scripts)
+        archives = create_dist_git(dist_name, src_root, bld_root, dist_sub, build.dist_scripts, formats)
     elif os.path.isdir(os.path.join(src_root, '.hg')):
-        names = create_dist_hg(dist_name, src_root, bld_root, dist_sub, build.dist_scripts)
+        archives = create_dist_hg(dist_name, src_root, bld_root, dist_sub, build.dist_scripts, formats)
     else:
         print('Dist currently only works with Git or Mercurial repos')
         return 1
-    if names is None:
+    if not archives:
         return 1
-    error_count = 0
-    for name in names:
-        rc = check_dist(name, meson_command) # Check only one.
-        if rc == 0:
-            create_hash(name)
-        error_count += rc
-    return 1 if error_count else 0
+    # All archives have the same contents, so check only one.
+    if check_dist(archives[0][0], meson_command) != 0:
+        return 1
+    for name, digest in archives:
+        create_hash(name, digest)
+    return 0
@@ -23,6 +23,7 @@
 import os, sys
 from .. import mesonlib
 from ..mesonlib import Popen_safe
+from . import depfixer
 import argparse
 
 parser = argparse.ArgumentParser()
@@ -47,7 +48,35 @@ def write_if_changed(text, outfilename):
     with open(outfilename, 'w') as f:
         f.write(text)
 
+def elf_syms(libfilename):
+    '''
+    Returns the lines "readelf -d" and "nm" would give for the SONAME and
+    the exported symbols of @libfilename, or None if it cannot be read.
+    '''
+    try:
+        with depfixer.Elf(libfilename, verbose=False, readonly=True) as elf:
+            soname = elf.get_soname()
+            symbols = elf.get_exported_symbols()
+            ptrsize = elf.ptrsize
+    except (SystemExit, RuntimeError, ValueError, IndexError, OSError):
+        return None
+    result = []
+    if soname is not None:
+        if ptrsize == 64:
+            tag = ' 0x{:016x} (SONAME)             '.format(depfixer.DT_SONAME)
+        else:
+            tag = ' 0x{:08x} (SONAME)                     '.format(depfixer.DT_SONAME)
+        result.append(tag + 'Library soname: [{}]'.format(soname.decode(errors='replace')))
+    result += ['{} {}'.format(name.decode(errors='replace'), t) for name, t in symbols]
+    return result
+
 def linux_syms(libfilename, outfilename):
+    # Read the library directly unless other tools were asked for
+    if 'READELF' not in os.environ and 'NM' not in os.environ:
+        result = elf_syms(libfilename)
+        if result is not None:
+            write_if_changed('\n'.join(result) + '\n', outfilename)
+            return
     evar = 'READELF'
     if evar in os.environ:
         readelfbin = os.environ[evar].strip()
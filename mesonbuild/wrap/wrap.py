@@ -14,12 +14,15 @@
 
 from .. import mlog
 import contextlib
-import urllib.request, os, hashlib, shutil, tempfile, stat
+import urllib.request, urllib.parse, os, hashlib, shutil, tempfile, stat
+import http.client
 import subprocess
 import sys
 import configparser
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from . import WrapMode
-from ..mesonlib import MesonException
+from ..mesonlib import MesonException, get_user_cache_dir
 
 try:
     import ssl
@@ -31,6 +34,8 @@ except ImportError:
 
 req_timeout = 600.0
 ssl_warning_printed = False
+blocksize = 1024 * 1024
+max_redirects = 10
 
 def build_ssl_context():
     ctx = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
@@ -70,12 +75,136 @@ def open_wrapdburl(urlstring):
         urlstring = 'http' + urlstring[5:]
     return urllib.request.urlopen(urlstring, timeout=req_timeout)
 
+def get_download_cache_dir():
+    '''
+    Directory of the download cache shared by all source trees. Archives are
+    stored under their sha256 hash, so a file can be used by any wrap that
+    expects that hash whatever its file name.
+    '''
+    cachedir = get_user_cache_dir()
+    if not cachedir:
+        return None
+    return os.path.join(cachedir, 'downloads', 'sha256')
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(blocksize)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+def copy_atomic(src, dst):
+    '''
+    Atomically puts a copy of src at dst. The file is not hard linked so that
+    changing the copy in a source tree cannot change the shared cache entry.
+    '''
+    tmpname = '{}.{}.{}~'.format(dst, os.getpid(), threading.get_ident())
+    shutil.copyfile(src, tmpname)
+    os.replace(tmpname, dst)
+
 class WrapException(MesonException):
     pass
 
 class WrapNotFoundException(WrapException):
     pass
 
+class Downloader:
+    '''
+    Downloads files over HTTP and HTTPS keeping one connection alive per host
+    and thread, so fetching the source and patch archives of several wraps
+    from the same server does not reconnect for every file. Other URL schemes,
+    and URLs that the environment sends through a proxy, go through urllib.
+    Each Resolver has its own Downloader, so that closing it only closes the
+    connections used by that Resolver.
+    '''
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def connection(self, scheme, netloc):
+        connections = self.local.__dict__.setdefault('connections', {})
+        conn = connections.get((scheme, netloc))
+        if conn is None:
+            if scheme == 'https':
+                conn = http.client.HTTPSConnection(netloc, timeout=req_timeout,
+                                                   context=ssl.create_default_context())
+            else:
+                conn = http.client.HTTPConnection(netloc, timeout=req_timeout)
+            connections[(scheme, netloc)] = conn
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    def close(self):
+        '''
+        Closes the connections opened by all the threads that used this
+        downloader. Must not be called while they are still downloading,
+        closed connections reopen when used again.
+        '''
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+
+    def request(self, url):
+        parts = urllib.parse.urlsplit(url)
+        conn = self.connection(parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = {'User-Agent': 'Meson'}
+        try:
+            conn.request('GET', path, headers=headers)
+            return conn.getresponse()
+        except (http.client.HTTPException, ConnectionError):
+            # The server may have dropped the idle connection, or the previous
+            # download was interrupted before its response was read. Retry once
+            # on a new connection.
+            conn.close()
+            conn.request('GET', path, headers=headers)
+            return conn.getresponse()
+
+    @staticmethod
+    def uses_proxy(scheme, netloc):
+        return scheme in urllib.request.getproxies() and not urllib.request.proxy_bypass(netloc)
+
+    def open(self, url):
+        global ssl_warning_printed
+        for _ in range(max_redirects):
+            parts = urllib.parse.urlsplit(url)
+            scheme = parts.scheme
+            if scheme not in ('http', 'https') or (scheme == 'https' and not has_ssl) or \
+                    self.uses_proxy(scheme, parts.netloc):
+                if url.startswith('https://wrapdb.mesonbuild.com'):
+                    return open_wrapdburl(url)
+                return urllib.request.urlopen(url, timeout=req_timeout)
+            try:
+                resp = self.request(url)
+            except OSError as e:
+                if not url.startswith('https://wrapdb.mesonbuild.com') or not isinstance(e, ssl.SSLError):
+                    raise
+                if not ssl_warning_printed:
+                    print('SSL connection failed. Falling back to unencrypted connections.')
+                    ssl_warning_printed = True
+                url = 'http' + url[5:]
+                continue
+            if resp.status in (301, 302, 303, 307, 308):
+                location = resp.getheader('Location')
+                resp.read()
+                if not location:
+                    raise WrapException('Redirect without a location while downloading {}'.format(url))
+                url = urllib.parse.urljoin(url, location)
+                continue
+            if resp.status != 200:
+                resp.read()
+                raise WrapException('Downloading {} failed: HTTP error {} {}'.format(url, resp.status, resp.reason))
+            return resp
+        raise WrapException('Too many redirects while downloading {}'.format(url))
+
 class PackageDefinition:
     def __init__(self, fname):
         self.filename = fname
@@ -110,6 +239,58 @@ class Resolver:
         self.wrap_mode = wrap_mode
         self.subdir_root = subdir_root
         self.cachedir = os.path.join(self.subdir_root, 'packagecache')
+        self.quiet = False
+        self.downloader = Downloader()
+
+    def prefetch(self, names=None, max_workers=None):
+        '''
+        Downloads the archives of the file wraps named in names, or of every
+        wrap in the subprojects directory, concurrently and without extracting
+        them. Wraps whose directory already exists are skipped. The archives
+        end up in the package cache where resolve() picks them up. Returns a
+        list of (name, exception) for the wraps that could not be fetched.
+        '''
+        if self.wrap_mode is WrapMode.nodownload or not os.path.isdir(self.subdir_root):
+            return []
+        if names is None:
+            names = sorted(f[:-5] for f in os.listdir(self.subdir_root) if f.endswith('.wrap'))
+        jobs = []
+        seen = set()
+        for name in names:
+            fname = os.path.join(self.subdir_root, name + '.wrap')
+            if not os.path.isfile(fname):
+                continue
+            wrap = PackageDefinition(fname)
+            directory = wrap.values.get('directory', wrap.name)
+            if wrap.type != 'file' or os.path.exists(os.path.join(self.subdir_root, directory)):
+                continue
+            for what in ('source', 'patch'):
+                filename = wrap.values.get(what + '_filename')
+                if filename and filename not in seen:
+                    seen.add(filename)
+                    jobs.append((wrap, what))
+        if not jobs:
+            return []
+
+        def fetch(job):
+            wrap, what = job
+            r = Resolver(self.subdir_root, self.wrap_mode)
+            r.quiet = True
+            r.downloader = self.downloader
+            r.packagename = wrap.name
+            r.wrap = wrap
+            try:
+                r.get_file_internal(what)
+            except (WrapException, OSError, http.client.HTTPException) as e:
+                return wrap.name, e
+            return None
+
+        os.makedirs(self.cachedir, exist_ok=True)
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                return [failure for failure in executor.map(fetch, jobs) if failure]
+        finally:
+            self.downloader.close()
 
     def resolve(self, packagename):
         self.packagename = packagename
@@ -205,99 +386,115 @@ class Resolver:
         raise WrapException(m.format(out))
 
     def get_file(self):
-        path = self.get_file_internal('source')
-        extract_dir = self.subdir_root
-        # Some upstreams ship packages that do not have a leading directory.
-        # Create one for them.
-        if 'lead_directory_missing' in self.wrap.values:
-            os.mkdir(self.dirname)
-            extract_dir = self.dirname
-        shutil.unpack_archive(path, extract_dir)
-        if self.wrap.has_patch():
-            self.apply_patch()
+        try:
+            path = self.get_file_internal('source')
+            extract_dir = self.subdir_root
+            # Some upstreams ship packages that do not have a leading directory.
+            # Create one for them.
+            if 'lead_directory_missing' in self.wrap.values:
+                os.mkdir(self.dirname)
+                extract_dir = self.dirname
+            shutil.unpack_archive(path, extract_dir)
+            if self.wrap.has_patch():
+                self.apply_patch()
+        finally:
+            self.downloader.close()
+
+    def run_vcs(self, cmd, cwd, check=True):
+        '''
+        Runs a version control command. In quiet mode its output is logged
+        instead of going straight to the terminal, so that it is kept together
+        with the other messages about the subproject.
+        '''
+        if not self.quiet:
+            if check:
+                subprocess.check_call(cmd, cwd=cwd)
+                return 0
+            return subprocess.call(cmd, cwd=cwd)
+        p = subprocess.run(cmd, cwd=cwd, stdin=subprocess.DEVNULL,
+                           stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        out = p.stdout.decode(errors='replace').rstrip()
+        if out:
+            mlog.log(out)
+        if check and p.returncode != 0:
+            raise subprocess.CalledProcessError(p.returncode, cmd)
+        return p.returncode
 
     def get_git(self):
         revno = self.wrap.get('revision')
         if self.wrap.values.get('clone-recursive', '').lower() == 'true':
-            subprocess.check_call(['git', 'clone', '--recursive', self.wrap.get('url'),
-                                   self.directory], cwd=self.subdir_root)
+            self.run_vcs(['git', 'clone', '--recursive', self.wrap.get('url'),
+                          self.directory], self.subdir_root)
         else:
-            subprocess.check_call(['git', 'clone', self.wrap.get('url'),
-                                   self.directory], cwd=self.subdir_root)
+            self.run_vcs(['git', 'clone', self.wrap.get('url'),
+                          self.directory], self.subdir_root)
         if revno.lower() != 'head':
-            if subprocess.call(['git', 'checkout', revno], cwd=self.dirname) != 0:
-                subprocess.check_call(['git', 'fetch', self.wrap.get('url'), revno], cwd=self.dirname)
-                subprocess.check_call(['git', 'checkout', revno],
-                                      cwd=self.dirname)
+            if self.run_vcs(['git', 'checkout', revno], self.dirname, check=False) != 0:
+                self.run_vcs(['git', 'fetch', self.wrap.get('url'), revno], self.dirname)
+                self.run_vcs(['git', 'checkout', revno], self.dirname)
         push_url = self.wrap.values.get('push-url')
         if push_url:
-            subprocess.check_call(['git', 'remote', 'set-url',
-                                   '--push', 'origin', push_url],
-                                  cwd=self.dirname)
+            self.run_vcs(['git', 'remote', 'set-url',
+                          '--push', 'origin', push_url], self.dirname)
 
     def get_hg(self):
         revno = self.wrap.get('revision')
-        subprocess.check_call(['hg', 'clone', self.wrap.get('url'),
-                               self.directory], cwd=self.subdir_root)
+        self.run_vcs(['hg', 'clone', self.wrap.get('url'),
+                      self.directory], self.subdir_root)
         if revno.lower() != 'tip':
-            subprocess.check_call(['hg', 'checkout', revno],
-                                  cwd=self.dirname)
+            self.run_vcs(['hg', 'checkout', revno], self.dirname)
 
     def get_svn(self):
         revno = self.wrap.get('revision')
-        subprocess.check_call(['svn', 'checkout', '-r', revno, self.wrap.get('url'),
-                               self.directory], cwd=self.subdir_root)
+        self.run_vcs(['svn', 'checkout', '-r', revno, self.wrap.get('url'),
+                      self.directory], self.subdir_root)
 
     def get_data(self, url):
-        blocksize = 10 * 1024
         h = hashlib.sha256()
         tmpfile = tempfile.NamedTemporaryFile(mode='wb', dir=self.cachedir, delete=False)
-        if url.startswith('https://wrapdb.mesonbuild.com'):
-            resp = open_wrapdburl(url)
-        else:
-            resp = urllib.request.urlopen(url, timeout=req_timeout)
-        with contextlib.closing(resp) as resp:
-            try:
-                dlsize = int(resp.info()['Content-Length'])
-            except TypeError:
-                dlsize = None
-            if dlsize is None:
-                print('Downloading file of unknown size.')
+        try:
+            resp = self.downloader.open(url)
+            with contextlib.closing(resp) as resp, tmpfile:
+                try:
+                    dlsize = int(resp.info()['Content-Length'])
+                except TypeError:
+                    dlsize = None
+                if self.quiet:
+                    pass
+                elif dlsize is None:
+                    print('Downloading file of unknown size.')
+                else:
+                    print('Download size:', dlsize)
+                    print('Downloading: ', end='')
+                    sys.stdout.flush()
+                printed_dots = 0
+                downloaded = 0
                 while True:
                     block = resp.read(blocksize)
                     if block == b'':
                         break
+                    downloaded += len(block)
                     h.update(block)
                     tmpfile.write(block)
-                hashvalue = h.hexdigest()
-                return hashvalue, tmpfile.name
-            print('Download size:', dlsize)
-            print('Downloading: ', end='')
-            sys.stdout.flush()
-            printed_dots = 0
-            downloaded = 0
-            while True:
-                block = resp.read(blocksize)
-                if block == b'':
-                    break
-                downloaded += len(block)
-                h.update(block)
-                tmpfile.write(block)
-                ratio = int(downloaded / dlsize * 10)
-                while printed_dots < ratio:
-                    print('.', end='')
-                    sys.stdout.flush()
-                    printed_dots += 1
-            print('')
-            hashvalue = h.hexdigest()
+                    if self.quiet or dlsize is None:
+                        continue
+                    ratio = int(downloaded / dlsize * 10)
+                    while printed_dots < ratio:
+                        print('.', end='')
+                        sys.stdout.flush()
+                        printed_dots += 1
+                if dlsize is not None and not self.quiet:
+                    print('')
+        except BaseException:
+            tmpfile.close()
+            os.remove(tmpfile.name)
+            raise
+        hashvalue = h.hexdigest()
         return hashvalue, tmpfile.name
 
     def check_hash(self, what, path):
-        expected = self.wrap.get(what + '_hash')
-        h = hashlib.sha256()
-        with open(path, 'rb') as f:
-            h.update(f.read())
-        dhash = h.hexdigest()
+        expected = self.wrap.get(what + '_hash').lower()
+        dhash = file_hash(path)
         if dhash != expected:
             raise WrapException('Incorrect hash for %s:\n %s expected\n %s actual.' % (what, expected, dhash))
 
@@ -306,11 +503,43 @@ class Resolver:
         srcurl = self.wrap.get(what + '_url')
         mlog.log('Downloading', mlog.bold(self.packagename), what, 'from', mlog.bold(srcurl))
         dhash, tmpfile = self.get_data(srcurl)
-        expected = self.wrap.get(what + '_hash')
+        expected = self.wrap.get(what + '_hash').lower()
         if dhash != expected:
             os.remove(tmpfile)
             raise WrapException('Incorrect hash for %s:\n %s expected\n %s actual.' % (what, expected, dhash))
-        os.rename(tmpfile, ofname)
+        os.replace(tmpfile, ofname)
+
+    def get_shared_file(self, what, cache_path):
+        '''
+        Puts the file with the expected hash from the shared download cache at
+        cache_path. Returns False if the shared cache does not have it.
+        '''
+        shared_dir = get_download_cache_dir()
+        if not shared_dir:
+            return False
+        shared_path = os.path.join(shared_dir, self.wrap.get(what + '_hash').lower())
+        if not os.path.isfile(shared_path):
+            return False
+        try:
+            self.check_hash(what, shared_path)
+        except WrapException:
+            # Corrupted, drop it so that it gets downloaded again
+            with contextlib.suppress(OSError):
+                os.remove(shared_path)
+            return False
+        copy_atomic(shared_path, cache_path)
+        mlog.log('Using', mlog.bold(self.packagename), what, 'from the shared download cache.')
+        return True
+
+    def add_shared_file(self, what, cache_path):
+        shared_dir = get_download_cache_dir()
+        if not shared_dir:
+            return
+        try:
+            os.makedirs(shared_dir, exist_ok=True)
+            copy_atomic(cache_path, os.path.join(shared_dir, self.wrap.get(what + '_hash').lower()))
+        except OSError as e:
+            mlog.debug('Could not add {} to the shared download cache: {}'.format(cache_path, e))
 
     def get_file_internal(self, what):
         filename = self.wrap.get(what + '_filename')
@@ -321,9 +550,11 @@ class Resolver:
             mlog.log('Using', mlog.bold(self.packagename), what, 'from cache.')
             return cache_path
 
-        if not os.path.isdir(self.cachedir):
-            os.mkdir(self.cachedir)
+        os.makedirs(self.cachedir, exist_ok=True)
+        if self.get_shared_file(what, cache_path):
+            return cache_path
         self.download(what, cache_path)
+        self.add_shared_file(what, cache_path)
         return cache_path
 
     def apply_patch(self):
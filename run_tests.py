@@ -34,6 +34,11 @@ from mesonbuild import mlog
 from mesonbuild.environment import Environment, detect_ninja
 from mesonbuild.coredata import backendlist
 
+# Keep the caches that Meson shares between build directories out of the
+# user cache directory, so that tests neither use nor leave results there
+test_cache_dir = tempfile.TemporaryDirectory(prefix='meson-test-cache-')
+os.environ['MESON_CACHE_DIR'] = test_cache_dir.name
+
 def guess_backend(backend, msbuild_exe):
     # Auto-detect backend if unspecified
     backend_flags = []
@@ -221,6 +226,10 @@ def clear_meson_configure_class_caches():
     mesonbuild.compilers.CCompiler.find_framework_cache = {}
     mesonbuild.dependencies.PkgConfigDependency.pkgbin_cache = {}
     mesonbuild.dependencies.PkgConfigDependency.class_pkgbin = mesonlib.PerMachine(None, None, None)
+    mesonbuild.dependencies.PkgConfigDependency.resolver_cache = {}
+    mesonbuild.dependencies.PkgConfigDependency.pkgbin_disk_cache.clear()
+    mesonbuild.dependencies.CMakeDependency.cmake_disk_cache.clear()
+    mesonlib.ProgramCache.shared.clear()
 
 def run_configure_inprocess(commandlist):
     old_stdout = sys.stdout
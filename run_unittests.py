@@ -27,7 +27,11 @@ import unittest
 import platform
 import pickle
 import functools
+import hashlib
 import io
+import socket
+import threading
+import time
 from itertools import chain
 from unittest import mock
 from configparser import ConfigParser
@@ -43,7 +47,7 @@ import mesonbuild.mesonlib
 import mesonbuild.coredata
 import mesonbuild.modules.gnome
 from mesonbuild.interpreter import Interpreter, ObjectHolder
-from mesonbuild.ast import AstInterpreter
+from mesonbuild.ast import AstInterpreter, DependencyCollector
 from mesonbuild.mesonlib import (
     is_windows, is_osx, is_cygwin, is_dragonflybsd, is_openbsd, is_haiku,
     windows_proof_rmtree, python_command, version_compare,
@@ -52,7 +56,7 @@ from mesonbuild.mesonlib import (
 from mesonbuild.environment import detect_ninja
 from mesonbuild.mesonlib import MesonException, EnvironmentException
 from mesonbuild.dependencies import PkgConfigDependency, ExternalProgram
-from mesonbuild.build import Target
+from mesonbuild.build import Build, Target, ConfigurationData
 import mesonbuild.modules.pkgconfig
 
 from mesonbuild.mtest import TAPParser, TestResult
@@ -61,7 +65,7 @@ from run_tests import (
     Backend, FakeBuild, FakeCompilerOptions,
     ensure_backend_detects_changes, exe_suffix, get_backend_commands,
     get_builddir_target_args, get_fake_env, get_fake_options, get_meson_script,
-    run_configure_inprocess, run_mtest_inprocess
+    run_configure_inprocess, run_mtest_inprocess, clear_meson_configure_class_caches
 )
 
 def get_dynamic_section_entry(fname, entry):
@@ -255,9 +259,14 @@ def no_pkgconfig():
 
     shutil.which = new_which
     ExternalProgram._search = new_search
+    # Programs found by earlier tests must not be reused from the user
+    # cache directory, and the mocked results must not end up in it.
+    clear_meson_configure_class_caches()
     try:
-        yield
+        with mock.patch.dict(os.environ, {'MESON_CACHE_DIR': ''}):
+            yield
     finally:
+        clear_meson_configure_class_caches()
         shutil.which = old_which
         ExternalProgram._search = old_search
 
@@ -592,6 +601,27 @@ class InternalTests(unittest.TestCase):
         cmd = ['@OUTPUT@.out', 'ordinary', 'strings']
         self.assertRaises(ME, substfunc, cmd, d)
 
+    def test_command_template(self):
+        regex = re.compile(r'(@(?:INPUT|OUTPUT[0-9]*|NAME)@)')
+        obj = object()
+        cmd = ['plain', obj, '@INPUT@', '--in=@INPUT@', '@NAME@-@OUTPUT0@.c',
+               '@OTHER@', '@EXTRA@', 'mail@example.com']
+        template = mesonbuild.mesonlib.CommandTemplate(cmd, regex)
+        self.assertEqual(template.templates, ['@INPUT@', '@INPUT@', '@NAME@', '@OUTPUT0@'])
+        # Templates are replaced in a single pass, without values for them
+        # they are left as they are
+        values = {'@INPUT@': 'a@NAME@.c', '@NAME@': 'foo', '@OUTPUT0@': 'out'}
+        self.assertEqual(template.substitute(values),
+                         ['plain', obj, 'a@NAME@.c', '--in=a@NAME@.c', 'foo-out.c',
+                          '@OTHER@', '@EXTRA@', 'mail@example.com'])
+        self.assertEqual(template.substitute({}), cmd)
+        # A list replaces a whole argument with all of its items
+        values = {'@INPUT@': ['a.c', 'b.c']}
+        with self.assertRaisesRegex(MesonException, 'more than one input file'):
+            template.substitute(values)
+        template = mesonbuild.mesonlib.CommandTemplate(cmd[:3], regex)
+        self.assertEqual(template.substitute(values), ['plain', obj, 'a.c', 'b.c'])
+
     def test_needs_exe_wrapper_override(self):
         config = ConfigParser()
         config['binaries'] = {
@@ -854,6 +884,454 @@ class InternalTests(unittest.TestCase):
                 PkgConfigDependency.pkgbin_cache = {}
                 PkgConfigDependency.class_pkgbin = PerMachine(None, None, None)
 
+    def test_program_cache(self):
+        cache = mesonbuild.mesonlib.ProgramCache()
+        searches = []
+
+        def search(name, search_dir):
+            searches.append(name)
+            return [shutil.which(name)]
+
+        with tempfile.TemporaryDirectory() as d, mock.patch.dict(os.environ, {'PATH': d}):
+            self.assertEqual(cache.search('prog', None, search), [None])
+            self.assertEqual(cache.search('prog', None, search), [None])
+            self.assertEqual(len(searches), 1)
+            # Adding a program to a directory in PATH invalidates the entry
+            prog = os.path.join(d, 'prog.exe' if is_windows() else 'prog')
+            shutil.copy(sys.executable, prog)
+            self.assertEqual(cache.search('prog', None, search), [prog])
+            self.assertEqual(cache.search('prog', None, search), [prog])
+            self.assertEqual(len(searches), 2)
+            # Version probes are only run once
+            cmd = [sys.executable, '-c', 'print("1.2.3")']
+            p, out, _ = cache.run(cmd)
+            self.assertIsInstance(p, subprocess.Popen)
+            self.assertEqual(out.strip(), '1.2.3')
+            p, out, _ = cache.run(cmd)
+            self.assertIsInstance(p, subprocess.CompletedProcess)
+            self.assertEqual(p.returncode, 0)
+            self.assertEqual(out.strip(), '1.2.3')
+
+    def test_pkgconfig_builtin_resolver(self):
+        from mesonbuild.dependencies.pcfile import PcResolver
+        with tempfile.TemporaryDirectory() as tmpdir:
+            def write_pc(name, content):
+                with open(os.path.join(tmpdir, name + '.pc'), 'w') as f:
+                    f.write(textwrap.dedent(content))
+            write_pc('foo', """\
+                prefix=/opt/foo
+                libdir=${prefix}/lib # trailing comment
+                includedir=${prefix}/include
+                dollar=$${prefix}
+
+                Name: foo
+                Version: 1.2.3
+                Requires: bar >= 2.0
+                Requires.private: baz
+                CFlags: -I${includedir} -DFOO="a b"
+                Libs: -L${libdir} -lfoo
+                Libs.private: -lm
+                """)
+            write_pc('bar', """\
+                prefix=/usr
+                Name: bar
+                Version: 2.1
+                Cflags: -I${prefix}/include -I/opt/bar/include
+                Libs: -L${prefix}/lib -lbar -lcommon
+                """)
+            write_pc('baz', """\
+                Name: baz
+                Version: 0.1
+                Requires: bar
+                Cflags: -DBAZ
+                Libs: -lbaz \\
+                  -lcommon
+                """)
+            write_pc('needsnewbar', """\
+                Name: needsnewbar
+                Version: 1
+                Requires: bar > 3
+                """)
+            r = PcResolver([tmpdir], system_include_path=['/usr/include'],
+                           system_library_path=['/usr/lib'])
+            self.assertEqual(r.query(['--modversion', 'foo'], {}), (0, '1.2.3'))
+            self.assertEqual(r.query(['--variable=dollar', 'foo'], {}), (0, '${prefix}'))
+            self.assertEqual(r.query(['--define-variable=prefix=/x', '--variable=libdir', 'foo'], {}),
+                             (0, '/x/lib'))
+            self.assertEqual(r.query(['--variable=pcfiledir', 'foo'], {}), (0, tmpdir))
+            self.assertEqual(r.query(['--variable=nope', 'foo'], {}), (0, ''))
+            rc, out = r.query(['--cflags', 'foo'], {})
+            self.assertEqual(rc, 0)
+            self.assertEqual(shlex.split(out), ['-I/opt/foo/include', '-DFOO=a b', '-DBAZ', '-I/opt/bar/include'])
+            rc, out = r.query(['--cflags', 'foo'], {'PKG_CONFIG_ALLOW_SYSTEM_CFLAGS': '1'})
+            self.assertIn('-I/usr/include', shlex.split(out))
+            # Private requirements only contribute libraries when linking statically
+            self.assertEqual(r.query(['--libs', 'foo'], {}), (0, '-L/opt/foo/lib -lfoo -lbar -lcommon'))
+            self.assertEqual(r.query(['--libs', '--static', 'foo'], {}),
+                             (0, '-L/opt/foo/lib -lfoo -lm -lbaz -lbar -lcommon'))
+            rc, out = r.query(['--libs', 'foo'], {'PKG_CONFIG_ALLOW_SYSTEM_LIBS': '1'})
+            self.assertEqual(out, '-L/opt/foo/lib -lfoo -L/usr/lib -lbar -lcommon')
+            rc, out = r.query(['--modversion', 'needsnewbar'], {})
+            self.assertEqual(rc, 0)
+            rc, out = r.query(['--libs', 'needsnewbar'], {})
+            self.assertEqual(rc, 1)
+            self.assertIn('bar', out)
+            rc, out = r.query(['--modversion', 'missing'], {})
+            self.assertEqual(rc, 1)
+            # The sysroot is prepended to include and library paths
+            r = PcResolver([tmpdir], sysroot='/sysroot', system_include_path=[], system_library_path=[])
+            self.assertEqual(r.query(['--cflags', 'bar'], {}), (0, '-I/sysroot/usr/include -I/sysroot/opt/bar/include'))
+            self.assertEqual(r.query(['--variable=pc_sysrootdir', 'bar'], {}), (0, '/sysroot'))
+            # Adding a file to the search path is picked up
+            write_pc('late', """\
+                Name: late
+                Version: 5
+                """)
+            os.utime(tmpdir, ns=(0, 0))
+            self.assertEqual(r.query(['--modversion', 'late'], {}), (0, '5'))
+            stamps = r.files_for(['foo'])
+            self.assertEqual(set(stamps), {tmpdir} | {os.path.join(tmpdir, n + '.pc') for n in ('foo', 'bar', 'baz')})
+
+    def test_pkgconfig_builtin_cache_per_machine(self):
+        # Without a pkg-config binary, the lookups for the build and the host
+        # machine of a cross build must not share cached results
+        class Resolver:
+            def __init__(self, out):
+                self.out = out
+
+            def query(self, args, env):
+                return 0, self.out
+
+        deps = []
+        for is_cross_machine in (False, True):
+            dep = PkgConfigDependency.__new__(PkgConfigDependency)
+            dep.pkgbin = None
+            dep.builtin_impl = True
+            dep.is_cross_machine = is_cross_machine
+            dep._get_resolver = lambda env, out='-I/' + ('host' if is_cross_machine else 'build'): Resolver(out)
+            deps.append(dep)
+        old_cache = PkgConfigDependency.pkgbin_cache
+        PkgConfigDependency.pkgbin_cache = {}
+        try:
+            self.assertEqual(deps[0]._call_pkgbin(['--cflags', 'foo']), (0, '-I/build'))
+            self.assertEqual(deps[1]._call_pkgbin(['--cflags', 'foo']), (0, '-I/host'))
+        finally:
+            PkgConfigDependency.pkgbin_cache = old_cache
+
+    def test_wrap_download_cache(self):
+        import http.server
+        import socketserver
+        import tarfile
+        import threading
+        import urllib.parse
+        from mesonbuild.wrap.wrap import Resolver
+
+        files = {}
+        requests = []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                requests.append((self.path, self.client_address))
+                # Proxies are sent the whole URL
+                data = files[urllib.parse.urlsplit(self.path).path]
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            daemon_threads = True
+
+        def make_archive(members):
+            buf = io.BytesIO()
+            with tarfile.open(fileobj=buf, mode='w:gz') as tf:
+                for name, content in members.items():
+                    info = tarfile.TarInfo(name)
+                    info.size = len(content)
+                    tf.addfile(info, io.BytesIO(content))
+            return buf.getvalue()
+
+        files['/foo-1.0.tar.gz'] = make_archive({'foo-1.0/foo.c': b'int foo(void) { return 0; }\n'})
+        files['/foo-patch.tar.gz'] = make_archive({'foo-1.0/meson.build': b"project('foo', 'c')\n"})
+        server = Server(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+            wrap = textwrap.dedent('''\
+                [wrap-file]
+                directory = foo-1.0
+                source_url = {0}/foo-1.0.tar.gz
+                source_filename = foo-1.0.tar.gz
+                source_hash = {1}
+                patch_url = {0}/foo-patch.tar.gz
+                patch_filename = foo-patch.tar.gz
+                patch_hash = {2}
+                ''').format(url, hashlib.sha256(files['/foo-1.0.tar.gz']).hexdigest(),
+                            hashlib.sha256(files['/foo-patch.tar.gz']).hexdigest())
+            # The server is not a proxy, so nothing can be downloaded if a
+            # proxy is used for it
+            env = {'MESON_CACHE_DIR': '', 'http_proxy': 'http://127.0.0.1:1', 'no_proxy': '127.0.0.1'}
+            with tempfile.TemporaryDirectory() as tmpdir, mock.patch.dict(os.environ, env):
+                os.environ['MESON_CACHE_DIR'] = os.path.join(tmpdir, 'cache')
+                spdirs = []
+                for i in range(4):
+                    spdir = os.path.join(tmpdir, 'tree{}'.format(i), 'subprojects')
+                    os.makedirs(spdir)
+                    with open(os.path.join(spdir, 'foo.wrap'), 'w') as f:
+                        f.write(wrap)
+                    spdirs.append(spdir)
+                # Both archives are fetched over one connection and added
+                # to the shared cache
+                self.assertEqual(Resolver(spdirs[0]).resolve('foo'), 'foo-1.0')
+                self.assertTrue(os.path.isfile(os.path.join(spdirs[0], 'foo-1.0', 'meson.build')))
+                self.assertEqual([p for p, _ in requests], ['/foo-1.0.tar.gz', '/foo-patch.tar.gz'])
+                self.assertEqual(requests[0][1], requests[1][1])
+                shared = os.listdir(os.path.join(tmpdir, 'cache', 'downloads', 'sha256'))
+                self.assertEqual(len(shared), 2)
+                # Other source trees get them from the shared cache
+                self.assertEqual(Resolver(spdirs[1]).prefetch(), [])
+                self.assertEqual(sorted(os.listdir(os.path.join(spdirs[1], 'packagecache'))),
+                                 ['foo-1.0.tar.gz', 'foo-patch.tar.gz'])
+                self.assertFalse(os.path.exists(os.path.join(spdirs[1], 'foo-1.0')))
+                self.assertEqual(len(requests), 2)
+                # A corrupted shared file is downloaded again, and the copies
+                # in the source trees are not affected
+                with open(os.path.join(tmpdir, 'cache', 'downloads', 'sha256', shared[0]), 'wb') as f:
+                    f.write(b'garbage')
+                self.assertEqual(Resolver(spdirs[2]).prefetch(), [])
+                self.assertEqual(len(requests), 3)
+                for spdir in spdirs[:3]:
+                    for name in ['foo-1.0.tar.gz', 'foo-patch.tar.gz']:
+                        with open(os.path.join(spdir, 'packagecache', name), 'rb') as f:
+                            self.assertEqual(f.read(), files['/' + name])
+                # Downloads go through the proxy set in the environment
+                with open(os.path.join(spdirs[3], 'foo.wrap'), 'w') as f:
+                    f.write(wrap.replace(url, 'http://wraps.invalid'))
+                os.environ.update({'MESON_CACHE_DIR': '', 'http_proxy': url, 'no_proxy': ''})
+                self.assertEqual(Resolver(spdirs[3]).resolve('foo'), 'foo-1.0')
+                self.assertEqual([p for p, _ in requests[3:]], ['http://wraps.invalid/foo-1.0.tar.gz',
+                                                                'http://wraps.invalid/foo-patch.tar.gz'])
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def test_transitive_dependencies(self):
+        '''
+        Test that the cached link dependencies of build targets are in the
+        same order, with the same duplicates removed and the same libraries
+        excluded, as when they were walked again for every target.
+        '''
+        import random
+        from mesonbuild import build
+
+        def old_get_dependencies(target, exclude=None, internal=True):
+            transitive_deps = []
+            if exclude is None:
+                exclude = []
+            if internal:
+                link_targets = target.link_targets + target.link_whole_targets
+            else:
+                link_targets = target.link_targets
+            for t in link_targets:
+                if t in transitive_deps or t in exclude:
+                    continue
+                transitive_deps.append(t)
+                if isinstance(t, build.StaticLibrary):
+                    transitive_deps += old_get_dependencies(t, transitive_deps + exclude, internal)
+            return transitive_deps
+
+        def make_target(cls, name):
+            t = cls.__new__(cls)
+            t.name = name
+            t.link_targets = []
+            t.link_whole_targets = []
+            t.transitive_dependencies = {}
+            return t
+
+        rand = random.Random(42)
+        for _ in range(50):
+            targets = []
+            for i in range(30):
+                cls = rand.choice([build.StaticLibrary, build.StaticLibrary, build.SharedLibrary])
+                t = make_target(cls, 'lib{}'.format(i))
+                # Only link to earlier targets, with some duplicates, like
+                # a target created after the ones it links to
+                if targets:
+                    t.link_targets = rand.choices(targets, k=rand.randint(0, 4))
+                    statics = [l for l in targets if isinstance(l, build.StaticLibrary)]
+                    if statics:
+                        t.link_whole_targets = rand.choices(statics, k=rand.randint(0, 2))
+                targets.append(t)
+            exe = make_target(build.Executable, 'exe')
+            exe.link_targets = rand.choices(targets, k=5)
+            exe.link_whole_targets = [t for t in rand.choices(targets, k=2)
+                                      if isinstance(t, build.StaticLibrary)]
+            for t in targets + [exe]:
+                for internal in (True, False):
+                    self.assertEqual(t.get_dependencies(internal=internal),
+                                     old_get_dependencies(t, internal=internal))
+                    exclude = rand.choices(targets, k=3)
+                    self.assertEqual(t.get_dependencies(exclude, internal=internal),
+                                     old_get_dependencies(t, exclude, internal=internal))
+            # The dependencies cannot change once they have been used
+            with self.assertRaises(mesonbuild.mesonlib.MesonException):
+                exe.link(targets[0])
+            with self.assertRaises(mesonbuild.mesonlib.MesonException):
+                targets[-1].link_whole(targets[0])
+
+    def test_stacked_decorator_checks(self):
+        '''
+        Test that stacked argument and feature checks all run, in the order
+        of the decorators, and that features warn once per configure.
+        '''
+        from mesonbuild.interpreterbase import (
+            InvalidArguments, _add_check, noPosargs, noKwargs, disablerIfNotFound,
+            FeatureNew, FeatureDeprecated
+        )
+        calls = []
+
+        def check(name):
+            return lambda s, node, args, kwargs, subproject: calls.append((name, subproject))
+
+        def checked(name):
+            return lambda f: _add_check(f, check(name))
+
+        class Holder:
+            current_node = None
+            subproject = 'decorated'
+
+            @FeatureNew('new thing', '0.99.0')
+            @checked('outer')
+            @disablerIfNotFound
+            @FeatureDeprecated('old thing', '0.50.0')
+            @noPosargs
+            @noKwargs
+            def method(self, args, kwargs):
+                calls.append(('method', None))
+                return 'result'
+
+        # _add_check() is normally called by decorator classes
+        Holder.method = _add_check(Holder.method, check('first'), want_subproject=True)
+        obj = Holder()
+        with mock.patch.dict(mesonbuild.mesonlib.project_meson_versions, {'decorated': '>=0.45'}), \
+                mock.patch.object(mesonbuild.mlog, 'warning') as warning, \
+                mock.patch.object(mesonbuild.mlog, 'deprecation') as deprecation:
+            FeatureNew.reset()
+            FeatureDeprecated.reset()
+            self.assertEqual(obj.method([], {}), 'result')
+            self.assertEqual(calls, [('first', 'decorated'), ('outer', 'decorated'), ('method', None)])
+            with self.assertRaisesRegex(InvalidArguments, 'positional'):
+                obj.method(['a'], {})
+            with self.assertRaisesRegex(InvalidArguments, 'keyword'):
+                obj.method([], {'a': 1})
+            self.assertEqual(warning.call_count, 1)
+            self.assertEqual(deprecation.call_count, 1)
+            # A new configure warns again
+            FeatureNew.reset()
+            FeatureDeprecated.reset()
+            obj.method([], {})
+            self.assertEqual(warning.call_count, 2)
+            self.assertEqual(deprecation.call_count, 2)
+        FeatureNew.reset()
+        FeatureDeprecated.reset()
+
+    def test_dist_xz_archive(self):
+        '''
+        Test that the .tar.xz dist archive has the same bytes as tarfile
+        writes, whatever xz program is installed.
+        '''
+        import gzip
+        import lzma
+        import tarfile
+        from mesonbuild.scripts import dist
+        with tempfile.TemporaryDirectory() as d:
+            distdir = os.path.join(d, 'foo-1.0')
+            os.makedirs(os.path.join(distdir, 'sub'))
+            with open(os.path.join(distdir, 'meson.build'), 'w') as f:
+                f.write("project('foo', 'c')\n")
+            with open(os.path.join(distdir, 'sub', 'data.bin'), 'wb') as f:
+                f.write(bytes(range(256)) * 8192)
+            archives = dist.create_archives(distdir, 'foo-1.0', ['xztar', 'gztar'])
+            self.assertEqual([os.path.basename(a[0]) for a in archives], ['foo-1.0.tar.xz', 'foo-1.0.tar.gz'])
+            reference = os.path.join(d, 'reference.tar.xz')
+            with tarfile.open(reference, 'w:xz') as tf:
+                for path, name, _ in dist.walk_tree(distdir, 'foo-1.0'):
+                    tf.add(path, name, recursive=False)
+            with open(distdir + '.tar.xz', 'rb') as f1, open(reference, 'rb') as f2:
+                self.assertEqual(f1.read(), f2.read())
+            for fname, digest in archives:
+                with open(fname, 'rb') as f:
+                    self.assertEqual(hashlib.sha256(f.read()).hexdigest(), digest)
+            # Both archives hold the same tar stream
+            with lzma.open(distdir + '.tar.xz') as f1, gzip.open(distdir + '.tar.gz') as f2:
+                self.assertEqual(f1.read(), f2.read())
+
+    def test_ninja_log_analysis(self):
+        from mesonbuild import manalyze
+        log = textwrap.dedent('''\
+            # ninja log v5
+            0	900	0	old.o	1
+            0	100	0	a.o	11
+            0	250	0	b.o	12
+            100	400	0	c.o	16
+            300	400	0	gen.h	13
+            300	400	0	gen.c	13
+            400	600	0	gen.o	14
+            600	650	0	libfoo.a	15
+            700	800	0	prog	17
+            ''').splitlines(True)
+        steps = manalyze.parse_ninja_log(log)
+        # Only the last build counts and outputs of one command are one step
+        self.assertEqual([s.outputs for s in steps],
+                         [['a.o'], ['b.o'], ['c.o'], ['gen.h', 'gen.c'], ['gen.o'], ['libfoo.a'], ['prog']])
+        graph = textwrap.dedent('''\
+            digraph ninja {
+            "0x1" [label="prog"]
+            "0x2" [label="c_LINKER", shape=ellipse]
+            "0x2" -> "0x1"
+            "0x3" -> "0x2" [arrowhead=none]
+            "0x4" -> "0x2" [arrowhead=none]
+            "0x3" [label="c.o"]
+            "0x5" -> "0x3" [label=" c_COMPILER"]
+            "0x5" [label="c.c"]
+            "0x4" [label="libfoo.a"]
+            "0x6" [label="c_STATIC_LINKER", shape=ellipse]
+            "0x6" -> "0x4"
+            "0x7" -> "0x6" [arrowhead=none]
+            "0x8" -> "0x6" [arrowhead=none]
+            "0x9" -> "0x6" [arrowhead=none]
+            "0x7" [label="a.o"]
+            "0x8" [label="b.o"]
+            "0x9" [label="gen.o"]
+            "0x10" -> "0x9" [label=" c_COMPILER"]
+            "0x10" [label="gen.c"]
+            "0x11" [label="custom", shape=ellipse]
+            "0x11" -> "0x10"
+            "0x11" -> "0x12"
+            "0x13" -> "0x11" [arrowhead=none]
+            "0x13" [label="gen \\"quoted\\".py"]
+            }
+            ''')
+        inputs = manalyze.parse_ninja_graph(graph)
+        self.assertEqual(inputs['prog'], ['c.o', 'libfoo.a'])
+        self.assertEqual(inputs['gen.c'], ['gen "quoted".py'])
+        self.assertNotIn('gen.h', inputs)
+        path = manalyze.critical_path(steps, inputs)
+        self.assertEqual([s.name for s in path], ['gen.h', 'gen.o', 'libfoo.a', 'prog'])
+        buckets = manalyze.parallelism(steps, 2)
+        self.assertAlmostEqual(buckets[0]['average'], 750 / 400)
+        self.assertAlmostEqual(buckets[1]['average'], 350 / 400)
+        # At most two steps ran at the same time
+        lanes = manalyze.assign_lanes(steps)
+        self.assertEqual(sorted(set(lanes.values())), [0, 1])
+
     def test_version_compare(self):
         comparefunc = mesonbuild.mesonlib.version_compare_many
         for (a, b, result) in [
@@ -962,6 +1440,14 @@ class InternalTests(unittest.TestCase):
             ver_b = Version(b)
             self.assertEqual(ver_a.__cmp__(ver_b), result)
             self.assertEqual(ver_b.__cmp__(ver_a), -result)
+            self.assertEqual(ver_a < ver_b, result < 0)
+            self.assertEqual(ver_a <= ver_b, result <= 0)
+            self.assertEqual(ver_a == ver_b, result == 0)
+            self.assertEqual(ver_a != ver_b, result != 0)
+            self.assertEqual(ver_a > ver_b, result > 0)
+            self.assertEqual(ver_a >= ver_b, result >= 0)
+            if result == 0:
+                self.assertEqual(hash(ver_a), hash(ver_b))
 
 @unittest.skipIf(is_tarball(), 'Skipping because this is a tarball release')
 class DataTests(unittest.TestCase):
@@ -1055,6 +1541,27 @@ class DataTests(unittest.TestCase):
             defined = set([a.strip() for a in res.group().split('\\')][1:])
             self.assertEqual(defined, set(chain(interp.funcs.keys(), interp.builtin.keys())))
 
+    def test_guess_library_absolute_path(self):
+        '''
+        Ensure that libraries are found in the directories that can be listed
+        and in those that can only be traversed.
+        '''
+        from mesonbuild.backend.ninjabackend import NinjaBackend
+        env = get_fake_env()
+        with tempfile.TemporaryDirectory() as d:
+            libfile = os.path.join(d, 'libfoo.so')
+            open(libfile, 'w').close()
+            libfile = os.path.realpath(libfile)
+            search_dirs = (os.path.join(d, 'missing'), d)
+            patterns = ('lib{}.so', 'lib{}.a')
+            backend = NinjaBackend(Build(env))
+            self.assertEqual(backend.guess_library_absolute_path(None, 'foo', search_dirs, patterns), libfile)
+            self.assertIsNone(backend.guess_library_absolute_path(None, 'bar', search_dirs, patterns))
+            backend = NinjaBackend(Build(env))
+            with mock.patch('os.scandir', side_effect=PermissionError):
+                self.assertEqual(backend.guess_library_absolute_path(None, 'foo', search_dirs, patterns), libfile)
+                self.assertIsNone(backend.guess_library_absolute_path(None, 'bar', search_dirs, patterns))
+
     def test_all_functions_defined_in_ast_interpreter(self):
         '''
         Ensure that the all functions defined in the Interpreter are also defined
@@ -1402,6 +1909,42 @@ class AllPlatformTests(BasePlatformTests):
         self.assertEqual(conf_file('@VAR@\n@VAR@\n', confdata), 'foo\nfoo\n')
         self.assertEqual(conf_file('@VAR@\r\n@VAR@\r\n', confdata), 'foo\r\nfoo\r\n')
 
+    def test_do_conf_file_large_template(self):
+        confdata = ConfigurationData()
+        for i in range(100):
+            confdata.values['VAR{}'.format(i)] = ('value{}'.format(i), '')
+        confdata.values['NUM'] = (42, '')
+        confdata.values['YES'] = (True, '')
+        lines = []
+        expected = []
+        for i in range(20000):
+            lines.append('@VAR{}@ \\@NUM@ @NUM@ @MISSING@\n'.format(i % 100))
+            expected.append('value{} @NUM@ 42 \n'.format(i % 100))
+            lines.append('#mesondefine YES\r\n' if i % 2 else '#mesondefine NO\r')
+            expected.append('#define YES\n' if i % 2 else '/* #undef NO */\n')
+        lines.append('#mesondefine NUM')
+        expected.append('#define NUM 42\n')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fin = os.path.join(tmpdir, 'config.h.in')
+            fout = os.path.join(tmpdir, 'config.h')
+            with open(fin, 'w', newline='') as f:
+                f.write(''.join(lines))
+            missing, useless = mesonbuild.mesonlib.do_conf_file(fin, fout, confdata, 'meson')
+            self.assertEqual(missing, {'MISSING'})
+            self.assertFalse(useless)
+            with open(fout, newline='') as f:
+                self.assertEqual(f.read(), ''.join(expected))
+            # An unchanged output is left alone
+            mtime = os.stat(fout).st_mtime_ns
+            time.sleep(0.01)
+            mesonbuild.mesonlib.do_conf_file(fin, fout, confdata, 'meson')
+            self.assertEqual(os.stat(fout).st_mtime_ns, mtime)
+            self.assertFalse(os.path.exists(fout + '~'))
+            confdata.values['NUM'] = (43, '')
+            mesonbuild.mesonlib.do_conf_file(fin, fout, confdata, 'meson')
+            with open(fout, newline='') as f:
+                self.assertIn('#define NUM 43\n', f.read())
+
     def test_absolute_prefix_libdir(self):
         '''
         Tests that setting absolute paths for --prefix and --libdir work. Can't
@@ -1635,6 +2178,94 @@ class AllPlatformTests(BasePlatformTests):
         self.uninstall()
         self.assertPathDoesNotExist(exename)
 
+    def test_install_incremental(self):
+        '''
+        Test that incremental installs skip unchanged files and still list
+        them in the install log, and that parallel installs write the same
+        install log as serial ones.
+        '''
+        if self.backend is not Backend.ninja:
+            raise unittest.SkipTest('{!r} backend can\'t install files'.format(self.backend.name))
+        exename = os.path.join(self.installdir, 'usr/bin/prog' + exe_suffix)
+        testdir = os.path.join(self.common_test_dir, '8 install')
+        self.init(testdir)
+        self.build()
+        logfile = os.path.join(self.logdir, 'install-log.txt')
+        install = self.meson_command + ['install', '--no-rebuild']
+        with mock.patch.dict(os.environ, {'DESTDIR': self.installdir}):
+            # Directories are only logged by the install that creates them
+            self._run(install, workdir=self.builddir)
+            self._run(install + ['--num-processes=1'], workdir=self.builddir)
+            with open(logfile) as f:
+                serial_log = f.read()
+            out = self._run(install + ['--num-processes=4', '--incremental'], workdir=self.builddir)
+            self.assertNotIn('Keeping up-to-date file', out)
+            with open(logfile) as f:
+                self.assertEqual(f.read(), serial_log)
+            out = self._run(install + ['--incremental'], workdir=self.builddir)
+            self.assertIn('Keeping up-to-date file ' + exename, out)
+            self.assertNotIn('Installing', out)
+            with open(logfile) as f:
+                self.assertEqual(f.read(), serial_log)
+            # Changing an installed file installs it again
+            with open(exename, 'ab') as f:
+                f.write(b'\0')
+            out = self._run(install + ['--incremental'], workdir=self.builddir)
+            self.assertNotIn('Keeping up-to-date file ' + exename, out)
+            self.assertIn('Installing prog' + exe_suffix, out)
+
+    def test_install_copy_strategy(self):
+        '''
+        Test that files are linked into DESTDIR when asked to, unless they
+        are installed with another mode than their source.
+        '''
+        if self.backend is not Backend.ninja:
+            raise unittest.SkipTest('{!r} backend can\'t install files'.format(self.backend.name))
+        if is_windows():
+            raise unittest.SkipTest('Creating symlinks needs special privileges on Windows')
+        with tempfile.TemporaryDirectory() as d:
+            # Hard links need the source on the same file system
+            testdir = os.path.join(d, 'src')
+            shutil.copytree(os.path.join(self.common_test_dir, '63 install subdir'), testdir)
+            self.init(testdir)
+            self.build()
+            src = os.path.join(testdir, 'nested_elided/sub/eighth.dat')
+            dst = os.path.join(self.installdir, 'usr/share/eighth.dat')
+            moded_src = os.path.join(testdir, 'sub1/second.dat')
+            moded_dst = os.path.join(self.installdir, 'usr/share/sub1/second.dat')
+            install = self.meson_command + ['install', '--no-rebuild']
+            with mock.patch.dict(os.environ, {'DESTDIR': self.installdir}):
+                for strategy in ('hardlink', 'symlink', 'auto', 'reflink', 'copy'):
+                    self._run(install + ['--copy-strategy=' + strategy], workdir=self.builddir)
+                    self.assertEqual(os.path.samefile(src, dst), strategy in ('hardlink', 'symlink'))
+                    self.assertEqual(os.path.islink(dst), strategy == 'symlink')
+                    self.assertFalse(os.path.samefile(moded_src, moded_dst))
+                    with open(src) as f1, open(dst) as f2:
+                        self.assertEqual(f1.read(), f2.read())
+
+    def test_install_strip_failure(self):
+        '''
+        Test that a strip failure in a parallel install prints what strip
+        printed and fails the install with an error.
+        '''
+        if self.backend is not Backend.ninja:
+            raise unittest.SkipTest('{!r} backend can\'t install files'.format(self.backend.name))
+        if not shutil.which('false'):
+            raise unittest.SkipTest('No false program to use as strip')
+        testdir = os.path.join(self.common_test_dir, '8 install')
+        native_file = os.path.join(self.builddir, 'native.ini')
+        with open(native_file, 'w') as f:
+            f.write("[binaries]\nstrip = '{}'\n".format(shutil.which('false')))
+        self.init(testdir, extra_args=['-Dstrip=true', '--native-file', native_file])
+        self.build()
+        install = self.meson_command + ['install', '--no-rebuild', '--num-processes=4']
+        with mock.patch.dict(os.environ, {'DESTDIR': self.installdir}):
+            p = subprocess.run(install, cwd=self.builddir, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, universal_newlines=True)
+        self.assertEqual(p.returncode, 1, p.stdout)
+        self.assertIn('Stripping target', p.stdout)
+        self.assertIn('ERROR: Could not strip file', p.stdout)
+
     def test_forcefallback(self):
         testdir = os.path.join(self.unit_test_dir, '31 forcefallback')
         self.init(testdir, ['--wrap-mode=forcefallback'])
@@ -1978,6 +2609,24 @@ class AllPlatformTests(BasePlatformTests):
             if hasattr(cc, 'is_64'):
                 self.assertEqual(cc.is_64, wcc.is_64)
 
+    def test_compiler_detection_cache(self):
+        '''
+        Test that new build directories reuse the compiler detection results
+        of earlier ones through the user cache directory.
+        '''
+        testdir = os.path.join(self.common_test_dir, '1 trivial')
+        with tempfile.TemporaryDirectory() as d:
+            with mock.patch.dict(os.environ, {'MESON_CACHE_DIR': d}):
+                self.init(testdir)
+                log = ''.join(self.get_meson_log())
+                self.assertIn('Sanity check compiler command line', log)
+                self.assertNotIn('is cached', log)
+                self.new_builddir()
+                self.init(testdir)
+                log = ''.join(self.get_meson_log())
+                self.assertNotIn('Sanity check compiler command line', log)
+                self.assertRegex(log, 'Sanity check of C compiler .* is cached')
+
     def test_always_prefer_c_compiler_for_asm(self):
         testdir = os.path.join(self.common_test_dir, '138 c cpp and asm')
         # Skip if building with MSVC
@@ -2128,6 +2777,18 @@ class AllPlatformTests(BasePlatformTests):
             # fails sometimes.
             pass
 
+    def test_dist_git_formats(self):
+        if not shutil.which('git'):
+            raise unittest.SkipTest('Git not found')
+
+        try:
+            self.dist_impl(_git_init, ['xztar', 'gztar', 'zip'])
+        except PermissionError:
+            # When run under Windows CI, something (virus scanner?)
+            # holds on to the git files so cleaning up the dir
+            # fails sometimes.
+            pass
+
     def test_dist_hg(self):
         if not shutil.which('hg'):
             raise unittest.SkipTest('Mercurial not found')
@@ -2168,7 +2829,7 @@ class AllPlatformTests(BasePlatformTests):
             # fails sometimes.
             pass
 
-    def dist_impl(self, vcs_init):
+    def dist_impl(self, vcs_init, formats=None):
         # Create this on the fly because having rogue .git directories inside
         # the source tree leads to all kinds of trouble.
         with tempfile.TemporaryDirectory() as project_dir:
@@ -2186,12 +2847,22 @@ int main(int argc, char **argv) {
 }
 ''')
             vcs_init(project_dir)
-            self.init(project_dir)
+            if formats is None:
+                self.init(project_dir)
+                formats = ['xztar']
+            else:
+                self.init(project_dir, extra_args=['-Ddist_formats=' + ','.join(formats)])
             self.build('dist')
-            distfile = os.path.join(self.distdir, 'disttest-1.4.3.tar.xz')
-            checksumfile = distfile + '.sha256sum'
-            self.assertPathExists(distfile)
-            self.assertPathExists(checksumfile)
+            extensions = {'xztar': '.tar.xz', 'gztar': '.tar.gz', 'zip': '.zip'}
+            for fmt in formats:
+                distfile = os.path.join(self.distdir, 'disttest-1.4.3' + extensions[fmt])
+                checksumfile = distfile + '.sha256sum'
+                self.assertPathExists(distfile)
+                self.assertPathExists(checksumfile)
+                with open(distfile, 'rb') as f:
+                    digest = hashlib.sha256(f.read()).hexdigest()
+                with open(checksumfile) as f:
+                    self.assertEqual(f.read(), '{} {}\n'.format(digest, os.path.basename(distfile)))
 
     def test_rpath_uses_ORIGIN(self):
         '''
@@ -2562,6 +3233,288 @@ int main(int argc, char **argv) {
         subprocess.check_call(self.wrap_command + ['promote', 'subprojects/s2/subprojects/ambiguous.wrap'], cwd=workdir)
         self.assertTrue(os.path.isfile(ambiguous_wrap))
 
+    def test_subprojects_parallel(self):
+        if not shutil.which('git'):
+            raise unittest.SkipTest('Git not found')
+        workdir = os.path.join(self.builddir, 'work')
+        spdir = os.path.join(workdir, 'subprojects')
+        os.makedirs(spdir)
+        with open(os.path.join(workdir, 'meson.build'), 'w') as f:
+            f.write("project('parallel')\n")
+        names = ['s{}'.format(i) for i in range(6)]
+        for name in names:
+            repo = os.path.join(self.builddir, 'repos', name)
+            os.makedirs(repo)
+            with open(os.path.join(repo, 'meson.build'), 'w') as f:
+                f.write("project('{}')\n".format(name))
+            _git_init(repo)
+            subprocess.check_call(['git', 'checkout', '-b', 'wrapbranch'], cwd=repo,
+                                  stderr=subprocess.DEVNULL)
+            with open(os.path.join(spdir, name + '.wrap'), 'w') as f:
+                f.write('[wrap-git]\nurl = {}\nrevision = wrapbranch\n'.format(Path(repo).as_uri()))
+        with open(os.path.join(spdir, 'missing.wrap'), 'w') as f:
+            f.write('[wrap-git]\nurl = {}\nrevision = wrapbranch\n'.format(
+                Path(self.builddir, 'repos', 'missing').as_uri()))
+
+        def run(*args):
+            p = subprocess.run(self.meson_command + ['subprojects'] + list(args) + ['--num-processes', '4'],
+                               cwd=workdir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               universal_newlines=True)
+            return p.returncode, p.stdout
+
+        def sections(out, header):
+            # Each subproject's messages come in one block, in order
+            blocks = re.split(r'^(?={} )'.format(header), out, flags=re.MULTILINE)[1:]
+            self.assertEqual([b.split()[1].rstrip('.') for b in blocks], ['missing'] + names)
+            return blocks
+
+        rc, out = run('download')
+        self.assertEqual(rc, 1)
+        blocks = sections(out, 'Download')
+        self.assertNotIn('-> done', blocks[0])
+        for block in blocks[1:-1]:
+            self.assertTrue(block.rstrip().endswith('-> done'), block)
+        self.assertIn('Processed 7 subprojects, 1 failed: missing', out)
+        for name in names:
+            self.assertTrue(os.path.isfile(os.path.join(spdir, name, 'meson.build')))
+
+        repo = os.path.join(self.builddir, 'repos', 's3')
+        with open(os.path.join(repo, 'new.txt'), 'w') as f:
+            f.write('new\n')
+        subprocess.check_call(['git', 'add', 'new.txt'], cwd=repo)
+        subprocess.check_call(['git', 'commit', '-m', 'new file'], cwd=repo, stdout=subprocess.DEVNULL)
+        rc, out = run('update', *names)
+        self.assertEqual(rc, 0, out)
+        self.assertEqual(len(re.findall(r'^Updating ', out, flags=re.MULTILINE)), len(names))
+        self.assertIn('Processed 6 subprojects, none failed', out)
+        self.assertTrue(os.path.isfile(os.path.join(spdir, 's3', 'new.txt')))
+
+    def test_parallel_subprojects(self):
+        '''
+        Test that subprojects configured concurrently give the same output and
+        build as when they are configured one after the other.
+        '''
+        testdir = os.path.join(self.unit_test_dir, '58 parallel subprojects')
+        results = []
+        for parallel in ['false', 'true']:
+            self.new_builddir()
+            out = self.init(testdir, extra_args=['-Dparallel_subprojects=' + parallel])
+            out = [l for l in out.splitlines() if self.builddir not in l and testdir not in l]
+            targets = json.dumps(self.introspect('--targets'), sort_keys=True)
+            results.append((out, targets.replace(self.builddir, '@BUILDDIR@')))
+            self.build()
+            self.run_tests()
+        log = ''.join(self.get_meson_log())
+        # c calls another subproject so it is configured in order, b is
+        # configured again because a found a dependency it looks up, and e
+        # is configured again after the main project overrides a program
+        self.assertIn('Configuring subprojects concurrently: a, b, e\n', log)
+        self.assertNotIn('Configuring subproject a again\n', log)
+        self.assertIn('Configuring subproject b again\n', log)
+        self.assertIn('Configuring subproject e again\n', log)
+        self.assertEqual(results[0][0], results[1][0])
+        self.assertEqual(results[0][1], results[1][1])
+        self.assertIn('Message: b uses two', results[1][0])
+        self.assertIn('|Build targets in project: 2', results[1][0])
+        self.assertEqual(len([l for l in results[1][0] if "feature introduced in '0.49.0'" in l]), 1)
+
+    def test_profile_configure(self):
+        '''
+        Test that --profile-configure writes a trace of what configuring the
+        project spent its time on.
+        '''
+        for name, categories in [('1 trivial', {'setup', 'file', 'function', 'compiler', 'process', 'target'}),
+                                 ('170 dependency factory', {'dependency'})]:
+            testdir = os.path.join(self.common_test_dir, name)
+            self.new_builddir()
+            out = self.init(testdir, extra_args=['--profile-configure'])
+            fname = os.path.join(self.logdir, 'profile-configure.json')
+            self.assertIn(fname, out)
+            with open(fname) as f:
+                events = json.load(f)['traceEvents']
+            spans = [e for e in events if e['ph'] == 'X']
+            self.assertLessEqual(categories, {e['cat'] for e in spans})
+            for e in spans:
+                self.assertGreaterEqual(e['ts'], 0)
+                self.assertGreaterEqual(e['dur'], 0)
+            self.assertIn('meson.build', [e['name'] for e in spans if e['cat'] == 'file'])
+            for e in spans:
+                if e['cat'] == 'dependency':
+                    self.assertIn('method', e['args'])
+        # Nothing is recorded without the option
+        self.new_builddir()
+        self.init(os.path.join(self.common_test_dir, '1 trivial'))
+        self.assertFalse(os.path.exists(os.path.join(self.logdir, 'profile-configure.json')))
+
+    def test_analyze_build(self):
+        '''
+        Test that meson analyze-build maps the steps of the last build to
+        targets and sources and finds the critical path through them.
+        '''
+        if self.backend is not Backend.ninja:
+            raise unittest.SkipTest('{!r} backend has no .ninja_log'.format(self.backend.name))
+        testdir = os.path.join(self.common_test_dir, '5 linkstatic')
+        self.init(testdir)
+        self.build()
+        trace = os.path.join(self.builddir, 'build-trace.json')
+        report = os.path.join(self.builddir, 'build-report.json')
+        out = self._run(self.meson_command + ['analyze-build', '--trace', trace,
+                                              '--json', report, self.builddir])
+        self.assertIn('Critical path:', out)
+        with open(report) as f:
+            report = json.load(f)
+        exe = [t for t in self.introspect('--targets') if t['name'] == 'prog'][0]
+        lib = [t for t in self.introspect('--targets') if t['name'] == 'mylib'][0]
+        targets = {t['name']: t for t in report['targets']}
+        self.assertEqual(targets[exe['id']]['steps'], 2)
+        self.assertEqual(targets[lib['id']]['steps'], 5)
+        self.assertEqual(sorted(os.path.basename(s['source']) for s in report['translation_units']),
+                         ['libfile.c', 'libfile2.c', 'libfile3.c', 'libfile4.c', 'main.c'])
+        # Linking the executable waits for one of the library objects, the
+        # library and the executable's own objects.
+        path = report['critical_path']
+        self.assertEqual(path[-1]['target'], exe['id'])
+        self.assertIn(lib['id'], [s['target'] for s in path])
+        with open(trace) as f:
+            events = json.load(f)['traceEvents']
+        self.assertEqual(len(events), len(report['steps']))
+        # Nothing to report without a build
+        self.new_builddir()
+        self.init(testdir)
+        with self.assertRaises(subprocess.CalledProcessError):
+            self._run(self.meson_command + ['analyze-build', self.builddir])
+
+    def test_compile_cache(self):
+        '''
+        Test that a second build directory reuses the objects compiled in
+        the first one.
+        '''
+        if self.backend is not Backend.ninja:
+            raise unittest.SkipTest('{!r} backend does not use the compile cache'.format(self.backend.name))
+        testdir = os.path.join(self.common_test_dir, '5 linkstatic')
+        env = get_fake_env(testdir, self.builddir, self.prefix)
+        if env.detect_c_compiler(False).get_argument_syntax() != 'gcc':
+            raise unittest.SkipTest('Compile cache needs a GCC-like compiler')
+        from mesonbuild.scripts import cachedcompile
+        with tempfile.TemporaryDirectory() as d, \
+                mock.patch.dict(os.environ, {'MESON_CACHE_DIR': d}):
+            cachedir = cachedcompile.get_cache_dir()
+            self.init(testdir, extra_args=['-Dcompile_cache=true'])
+            self.build()
+            stats = cachedcompile.get_stats(cachedir)
+            self.assertEqual(stats['hits'], 0)
+            self.assertEqual(stats['misses'], 5)
+            self.assertEqual(stats['entries'], 5)
+            self.new_builddir()
+            self.init(testdir, extra_args=['-Dcompile_cache=true'])
+            self.build()
+            self.run_tests()
+            stats = cachedcompile.get_stats(cachedir)
+            self.assertEqual(stats['hits'], 5)
+            self.assertEqual(stats['misses'], 5)
+            out = self._run(self.meson_command + ['--internal', 'cachedcompile', '--stats'])
+            self.assertIn('50.0%', out)
+            # A changed argument is a different entry
+            self.new_builddir()
+            self.init(testdir, extra_args=['-Dcompile_cache=true', '-Dc_args=-DFOO'])
+            self.build()
+            self.assertEqual(cachedcompile.get_stats(cachedir)['entries'], 10)
+
+    def test_compile_cache_pch(self):
+        '''
+        Test that editing a precompiled header recompiles the sources that
+        use it instead of restoring their stale objects.
+        '''
+        if self.backend is not Backend.ninja:
+            raise unittest.SkipTest('{!r} backend does not use the compile cache'.format(self.backend.name))
+        env = get_fake_env(self.builddir, self.builddir, self.prefix)
+        if env.detect_c_compiler(False).get_argument_syntax() != 'gcc':
+            raise unittest.SkipTest('Compile cache needs a GCC-like compiler')
+        with tempfile.TemporaryDirectory() as d, \
+                mock.patch.dict(os.environ, {'MESON_CACHE_DIR': d}):
+            testdir = os.path.join(d, 'src')
+            shutil.copytree(os.path.join(self.unit_test_dir, '61 pch cache'), testdir)
+            self.init(testdir, extra_args=['-Dcompile_cache=true'])
+            self.build()
+            self.run_tests()
+            header = os.path.join(testdir, 'pch', 'prog.h')
+            with open(header) as f:
+                contents = f.read()
+            with open(header, 'w') as f:
+                f.write(contents.replace('return 0;', 'return 1;'))
+            self.build()
+            with self.assertRaises(subprocess.CalledProcessError):
+                self.run_tests()
+            from mesonbuild.scripts import cachedcompile
+            self.assertEqual(cachedcompile.get_stats(cachedcompile.get_cache_dir())['hits'], 0)
+
+    def test_cache_custom_targets(self):
+        if self.backend is not Backend.ninja:
+            raise unittest.SkipTest('{!r} backend does not use the compile cache'.format(self.backend.name))
+        testdir = os.path.join(self.common_test_dir, '145 custom target multiple outputs')
+        from mesonbuild.scripts import cachedcompile
+        with tempfile.TemporaryDirectory() as d, \
+                mock.patch.dict(os.environ, {'MESON_CACHE_DIR': d}):
+            cachedir = cachedcompile.get_cache_dir()
+            self.init(testdir, extra_args=['-Dcache_custom_targets=true'])
+            self.build()
+            stats = cachedcompile.get_stats(cachedir)
+            self.assertEqual(stats['hits'], 0)
+            self.assertGreater(stats['misses'], 0)
+            self.new_builddir()
+            self.init(testdir, extra_args=['-Dcache_custom_targets=true'])
+            self.build()
+            self.assertEqual(cachedcompile.get_stats(cachedir)['hits'], stats['misses'])
+            for f in ('diff.h', 'diff.sh', 'second.h', 'second.sh'):
+                self.assertPathExists(os.path.join(self.builddir, f))
+
+    @unittest.skipIf(not hasattr(socket, 'AF_UNIX'), 'Unix sockets not available')
+    def test_compile_cache_daemon(self):
+        '''
+        Test that a claim on a key makes other claims on it wait until it is
+        given up, and that they are hits if the outputs were stored.
+        '''
+        from mesonbuild.scripts import cachedaemon, cachedcompile
+        with tempfile.TemporaryDirectory() as d, \
+                mock.patch.dict(os.environ, {'MESON_CACHE_DIR': d}):
+            cachedir = cachedcompile.get_cache_dir()
+
+            def wait_for_waits(count):
+                for _ in range(200):
+                    with cachedaemon.connect(cachedir) as sock:
+                        if cachedaemon.request(sock, {'op': 'stats'})['waits'] == count:
+                            return
+                    time.sleep(0.05)
+                self.fail('Claim did not wait')
+            self._run(self.meson_command + ['--internal', 'cachedaemon', '--idle-timeout', '60'])
+            try:
+                key = 'ab' * 32
+                first = cachedaemon.claim(cachedir, key)
+                self.assertIsNotNone(first)
+                results = []
+                waiter = threading.Thread(target=lambda: results.append(cachedaemon.claim(cachedir, key)))
+                waiter.start()
+                wait_for_waits(1)
+                self.assertTrue(waiter.is_alive())
+                os.makedirs(os.path.join(cachedir, key[:2], key))
+                first.close()
+                waiter.join(10)
+                self.assertEqual(results, [None])
+                # A claim that is given up without storing anything passes on
+                other = 'cd' * 32
+                first = cachedaemon.claim(cachedir, other)
+                waiter = threading.Thread(target=lambda: results.append(cachedaemon.claim(cachedir, other)))
+                waiter.start()
+                wait_for_waits(2)
+                first.close()
+                waiter.join(10)
+                self.assertIsNotNone(results[-1])
+                results[-1].close()
+                out = self._run(self.meson_command + ['--internal', 'cachedaemon', '--status'])
+                self.assertIn('Waits:   2', out)
+            finally:
+                self._run(self.meson_command + ['--internal', 'cachedaemon', '--stop'])
+
     def test_warning_location(self):
         tdir = os.path.join(self.unit_test_dir, '22 warning location')
         out = self.init(tdir)
@@ -3014,6 +3967,18 @@ recommended as it is not supported on some platforms''')
         self.assertRegex(out, "WARNING: Project specifies a minimum meson_version '>=0.45'")
         self.assertRegex(out, " * 0.47.0: {'dict'}")
 
+    def test_feature_check_usage_inprocess(self):
+        '''
+        Test that each configure run in the same process warns about the
+        features a project uses, once.
+        '''
+        testdir = os.path.join(self.unit_test_dir, '41 featurenew subprojects')
+        for _ in range(2):
+            self.new_builddir()
+            out = self.init(testdir, inprocess=True)
+            self.assertEqual(len(re.findall(r"WARNING: Project targetting '>=0.45'.*'0.47.0': dict", out)), 1)
+            self.assertEqual(len(re.findall(r"\|WARNING: Project targetting '>=0.40'.*'0.44.0': disabler", out)), 1)
+
     def test_configure_file_warnings(self):
         testdir = os.path.join(self.common_test_dir, "14 configure file")
         out = self.init(testdir)
@@ -4120,6 +5085,73 @@ class LinuxlikeTests(BasePlatformTests):
         self.assertEqual(foo_dep.get_pkgconfig_variable('foo', {}), 'bar')
         self.assertPathEqual(foo_dep.get_pkgconfig_variable('datadir', {}), '/usr/data')
 
+    def test_pkgconfig_gen_builtin_impl(self):
+        '''
+        Test that the builtin pkg-config implementation gives the same results
+        as the pkg-config executable for generated pkg-config files.
+        '''
+        testdir = os.path.join(self.common_test_dir, '48 pkgconfig-gen')
+        self.init(testdir)
+        os.environ['PKG_CONFIG_LIBDIR'] = self.privatedir
+        # Results of earlier in-process lookups don't know about the new PKG_CONFIG_LIBDIR
+        clear_meson_configure_class_caches()
+        kwargs = {'required': True, 'silent': True}
+        env = get_fake_env(testdir, self.builddir, self.prefix)
+        ext_dep = PkgConfigDependency('libfoo', env, kwargs)
+        env = get_fake_env(testdir, self.builddir, self.prefix)
+        env.coredata.builtins['pkg_config_impl'].set_value('builtin')
+        foo_dep = PkgConfigDependency('libfoo', env, kwargs)
+        self.assertTrue(foo_dep.found())
+        self.assertIsNone(foo_dep.pkgbin)
+        self.assertEqual(foo_dep.get_version(), ext_dep.get_version())
+        self.assertEqual(foo_dep.get_compile_args(), ext_dep.get_compile_args())
+        self.assertEqual(foo_dep.get_link_args(), ext_dep.get_link_args())
+        self.assertEqual(foo_dep.get_pkgconfig_variable('foo', {}), 'bar')
+        self.assertPathEqual(foo_dep.get_pkgconfig_variable('datadir', {}), '/usr/data')
+        kwargs = {'required': False, 'silent': True}
+        self.assertFalse(PkgConfigDependency('libnotthere', env, kwargs).found())
+
+    def test_prefetch_dependencies(self):
+        '''
+        Test that dependencies looked up ahead of time are used and logged
+        like serially looked up ones.
+        '''
+        testdir = os.path.join(self.src_root, 'test cases/linuxlike/1 pkg-config')
+        deps = DependencyCollector(testdir).analyze()
+        self.assertEqual([name for name, kwargs in deps], ['zlib', 'nvakuhrabnsdfasdf'])
+        self.assertEqual(deps[0][1]['version'], '>=1.2')
+        out = self.init(testdir, extra_args=['-Dprefetch_dependencies=true'])
+        self.assertRegex(out, r'Found pkg-config: .*\nDependency zlib found: YES')
+        self.assertIn('Dependency nvakuhrabnsdfasdf found: NO', out)
+        self.build()
+        self.run_tests()
+
+    def test_cmake_disk_cache(self):
+        '''
+        Test that CMake results are reused by new build directories until one
+        of the CMake files they were read from changes.
+        '''
+        if not shutil.which('cmake'):
+            raise unittest.SkipTest('cmake not found')
+        with tempfile.TemporaryDirectory() as d:
+            testdir = os.path.join(d, 'src')
+            shutil.copytree(os.path.join(self.src_root, 'test cases/linuxlike/13 cmake dependency'), testdir)
+            with mock.patch.dict(os.environ, {'MESON_CACHE_DIR': os.path.join(d, 'cache')}):
+                self.init(testdir)
+                self.assertNotIn('Using cached CMake system information', ''.join(self.get_meson_log()))
+                self.new_builddir()
+                self.init(testdir)
+                log = ''.join(self.get_meson_log())
+                self.assertIn('Using cached CMake system information', log)
+                self.assertNotIn('-DNAME=', log)
+                with open(os.path.join(testdir, 'cmake', 'FindSomethingLikeZLIB.cmake'), 'a') as f:
+                    f.write('\n# Changed\n')
+                self.new_builddir()
+                self.init(testdir)
+                log = ''.join(self.get_meson_log())
+                self.assertNotIn('-DNAME=ZLIB', log)
+                self.assertIn('-DNAME=SomethingLikeZLIB', log)
+
     def test_pkgconfig_gen_deps(self):
         '''
         Test that generated pkg-config files correctly handle dependencies
@@ -4313,6 +5345,90 @@ class LinuxlikeTests(BasePlatformTests):
         libdir = self.installdir + os.path.join(self.prefix, self.libdir)
         self._test_soname_impl(libdir, True)
 
+    def test_symbol_extraction(self):
+        '''
+        Test that the symbols files written without running readelf and nm
+        are the same as the ones written with them.
+        '''
+        if not mesonbuild.mesonlib.is_linux():
+            raise unittest.SkipTest('Symbols are only extracted from ELF libraries on Linux')
+        if not shutil.which('readelf') or not shutil.which('nm'):
+            raise unittest.SkipTest('readelf or nm not found')
+        from mesonbuild.scripts import symbolextractor
+        testdir = os.path.join(self.unit_test_dir, '1 soname')
+        self.init(testdir)
+        self.build()
+        libs = [f for f in glob(os.path.join(self.builddir, 'lib*.so*')) if not os.path.islink(f)]
+        self.assertTrue(libs)
+        for lib in libs:
+            builtin = os.path.join(self.builddir, 'builtin.symbols')
+            tools = os.path.join(self.builddir, 'tools.symbols')
+            symbolextractor.linux_syms(lib, builtin)
+            with mock.patch.dict(os.environ, {'NM': 'nm', 'LC_ALL': 'C'}):
+                symbolextractor.linux_syms(lib, tools)
+            with open(builtin) as f1, open(tools) as f2:
+                self.assertEqual(f1.read(), f2.read())
+
+    def test_depfixer(self):
+        '''
+        Test reading and fixing built binaries with depfixer.Elf, also when
+        they are opened read-only or lack a dynamic string table.
+        '''
+        if not mesonbuild.mesonlib.is_linux():
+            raise unittest.SkipTest('depfixer only edits ELF files on Linux here')
+        if not shutil.which('readelf'):
+            raise unittest.SkipTest('readelf not found')
+        from mesonbuild.scripts import depfixer, symbolextractor
+        testdir = os.path.join(self.unit_test_dir, '10 build_rpath')
+        self.init(testdir)
+        self.build()
+        prog = os.path.join(self.builddir, 'prog')
+        lib = os.path.join(self.builddir, 'sub', 'libstuff.so')
+        # Reading files that cannot be written to
+        os.chmod(lib, 0o444)
+        os.chmod(prog, 0o555)
+        with depfixer.Elf(lib, verbose=False, readonly=True) as elf:
+            self.assertEqual(elf.get_soname(), b'libstuff.so')
+            self.assertEqual(elf.get_soname().decode(), get_soname(lib))
+            self.assertIn((b'get_stuff', 'T'), elf.get_exported_symbols())
+        with depfixer.Elf(prog, verbose=False, readonly=True) as elf:
+            self.assertIsNone(elf.get_soname())
+            self.assertEqual(elf.read_str(elf.get_entry_offset(depfixer.DT_RUNPATH)),
+                             b'$ORIGIN/sub:/foo/bar')
+            # A read-only mapping cannot be written to
+            with self.assertRaises(TypeError):
+                elf.fix_rpath('')
+        os.chmod(lib, 0o644)
+        os.chmod(prog, 0o755)
+        # Without a .dynstr section the dynamic entries cannot be read
+        def without_dynstr(fname):
+            with open(fname, 'rb') as f:
+                data = f.read()
+            self.assertEqual(data.count(b'.dynstr\0'), 1)
+            result = os.path.join(self.builddir, 'nodynstr-' + os.path.basename(fname))
+            with open(result, 'wb') as f:
+                f.write(data.replace(b'.dynstr\0', b'.dynstX\0'))
+            return result
+        nodynstr = without_dynstr(lib)
+        with depfixer.Elf(nodynstr, verbose=False, readonly=True) as elf:
+            with self.assertRaises(RuntimeError):
+                elf.get_soname()
+        self.assertIsNone(symbolextractor.elf_syms(nodynstr))
+        nodynstr = without_dynstr(prog)
+        with depfixer.Elf(nodynstr, verbose=False, readonly=True) as elf:
+            with self.assertRaises(RuntimeError):
+                elf.print_deps()
+        with self.assertRaises(RuntimeError):
+            depfixer.fix_rpath(nodynstr, '', None, {}, verbose=False)
+        # Shortening and then removing the rpath
+        self.assertEqual(get_rpath(prog), '$ORIGIN/sub:/foo/bar')
+        depfixer.fix_rpath(prog, '/foo', None, {}, verbose=False)
+        self.assertEqual(get_rpath(prog), '/foo')
+        with self.assertRaises(SystemExit):
+            depfixer.fix_rpath(prog, '/foo/bar/baz', None, {}, verbose=False)
+        depfixer.fix_rpath(prog, '', None, {}, verbose=False)
+        self.assertIsNone(get_rpath(prog))
+
     def test_compiler_check_flags_order(self):
         '''
         Test that compiler check flags override all other flags. This can't be
@@ -4407,6 +5523,111 @@ class LinuxlikeTests(BasePlatformTests):
         self.assertPathDoesNotExist(os.path.join(self.builddir, 'user@exe/user-unity.c'))
         self.build()
 
+    def test_unity_size(self):
+        testdir = os.path.join(self.unit_test_dir, '59 unity size')
+        self.init(testdir, extra_args=['--unity=on', '-Dunity_size=2'])
+        private_dir = os.path.join(self.builddir, 'prog@exe')
+
+        def get_chunks(pattern='prog-unity-*.c'):
+            chunks = {}
+            for f in glob(os.path.join(private_dir, pattern)):
+                with open(f) as ifile:
+                    chunks[os.path.basename(f)] = ifile.read()
+            return chunks
+        chunks = get_chunks()
+        self.assertGreater(len(chunks), 1)
+        self.assertPathDoesNotExist(os.path.join(private_dir, 'prog-unity.c'))
+        # Every source is in exactly one chunk
+        included = ''.join(chunks.values())
+        for src in ['prog.c'] + ['f{}.c'.format(i) for i in range(1, 9)]:
+            self.assertEqual(included.count(os.sep + src + '>'), 1, src)
+        self.build()
+        self.run_tests()
+        # Chunks are stable across regenerations
+        self.utime(os.path.join(testdir, 'meson.build'))
+        self.build()
+        self.assertEqual(get_chunks(), chunks)
+        # Balancing by size or time still includes every source once, the
+        # sources are small enough to all go in one unity file
+        for balance in ('size', 'time'):
+            self.setconf('-Dunity_balance=' + balance)
+            self.build()
+            included = ''.join(get_chunks('prog-unity*.c').values())
+            for src in ['prog.c'] + ['f{}.c'.format(i) for i in range(1, 9)]:
+                self.assertEqual(included.count(os.sep + src + '>'), 1, src)
+        # Without unity_size there is one unity file again
+        self.setconf('-Dunity_size=0')
+        self.build()
+        self.assertPathExists(os.path.join(private_dir, 'prog-unity.c'))
+        self.assertEqual(get_chunks(), {})
+
+    def test_unity_size_add_source(self):
+        '''
+        Test that adding a source to a target split into unity files only
+        changes the chunks around it, even when balancing by size and the
+        new source is much larger than the others.
+        '''
+        with tempfile.TemporaryDirectory() as testdir:
+            names = ['f{}'.format(i) for i in range(1, 25)]
+
+            def write_project(names):
+                with open(os.path.join(testdir, 'meson.build'), 'w') as f:
+                    f.write("project('unity add source', 'c')\n")
+                    f.write("static_library('lib', {})\n".format([n + '.c' for n in names]))
+                for n in names:
+                    with open(os.path.join(testdir, n + '.c'), 'w') as f:
+                        # The large source is about as big as all the others
+                        padding = 24 if n == 'large' else 1
+                        f.write('/*' + ' ' * 4000 * padding + '*/\nint {}(void) {{ return 0; }}\n'.format(n))
+
+            def get_chunks():
+                chunks = {}
+                for f in glob(os.path.join(self.builddir, 'lib@sta', 'lib-unity-*.c')):
+                    with open(f) as ifile:
+                        members = re.findall(r'([^\\/]+)\.c>', ifile.read())
+                    chunks[os.path.basename(f)] = members
+                return chunks
+
+            for balance in ('count', 'size'):
+                write_project(names)
+                self.init(testdir, extra_args=['--unity=on', '-Dunity_size=3', '-Dunity_balance=' + balance])
+                old_chunks = get_chunks()
+                self.assertGreater(len(old_chunks), 3)
+                self.new_builddir()
+                write_project(names[:12] + ['large'] + names[12:])
+                self.init(testdir, extra_args=['--unity=on', '-Dunity_size=3', '-Dunity_balance=' + balance])
+                new_chunks = get_chunks()
+                self.new_builddir()
+                # Only the chunk the new source is in and the one after it
+                # can change
+                changed = [name for name, members in old_chunks.items() if new_chunks.get(name) != members]
+                self.assertLessEqual(len(changed), 2, (balance, old_chunks, new_chunks))
+                self.assertEqual(sorted(sum(new_chunks.values(), [])), sorted(names + ['large']))
+
+    @skip_if_not_base_option('b_pch_auto')
+    def test_auto_pch(self):
+        testdir = os.path.join(self.unit_test_dir, '60 auto pch')
+        self.init(testdir, extra_args=['-Db_pch_auto=true'])
+        header = os.path.join(self.builddir, 'prog@exe', 'meson_auto_pch-c.h')
+        with open(header) as f:
+            # stdlib.h and stdint.h are only included by one source each
+            self.assertEqual(f.read(), '#include <stdio.h>\n#include <string.h>\n')
+        # defines.c starts with a #define, so its target gets none
+        self.assertPathDoesNotExist(os.path.join(self.builddir, 'defines@exe', 'meson_auto_pch-c.h'))
+        # Neither does config.c, which includes config.h before the system headers
+        self.assertPathDoesNotExist(os.path.join(self.builddir, 'config@exe', 'meson_auto_pch-c.h'))
+        self.build()
+        self.run_tests()
+        for cmd in self.get_compdb():
+            if 'prog@exe' in cmd['command']:
+                self.assertIn('meson_auto_pch-c.h', cmd['command'])
+            else:
+                self.assertNotIn('meson_auto_pch-c.h', cmd['command'])
+        self.setconf('-Db_pch_auto=false')
+        self.build()
+        for cmd in self.get_compdb():
+            self.assertNotIn('meson_auto_pch-c.h', cmd['command'])
+
     def test_installed_modes(self):
         '''
         Test that files installed by these tests have the correct permissions.
@@ -4618,6 +5839,33 @@ class LinuxlikeTests(BasePlatformTests):
         for v in installed.values():
             self.assertTrue('prog' in v or 'foo' in v)
 
+    @skipIfNoPkgconfig
+    def test_pkgconfig_disk_cache(self):
+        '''
+        Test that the results of the pkg-config executable are only cached
+        in the user cache directory when enabled, and are not reused once a
+        .pc file changed.
+        '''
+        with tempfile.TemporaryDirectory() as d:
+            testdir = os.path.join(d, 'src')
+            shutil.copytree(os.path.join(self.unit_test_dir, '8 -L -l order'), testdir)
+            env = {'MESON_CACHE_DIR': os.path.join(d, 'cache'), 'PKG_CONFIG_PATH': testdir}
+            with mock.patch.dict(os.environ, env):
+                cached = []
+                for enabled in ('false', 'false', 'true', 'true'):
+                    self.new_builddir()
+                    self.init(testdir, extra_args=['-Dpkg_config_cache=' + enabled])
+                    log = ''.join(self.get_meson_log())
+                    cached.append('Using cached `pkg-config --modversion first`' in log)
+                self.assertEqual(cached, [False, False, False, True])
+                with open(os.path.join(testdir, 'first.pc'), 'a') as f:
+                    f.write('\n')
+                self.new_builddir()
+                self.init(testdir, extra_args=['-Dpkg_config_cache=true'])
+                log = ''.join(self.get_meson_log())
+                self.assertNotIn('Using cached `pkg-config --modversion first`', log)
+                self.assertIn('Using cached `pkg-config --modversion second`', log)
+
     @skipIfNoPkgconfig
     def test_order_of_l_arguments(self):
         testdir = os.path.join(self.unit_test_dir, '8 -L -l order')
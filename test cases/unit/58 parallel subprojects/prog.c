@@ -0,0 +1,7 @@
+int a_func(void);
+int b_func(void);
+int c_func(void);
+
+int main(void) {
+    return a_func() + b_func() + c_func() == 6 ? 0 : 1;
+}
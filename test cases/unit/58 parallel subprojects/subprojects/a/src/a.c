@@ -0,0 +1,3 @@
+int a_func(void) {
+    return 1;
+}
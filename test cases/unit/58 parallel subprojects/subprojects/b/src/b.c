@@ -0,0 +1,3 @@
+int b_func(void) {
+    return 2;
+}
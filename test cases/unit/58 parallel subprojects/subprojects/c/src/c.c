@@ -0,0 +1,3 @@
+int c_func(void) {
+    return 3;
+}
@@ -0,0 +1,3 @@
+int f1(void) {
+    return 1;
+}
@@ -0,0 +1,3 @@
+int f2(void) {
+    return 2;
+}
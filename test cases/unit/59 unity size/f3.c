@@ -0,0 +1,3 @@
+int f3(void) {
+    return 3;
+}
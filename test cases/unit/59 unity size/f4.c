@@ -0,0 +1,3 @@
+int f4(void) {
+    return 4;
+}
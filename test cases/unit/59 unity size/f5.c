@@ -0,0 +1,3 @@
+int f5(void) {
+    return 5;
+}
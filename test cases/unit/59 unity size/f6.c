@@ -0,0 +1,3 @@
+int f6(void) {
+    return 6;
+}
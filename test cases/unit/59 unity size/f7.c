@@ -0,0 +1,3 @@
+int f7(void) {
+    return 7;
+}
@@ -0,0 +1,3 @@
+int f8(void) {
+    return 8;
+}
@@ -0,0 +1,12 @@
+int f1(void);
+int f2(void);
+int f3(void);
+int f4(void);
+int f5(void);
+int f6(void);
+int f7(void);
+int f8(void);
+
+int main(void) {
+    return f1() + f2() + f3() + f4() + f5() + f6() + f7() + f8() == 36 ? 0 : 1;
+}
@@ -0,0 +1,10 @@
+#include "config.h"
+#include <stdio.h>
+#include <string.h>
+
+int lib_function(void);
+int util_function(void);
+
+int main(void) {
+    return lib_function() + util_function();
+}
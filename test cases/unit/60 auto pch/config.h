@@ -0,0 +1 @@
+#define _GNU_SOURCE
@@ -0,0 +1,10 @@
+#define _GNU_SOURCE
+#include <stdio.h>
+#include <string.h>
+
+int lib_function(void);
+int util_function(void);
+
+int main(void) {
+    return lib_function() + util_function();
+}
@@ -0,0 +1,7 @@
+#include <stdio.h>
+#include <string.h>
+#include <stdlib.h>
+
+int lib_function(void) {
+    return strcmp("a", "a");
+}
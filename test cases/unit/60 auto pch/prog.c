@@ -0,0 +1,11 @@
+/* The headers below are used by most sources */
+#include <stdio.h>
+#include <string.h>
+
+int lib_function(void);
+int util_function(void);
+
+int main(void) {
+    printf("%d\n", (int)strlen("hello"));
+    return lib_function() + util_function();
+}
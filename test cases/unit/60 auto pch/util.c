@@ -0,0 +1,7 @@
+#include <stdio.h> // needed for puts
+#include <stdint.h>
+
+int util_function(void) {
+    puts("util");
+    return (int)(uint8_t)256;
+}
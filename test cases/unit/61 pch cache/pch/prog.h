@@ -0,0 +1,3 @@
+static inline int value(void) {
+    return 0;
+}
@@ -0,0 +1,5 @@
+// value() comes from the precompiled header
+
+int main(void) {
+    return value();
+}
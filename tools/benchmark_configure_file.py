@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 The Meson development team
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Measures how long configure_file() takes to fill in a large template.
+
+A template of the given size is generated with a mix of plain text,
+template variables and #mesondefine lines, and filled in twice per run:
+once into a new output file and once more when the output would not
+change, which is what happens when a project is reconfigured.
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mesonbuild import mesonlib  # noqa: E402
+
+def make_template(size, variables):
+    lines = []
+    total = 0
+    i = 0
+    while total < size:
+        if i % 4 == 0:
+            line = '#mesondefine VAR{}\n'.format(i % variables)
+        else:
+            line = 'static const char *str{} = "@VAR{}@";\n'.format(i, i % variables)
+        lines.append(line)
+        total += len(line)
+        i += 1
+    return ''.join(lines)
+
+def run(template, confdata, repeat):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = os.path.join(tmpdir, 'config.h.in')
+        dst = os.path.join(tmpdir, 'config.h')
+        with open(src, 'w', encoding='utf-8') as f:
+            f.write(template)
+        best_new = best_same = None
+        for _ in range(repeat):
+            if os.path.exists(dst):
+                os.unlink(dst)
+            start = time.perf_counter()
+            mesonlib.do_conf_file(src, dst, confdata, 'meson')
+            elapsed_new = time.perf_counter() - start
+            start = time.perf_counter()
+            mesonlib.do_conf_file(src, dst, confdata, 'meson')
+            elapsed_same = time.perf_counter() - start
+            if best_new is None or elapsed_new < best_new:
+                best_new = elapsed_new
+            if best_same is None or elapsed_same < best_same:
+                best_same = elapsed_same
+        return best_new, best_same
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=float, default=4,
+                        help='Size of the template in MiB.')
+    parser.add_argument('--variables', type=int, default=1000,
+                        help='How many configuration values to use.')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='How many times to run, the best time is reported.')
+    options = parser.parse_args()
+    template = make_template(int(options.size * 1024 * 1024), options.variables)
+    confdata = {'VAR{}'.format(i): ('value{}'.format(i), '') for i in range(options.variables)}
+    best_new, best_same = run(template, confdata, options.repeat)
+    print('{:.1f} MiB template: {:.2f} ms, {:.2f} ms when unchanged'.format(
+        len(template) / (1024 * 1024), best_new * 1000, best_same * 1000))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
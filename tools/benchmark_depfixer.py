@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 The Meson development team
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Measures how long depfixer takes to fix the rpaths of ELF files.
+
+Every file given on the command line, or by default the largest shared
+libraries in the system library directories, is copied to a temporary
+directory and has its rpath removed the same way "meson install" does.
+The copies are made before the timing starts, so only depfixer is timed.
+'''
+
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mesonbuild.scripts import depfixer  # noqa: E402
+
+def default_files(count):
+    files = set()
+    for pattern in ('/usr/lib*/*.so*', '/usr/lib*/*/*.so*'):
+        for f in glob.glob(pattern):
+            if os.path.isfile(f) and not os.path.islink(f):
+                files.add(f)
+    return sorted(files, key=os.path.getsize, reverse=True)[:count]
+
+def run(files, repeat):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        best = None
+        for _ in range(repeat):
+            copies = []
+            for i, f in enumerate(files):
+                copy = os.path.join(tmpdir, '{}-{}'.format(i, os.path.basename(f)))
+                shutil.copyfile(f, copy)
+                copies.append(copy)
+            start = time.perf_counter()
+            for copy in copies:
+                depfixer.fix_rpath(copy, '', copy, None, verbose=False)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('files', nargs='*',
+                        help='ELF files to fix (default: the largest system shared libraries)')
+    parser.add_argument('--count', type=int, default=20,
+                        help='How many system libraries to use when no files are given.')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='How many times to run, the best time is reported.')
+    options = parser.parse_args()
+    files = options.files or default_files(options.count)
+    if not files:
+        sys.exit('No ELF files found.')
+    size = sum(os.path.getsize(f) for f in files)
+    best = run(files, options.repeat)
+    print('{} files, {:.1f} MiB: {:.2f} ms, {:.3f} ms per file'.format(
+        len(files), size / (1024 * 1024), best * 1000, best * 1000 / len(files)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 The Meson development team
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Measures how long the Ninja backend takes to write generator rules.
+
+A project is created in a temporary directory with a generator that
+writes a source file and a dependency file for each of its inputs, like
+IDL compilers do, and is configured in-process. Only the time spent writing the build
+rules of the generated files is reported, next to the whole setup time.
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mesonbuild import mesonmain  # noqa: E402
+from mesonbuild.backend import ninjabackend  # noqa: E402
+
+meson_build = '''gen = generator(find_program('gen.py'),
+  output : '@BASENAME@.c',
+  depfile : '@BASENAME@.d',
+  arguments : ['@INPUT@', '--output=@OUTPUT@', '--depfile=@DEPFILE@',
+               '-I@CURRENT_SOURCE_DIR@', '--name=@PLAINNAME@', '@EXTRA_ARGS@'])
+
+executable('prog', gen.process(files(inputs), extra_args : ['--verbose']))
+'''
+
+def make_project(srcdir, count):
+    with open(os.path.join(srcdir, 'gen.py'), 'w') as f:
+        f.write('#!/usr/bin/env python3\n')
+    os.chmod(os.path.join(srcdir, 'gen.py'), 0o755)
+    os.mkdir(os.path.join(srcdir, 'idl'))
+    inputs = []
+    for i in range(count):
+        name = 'idl/file{}.idl'.format(i)
+        open(os.path.join(srcdir, name), 'w').close()
+        inputs.append(name)
+    with open(os.path.join(srcdir, 'meson.build'), 'w') as f:
+        f.write("project('generator benchmark', 'c')\n\n")
+        f.write('inputs = [\n')
+        f.write(''.join("  '{}',\n".format(i) for i in inputs))
+        f.write(']\n\n')
+        f.write(meson_build)
+
+def run(srcdir, builddir):
+    elapsed = 0
+    generate = ninjabackend.NinjaBackend.generate_genlist_for_target
+
+    def timed(*args, **kwargs):
+        nonlocal elapsed
+        start = time.perf_counter()
+        try:
+            return generate(*args, **kwargs)
+        finally:
+            elapsed += time.perf_counter() - start
+
+    ninjabackend.NinjaBackend.generate_genlist_for_target = timed
+    try:
+        start = time.perf_counter()
+        if mesonmain.run(['setup', srcdir, builddir], sys.argv[0]) != 0:
+            sys.exit('Configuring the project failed.')
+        return elapsed, time.perf_counter() - start
+    finally:
+        ninjabackend.NinjaBackend.generate_genlist_for_target = generate
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--outputs', type=int, default=50000,
+                        help='How many source files the generator writes.')
+    options = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        srcdir = os.path.join(tmpdir, 'src')
+        os.mkdir(srcdir)
+        make_project(srcdir, options.outputs)
+        generator_time, setup_time = run(srcdir, os.path.join(tmpdir, 'build'))
+    print('{} generator outputs: {:.2f} s writing generator rules, {:.2f} s setup'.format(
+        options.outputs, generator_time, setup_time))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
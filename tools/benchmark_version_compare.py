@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 The Meson development team
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Measures how long version comparisons take.
+
+Each case is run the given number of times with the versions that
+configuring a project compares most often: the Meson version against
+feature versions, and dependency versions against their requirements.
+The best of a few runs is reported per call.
+'''
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mesonbuild import mesonlib  # noqa: E402
+
+feature_versions = ['0.40.0', '0.44.0', '0.46.0', '0.47.0', '0.48.0', '0.49.0', '0.50.0']
+dependency_versions = ['2.58.3', '1.2.11', '3.24.5', '1.16.0', '7.64.0']
+requirements = ['>=2.40', '>= 1.2.8', '<4.0', '!=3.0.0', '==1.16.0']
+
+cases = [
+    ('Version()', lambda: [mesonlib.Version(v) for v in feature_versions]),
+    ('Version < Version', lambda: [a < b for a, b in version_pairs]),
+    ('version_compare(feature)',
+     lambda: [mesonlib.version_compare('0.50.999', '>=' + v) for v in feature_versions]),
+    ('version_compare(dependency)',
+     lambda: [mesonlib.version_compare(v, r) for v in dependency_versions for r in requirements]),
+    ('version_compare_many()',
+     lambda: [mesonlib.version_compare_many(v, requirements) for v in dependency_versions]),
+]
+
+version_pairs = [(mesonlib.Version(a), mesonlib.Version(b))
+                 for a in feature_versions for b in feature_versions]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--number', type=int, default=10000,
+                        help='How many times to run each case.')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='How many times to measure, the best time is reported.')
+    options = parser.parse_args()
+    for name, func in cases:
+        calls = len(func())
+        best = min(timeit.repeat(func, number=options.number, repeat=options.repeat))
+        print('{:30} {:8.3f} us per call'.format(name, best * 1e6 / (options.number * calls)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())